@@ -0,0 +1,492 @@
+"""Microbenchmarks for the core toycoin primitives.
+
+Each benchmark is timed over a growing input size (leaf count, chain length,
+difficulty etc.), so the output reads as a scaling curve. Results are saved
+as JSON, and a previous results file can be passed in to compare commits.
+
+Run from the blockchain directory:
+
+    python -m benchmarks.core --out bench.json
+    python -m benchmarks.core --compare bench.json --out bench2.json
+"""
+
+
+import argparse # type: ignore
+import contextlib # type: ignore
+import json # type: ignore
+import platform # type: ignore
+import statistics # type: ignore
+import subprocess # type: ignore
+import time # type: ignore
+from concurrent.futures import ProcessPoolExecutor # type: ignore
+from tests import helpers # type: ignore
+from toycoin import block, hash, merkle, signature, transaction, wallet # type: ignore
+from toycoin.network import blocktree, serialize # type: ignore
+from typing import Callable, Dict, Iterator, List, Optional # type: ignore
+
+
+################################################################################
+
+
+Result = Dict[str, float]
+Results = Dict[str, List[Result]]
+
+LEAF_COUNTS = [16, 64, 256, 1024, 4096]
+CHAIN_LENGTHS = [4, 16, 64, 256, 1024]
+TARGET_BITS = [1, 4, 8, 12, 16] # leading zero bits required by target
+MSG_SIZES = [64, 1024, 16384, 262144]
+
+
+################################################################################
+# Timing
+
+
+def measure(f: Callable[[], object],
+            repeat: int = 5,
+            number: int = 1
+            ) -> Result:
+    """Time f over repeat rounds of number calls each.
+    Returns per-call median and best times in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        times.append((time.perf_counter() - start) / number)
+
+    return {'median': statistics.median(times),
+            'best': min(times)}
+
+
+def auto_number(f: Callable[[], object], min_time: float = 0.05) -> int:
+    """Find a call count that makes one round take at least min_time."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        if time.perf_counter() - start >= min_time or number >= 1_000_000:
+            return number
+        number *= 4
+
+
+def run_curve(name: str,
+              sizes: List[int],
+              setup: Callable[[int], Callable[[], object]],
+              repeat: int,
+              results: Results):
+    """Time the callable built by setup(n) for each n in sizes."""
+    curve = []
+    for n in sizes:
+        f = setup(n)
+        r = measure(f, repeat, auto_number(f))
+        r['n'] = n
+        curve.append(r)
+        print(f'{name:<28} n={n:<8} median={fmt_time(r["median"]):>10} '
+              f'best={fmt_time(r["best"]):>10}')
+    results[name] = curve
+
+
+################################################################################
+# Fixtures
+
+
+@contextlib.contextmanager
+def fixed_target(target: block.Target) -> Iterator[None]:
+    """Temporarily pin block target, so long chains can be mined quickly.
+    Validation work per block does not depend on the target.
+    """
+    original = block.expected_targets
+    block.expected_targets = lambda headers, interval=None: (
+        [target] * (len(headers) + 1))
+    try:
+        yield
+    finally:
+        block.expected_targets = original
+
+
+def gen_wallet() -> wallet.Wallet:
+    """Generate wallet."""
+    priv_key = signature.gen_priv_key()
+    pub_key = signature.get_pub_key_bytes(priv_key)
+    return wallet.Wallet(pub_key, priv_key)
+
+
+def coinbase_txn(receiver: bytes, value: int) -> transaction.Transaction:
+    """Coinbase transaction paying value to receiver."""
+    return {'previous_hashes': [],
+            'receiver': receiver,
+            'receiver_value': value,
+            'receiver_signature': b'',
+            'sender': transaction.COINBASE,
+            'sender_change': 0,
+            'sender_signature': b''
+            }
+
+
+def gen_txns(n: int) -> List[transaction.Transaction]:
+    """Generate n signed transactions between two wallets."""
+    a_wallet, b_wallet = gen_wallet(), gen_wallet()
+    a_wallet.receive(coinbase_txn(a_wallet.public_key, n))
+
+    txns = []
+    for _ in range(n):
+        pair = a_wallet.send(1, b_wallet.public_key)
+        assert pair is not None
+        _, txn = pair
+        a_wallet.confirm_send(transaction.hash_txn(txn))
+        a_wallet.receive(txn)
+        txns.append(txn)
+    return txns
+
+
+def gen_chain(length: int,
+              txns: List[transaction.Transaction]
+              ) -> block.Blockchain:
+    """Mine a chain of given length, cycling through txns (2 per block).
+    Blocks are timestamped one interval apart, ending now.
+    """
+    return helpers.gen_chain(length, txns=txns)
+
+
+################################################################################
+# Benchmarks
+
+
+def bench_hash(results: Results, repeat: int):
+    """hash.hash vs message size."""
+    def setup(n: int) -> Callable[[], object]:
+        msg = bytes(n)
+        return lambda: hash.hash(msg)
+
+    run_curve('hash.hash', MSG_SIZES, setup, repeat, results)
+
+
+def bench_merkle(results: Results, repeat: int):
+    """merkle.from_list, merkle.root (serial and parallel),
+    merkle.MerkleFrontier and merkle.contains vs leaf count.
+    """
+    def leaves(n: int) -> List[hash.Hash]:
+        return [hash.hash(str(i).encode()) for i in range(n)]
+
+    def setup_from_list(n: int) -> Callable[[], object]:
+        ls = leaves(n)
+        return lambda: merkle.from_list(ls)
+
+    def setup_root(n: int) -> Callable[[], object]:
+        ls = leaves(n)
+        return lambda: merkle.root(ls)
+
+    def setup_root_parallel(n: int) -> Callable[[], object]:
+        # parallel at every size, to find where it pays off
+        ls = leaves(n)
+        return lambda: merkle.root_parallel(ls, executor, parallel_min=0)
+
+    def setup_frontier(n: int) -> Callable[[], object]:
+        ls = leaves(n)
+        return lambda: merkle.MerkleFrontier(ls).root()
+
+    def setup_contains(n: int) -> Callable[[], object]:
+        ls = leaves(n)
+        tree = merkle.from_list(ls)
+        assert tree is not None
+        return lambda: merkle.contains(tree, ls[n // 2])
+
+    run_curve('merkle.from_list', LEAF_COUNTS, setup_from_list, repeat, results)
+    run_curve('merkle.root', LEAF_COUNTS, setup_root, repeat, results)
+    with ProcessPoolExecutor() as executor:
+        run_curve('merkle.root_parallel', LEAF_COUNTS,
+                  setup_root_parallel, repeat, results)
+    run_curve('merkle.MerkleFrontier', LEAF_COUNTS,
+              setup_frontier, repeat, results)
+    run_curve('merkle.contains', LEAF_COUNTS, setup_contains, repeat, results)
+
+
+def bench_proof_of_work(results: Results, repeat: int):
+    """block.proof_of_work vs target bits (mean over many roots)."""
+    def setup(bits: int) -> Callable[[], object]:
+        roots = iter(hash.hash(str(i).encode()) for i in range(10 ** 9))
+        target = 2 ** (block.HASH_BITS - bits)
+        return lambda: block.proof_of_work(block.GENESIS, next(roots), target)
+
+    run_curve('block.proof_of_work', TARGET_BITS, setup, repeat, results)
+
+
+def bench_signature(results: Results, repeat: int):
+    """signature.sign and signature.verify vs message size."""
+    priv_key = signature.gen_priv_key()
+    pub_key = signature.get_pub_key(priv_key)
+
+    def setup_sign(n: int) -> Callable[[], object]:
+        msg = bytes(n)
+        return lambda: signature.sign(priv_key, msg)
+
+    def setup_verify(n: int) -> Callable[[], object]:
+        msg = bytes(n)
+        sig = signature.sign(priv_key, msg)
+        return lambda: signature.verify(sig, pub_key, msg)
+
+    run_curve('signature.sign', MSG_SIZES, setup_sign, repeat, results)
+    run_curve('signature.verify', MSG_SIZES, setup_verify, repeat, results)
+
+
+def bench_serialize(results: Results,
+                    repeat: int,
+                    txns: List[transaction.Transaction],
+                    chains: Dict[int, block.Blockchain]):
+    """serialize pack/unpack of txn pairs and chains."""
+    def setup_pack_txns(n: int) -> Callable[[], object]:
+        pairs: List[transaction.TxnPair] = [([], txn) for txn in txns[:n]]
+        return lambda: [serialize.pack_txn_pair(p) for p in pairs]
+
+    def setup_unpack_txns(n: int) -> Callable[[], object]:
+        ss = [serialize.pack_txn_pair(([], txn)) for txn in txns[:n]]
+        return lambda: [serialize.unpack_txn_pair(s) for s in ss]
+
+    def setup_pack_chain(n: int, version: int = serialize.WIRE_VERSION
+                         ) -> Callable[[], object]:
+        chain = chains[n]
+        return lambda: serialize.pack_blockchain(chain, version=version)
+
+    def setup_unpack_chain(n: int, version: int = serialize.WIRE_VERSION
+                           ) -> Callable[[], object]:
+        s = serialize.pack_blockchain(chains[n], version=version)
+        return lambda: serialize.unpack_blockchain(s)
+
+    txn_counts = [1, 4, 16, len(txns)]
+    run_curve('serialize.pack_txn_pair', txn_counts,
+              setup_pack_txns, repeat, results)
+    run_curve('serialize.unpack_txn_pair', txn_counts,
+              setup_unpack_txns, repeat, results)
+    run_curve('serialize.pack_blockchain', CHAIN_LENGTHS,
+              setup_pack_chain, repeat, results)
+    run_curve('serialize.unpack_blockchain', CHAIN_LENGTHS,
+              setup_unpack_chain, repeat, results)
+    run_curve('serialize.pack_blockchain_v1', CHAIN_LENGTHS,
+              lambda n: setup_pack_chain(n, 1), repeat, results)
+    run_curve('serialize.unpack_blockchain_v1', CHAIN_LENGTHS,
+              lambda n: setup_unpack_chain(n, 1), repeat, results)
+
+
+def bench_validation(results: Results,
+                     repeat: int,
+                     txns: List[transaction.Transaction],
+                     chains: Dict[int, block.Blockchain]):
+    """block.valid_blockchain (serial, checkpointed, with known blocks and
+    parallel), BlockTree.header_work and block.valid_tokens (searched and
+    indexed) vs chain length.
+    """
+    def setup_chain(n: int) -> Callable[[], object]:
+        chain = chains[n]
+        return lambda: block.valid_blockchain(chain)
+
+    def setup_checkpointed(n: int) -> Callable[[], object]:
+        # all but the last few blocks assumed valid
+        chain = chains[n]
+        checkpoints: block.Checkpoints = {}
+        block.update_checkpoints(chain, checkpoints, min(n - 1, 2))
+        return lambda: block.valid_blockchain(chain, None, checkpoints)
+
+    def setup_registered(n: int) -> Callable[[], object]:
+        # all but the tip validated before, as when a chain grows by a block
+        chain = chains[n]
+        registry = block.ValidatedBlocks()
+        block.valid_blockchain(chain[:-1], None, None, registry)
+        return lambda: block.valid_blockchain(chain, None, None, registry)
+
+    def setup_tree(n: int) -> Callable[[], object]:
+        # headers of a chain whose blocks but the tip are in the tree
+        chain = chains[n]
+        tree = blocktree.BlockTree()
+        assert tree.add_chain(chain[:-1])
+        headers = [b['header'] for b in chain]
+        return lambda: tree.header_work(headers)
+
+    def setup_parallel(n: int) -> Callable[[], object]:
+        chain = chains[n]
+        return lambda: block.valid_blockchain_parallel(chain, None, executor)
+
+    def setup_tokens(n: int, indexed: bool = False) -> Callable[[], object]:
+        # token with no source txn: worst case, a full backwards search
+        txn = chains[n][0]['txns'][0]
+        token: transaction.Token = {'txn_hash': hash.hash(b'missing'),
+                                    'owner': txn['receiver'],
+                                    'value': txn['receiver_value'],
+                                    'signature': txn['receiver_signature']}
+        chain = chains[n]
+        index = None
+        if indexed:
+            index = block.ChainIndex()
+            index.update(chain)
+        return lambda: block.valid_tokens([token], chain, index)
+
+    run_curve('block.valid_blockchain', CHAIN_LENGTHS,
+              setup_chain, repeat, results)
+    run_curve('block.valid_blockchain_checkpointed', CHAIN_LENGTHS,
+              setup_checkpointed, repeat, results)
+    run_curve('block.valid_blockchain_registered', CHAIN_LENGTHS,
+              setup_registered, repeat, results)
+    run_curve('blocktree.header_work', CHAIN_LENGTHS,
+              setup_tree, repeat, results)
+    with ProcessPoolExecutor() as executor:
+        run_curve('block.valid_blockchain_parallel', CHAIN_LENGTHS,
+                  setup_parallel, repeat, results)
+    run_curve('block.valid_tokens', CHAIN_LENGTHS,
+              setup_tokens, repeat, results)
+    run_curve('block.valid_tokens_indexed', CHAIN_LENGTHS,
+              lambda n: setup_tokens(n, True), repeat, results)
+
+
+def bench_wallet(results: Results, repeat: int):
+    """Wallet.send vs number of tokens spent per send."""
+    def setup(n: int) -> Callable[[], object]:
+        a_wallet, b_wallet = gen_wallet(), gen_wallet()
+
+        def send():
+            # refill with n unit tokens, so every send spends n tokens
+            a_wallet.wallet = []
+            for _ in range(n):
+                a_wallet.receive(coinbase_txn(a_wallet.public_key, 1))
+            a_wallet.send(n, b_wallet.public_key)
+        return send
+
+    run_curve('wallet.send', [1, 4, 16, 64], setup, repeat, results)
+
+
+def bench_txn_versions(results: Results, repeat: int):
+    """transaction.send and transaction.valid_txn per txn version vs number
+    of tokens spent.
+    """
+    a_wallet, b_wallet = gen_wallet(), gen_wallet()
+
+    def tokens(n: int) -> List[transaction.Token]:
+        a_wallet.wallet = []
+        for _ in range(n):
+            a_wallet.receive(coinbase_txn(a_wallet.public_key, 1))
+        return a_wallet.wallet
+
+    def setup_send(n: int, version: int) -> Callable[[], object]:
+        ts = tokens(n)
+        return lambda: transaction.send(b_wallet.public_key,
+                                        a_wallet.public_key,
+                                        a_wallet.private_key, n, ts, version)
+
+    def setup_valid(n: int, version: int) -> Callable[[], object]:
+        pair = setup_send(n, version)()
+        assert pair is not None
+        return lambda: transaction.valid_txn(*pair)
+
+    for v in transaction.TXN_VERSIONS:
+        run_curve(f'transaction.send_v{v}', [1, 16],
+                  lambda n: setup_send(n, v), repeat, results)
+        run_curve(f'transaction.valid_txn_v{v}', [1, 16],
+                  lambda n: setup_valid(n, v), repeat, results)
+
+
+################################################################################
+# Reporting
+
+
+def fmt_time(t: float) -> str:
+    """Format seconds with a readable unit."""
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if t >= scale:
+            return f'{t / scale:.2f}{unit}'
+    return f'{t / 1e-9:.0f}ns'
+
+
+def report_scaling(results: Results):
+    """Print growth of time relative to growth of n along each curve."""
+    print(f'\n{"Scaling":<28} (time ratio / size ratio between steps)')
+    for name, curve in results.items():
+        steps = []
+        for r0, r1 in zip(curve, curve[1:]):
+            if r0['n'] > 0 and r0['median'] > 0:
+                steps.append(f'{r1["median"] / r0["median"]:.1f}/'
+                             f'{r1["n"] / r0["n"]:.0f}')
+        print(f'{name:<28} {"  ".join(steps)}')
+
+
+def report_compare(results: Results, baseline: Results):
+    """Print median time of results relative to baseline results."""
+    print(f'\n{"Compare":<28} (new / baseline median, >1 is slower)')
+    for name, curve in results.items():
+        old = {r['n']: r['median'] for r in baseline.get(name, [])}
+        ratios = [f'n={r["n"]}:{r["median"] / old[r["n"]]:.2f}'
+                  for r in curve if old.get(r['n'])]
+        if ratios:
+            print(f'{name:<28} {"  ".join(ratios)}')
+
+
+def git_commit() -> Optional[str]:
+    """Current git commit, if available."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def save(path: str, results: Results):
+    """Save results with enough metadata to compare runs."""
+    doc = {'commit': git_commit(),
+           'timestamp': int(time.time()),
+           'python': platform.python_version(),
+           'machine': platform.machine(),
+           'results': results}
+    with open(path, 'w') as f:
+        json.dump(doc, f, indent=4, sort_keys=True)
+    print(f'\nSaved results to {path}')
+
+
+################################################################################
+
+
+BENCHMARKS = ['hash', 'merkle', 'pow', 'signature', 'serialize',
+              'validation', 'wallet']
+
+
+def main(args):
+    """Run selected benchmarks."""
+    selected = args.only or BENCHMARKS
+    results: Results = {}
+
+    if 'hash' in selected:
+        bench_hash(results, args.repeat)
+    if 'merkle' in selected:
+        bench_merkle(results, args.repeat)
+    if 'pow' in selected:
+        bench_proof_of_work(results, args.repeat)
+    if 'signature' in selected:
+        bench_signature(results, args.repeat)
+    if 'wallet' in selected:
+        bench_wallet(results, args.repeat)
+        bench_txn_versions(results, args.repeat)
+
+    if 'serialize' in selected or 'validation' in selected:
+        txns = gen_txns(32)
+        with fixed_target(block.INITIAL_TARGET):
+            chains = {n: gen_chain(n, txns) for n in CHAIN_LENGTHS}
+            if 'serialize' in selected:
+                bench_serialize(results, args.repeat, txns, chains)
+            if 'validation' in selected:
+                bench_validation(results, args.repeat, txns, chains)
+
+    report_scaling(results)
+    if args.compare:
+        with open(args.compare) as f:
+            report_compare(results, json.load(f)['results'])
+    if args.out:
+        save(args.out, results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default='bench_output.json')
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--repeat', default=5, type=int)
+    parser.add_argument('--only', nargs='*', choices=BENCHMARKS)
+
+    main(parser.parse_args())
@@ -0,0 +1,321 @@
+"""End-to-end network throughput and latency harness.
+
+Starts a relay, N nodes, a listener and a transaction oracle as local
+processes, subscribes to the node channel as a passive monitor, and after a
+fixed duration reports:
+
+- txn-submit to block-inclusion latency percentiles
+- blocks / sec and txns / sec
+- bytes relayed (per subscriber, and estimated in total)
+- CPU seconds and utilization per process
+
+All processes are shut down at the end. Run from the blockchain directory:
+
+    python -m benchmarks.network --nodes 3 --duration 60 --out net.json
+"""
+
+
+import argparse # type: ignore
+import asyncio # type: ignore
+import json # type: ignore
+import os # type: ignore
+import signal # type: ignore
+import statistics # type: ignore
+import subprocess # type: ignore
+import sys # type: ignore
+import tempfile # type: ignore
+import time # type: ignore
+from collections import Counter # type: ignore
+from toycoin import hash, transaction # type: ignore
+from toycoin.network import compact, serialize # type: ignore
+from toycoin.network.msg_protocol import FrameReader, FrameWriter, decode_frame, hello, subscribe # type: ignore
+from typing import Dict, List, Optional, Tuple # type: ignore
+
+
+################################################################################
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NETWORK = os.path.join(ROOT, 'toycoin', 'network')
+
+Proc = Tuple[str, subprocess.Popen]
+
+
+################################################################################
+# Monitor
+
+
+class Monitor:
+    """Passive subscriber recording when txns and blocks are first seen.
+    Blocks announced as headers are counted from their headers; their txns
+    are seen as included once a node fetches their bodies. Txns of compact
+    blocks are matched to submitted txns by short id.
+    """
+
+    def __init__(self):
+        self.submitted: Dict[hash.Hash, float] = {}
+        self.included: Dict[hash.Hash, float] = {}
+        self.blocks: Dict[hash.Hash, float] = {}
+        self.msg_counts: Counter = Counter()
+        self.msg_bytes: Counter = Counter()
+        self.start = time.monotonic()
+
+
+    async def run(self, frames: FrameReader):
+        """Record messages until the connection closes."""
+        try:
+            while batch := await frames.read():
+                now = time.monotonic()
+                for frame in batch:
+                    self.handle(decode_frame(frame)[1], now, len(frame))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+
+    def handle(self, data: bytes, now: float, size: int):
+        """Record first-seen times of txns, blocks and block inclusions, and
+        the frame size.
+        """
+        kind = data[:4].decode(errors='replace')
+        self.msg_counts[kind] += 1
+        self.msg_bytes[kind] += size
+
+        if data[:4] == b'TXN ':
+            _, txn = serialize.unpack_txn_pair(data[4:])
+            self.submitted.setdefault(transaction.hash_txn(txn), now)
+        elif data[:4] == b'BLOC':
+            for b in serialize.unpack_blockchain(data[4:]):
+                h = b['header']['this_hash']
+                if h in self.blocks:
+                    continue
+                self.blocks[h] = now
+                for txn in b['txns']:
+                    self.included.setdefault(transaction.hash_txn(txn), now)
+        elif data[:4] == b'HDRS':
+            announcement = json.loads(data[4:])
+            for hdr in serialize.unpack_headers(announcement['headers']):
+                self.blocks.setdefault(hdr['this_hash'], now)
+        elif data[:4] == b'CMPT':
+            announcement = json.loads(data[4:])
+            hdr, ids = serialize.unpack_compact_block(announcement['block'])
+            h = hdr['this_hash']
+            self.blocks.setdefault(h, now)
+            short = {compact.short_id(txn_hash, h): txn_hash
+                     for txn_hash in self.submitted}
+            for s in ids:
+                if s in short:
+                    self.included.setdefault(short[s], now)
+        elif data[:4] == b'BODY':
+            _, txns = serialize.unpack_body(data[4:])
+            for txn in txns:
+                self.included.setdefault(transaction.hash_txn(txn), now)
+
+
+    def latencies(self) -> List[float]:
+        """Submit to inclusion latency of txns seen both ways."""
+        return [self.included[h] - t for h, t in self.submitted.items()
+                if h in self.included]
+
+
+################################################################################
+# Processes
+
+
+def start(name: str,
+          script: str,
+          args: List[str],
+          log_dir: str
+          ) -> Proc:
+    """Start network script as a subprocess, logging to log_dir."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, env.get('PYTHONPATH', '')])
+    # the child gets its own copy of the log file descriptor
+    with open(os.path.join(log_dir, f'{name}.log'), 'w') as log:
+        p = subprocess.Popen([sys.executable, '-u',
+                              os.path.join(NETWORK, script)] + args,
+                             stdout=log, stderr=subprocess.STDOUT,
+                             cwd=NETWORK, env=env)
+    return name, p
+
+
+def stop(procs: List[Proc], timeout: float = 5):
+    """Interrupt processes in reverse start order, killing stragglers."""
+    for _, p in reversed(procs):
+        if p.poll() is None:
+            p.send_signal(signal.SIGINT)
+    for name, p in reversed(procs):
+        try:
+            p.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f'{name} did not exit, killing')
+            p.kill()
+            p.wait()
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU seconds of a live process (Linux /proc only)."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 10):
+    """Wait until something accepts connections on host:port."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+
+################################################################################
+# Main
+
+
+async def main(args):
+    """Run network, monitor for duration, shut down and report."""
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix='toycoin-net-')
+    os.makedirs(log_dir, exist_ok=True)
+    port = ['--port', str(args.port)]
+    procs: List[Proc] = []
+
+    try:
+        procs.append(start('relay', 'relay.py', port, log_dir))
+        await wait_for_port(args.host, args.port)
+
+        for i in range(args.nodes):
+            procs.append(start(f'node{i}', 'node.py',
+                               port + ['--channel', args.channel],
+                               log_dir))
+        procs.append(start('listener', 'listener.py',
+                           port + ['--listen', args.channel],
+                           log_dir))
+
+        monitor = Monitor()
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+        frames, frame_writer = FrameReader(reader), FrameWriter(writer)
+        await hello(frames, frame_writer)
+        await subscribe(frame_writer, args.channel.encode())
+        monitor_task = asyncio.create_task(monitor.run(frames))
+        await asyncio.sleep(args.warmup)
+
+        procs.append(start('oracle', 'txn_oracle.py',
+                           port + ['--channel', args.channel,
+                                   '--min_interval', str(args.min_interval),
+                                   '--max_interval', str(args.max_interval)],
+                           log_dir))
+
+        cpu0 = {name: cpu_seconds(p.pid) for name, p in procs}
+        t0 = time.monotonic()
+        await asyncio.sleep(args.duration)
+        elapsed = time.monotonic() - t0
+        cpu1 = {name: cpu_seconds(p.pid) for name, p in procs}
+
+        writer.close()
+        monitor_task.cancel()
+
+    finally:
+        stop(procs)
+
+    cpu = {name: (cpu1[name] - cpu0[name]
+                  if cpu0[name] is not None and cpu1[name] is not None
+                  else None)
+           for name, _ in procs}
+    summary = summarize(monitor, cpu, elapsed, args.nodes)
+    report(summary)
+    print(f'\nProcess logs in {log_dir}')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(summary, f, indent=4, sort_keys=True)
+        print(f'Saved results to {args.out}')
+
+
+################################################################################
+# Reporting
+
+
+def summarize(monitor: Monitor,
+              cpu: Dict[str, Optional[float]],
+              elapsed: float,
+              nodes: int
+              ) -> dict:
+    """Summary statistics for a run."""
+    lats = sorted(monitor.latencies())
+    if len(lats) >= 2:
+        qs = statistics.quantiles(lats, n=100, method='inclusive')
+        pcts = {'p50': qs[49], 'p90': qs[89], 'p99': qs[98],
+                'max': lats[-1]}
+    else:
+        pcts = {}
+
+    per_subscriber = sum(monitor.msg_bytes.values())
+    subscribers = nodes + 2 # nodes, listener and this monitor
+
+    return {'duration': elapsed,
+            'nodes': nodes,
+            'txns_submitted': len(monitor.submitted),
+            'txns_included': len(monitor.included),
+            'txns_per_sec': len(monitor.included) / elapsed,
+            'blocks': len(monitor.blocks),
+            'blocks_per_sec': len(monitor.blocks) / elapsed,
+            'latency': pcts,
+            'msg_counts': dict(monitor.msg_counts),
+            'bytes_per_subscriber': per_subscriber,
+            'bytes_relayed_est': per_subscriber * subscribers,
+            'cpu_seconds': cpu,
+            'cpu_util': {name: (t / elapsed if t is not None else None)
+                         for name, t in cpu.items()}}
+
+
+def report(summary: dict):
+    """Print summary."""
+    print(f'\nDuration {summary["duration"]:.1f}s, '
+          f'{summary["nodes"]} nodes')
+    print(f'Txns submitted {summary["txns_submitted"]}, '
+          f'included {summary["txns_included"]} '
+          f'({summary["txns_per_sec"]:.2f}/s)')
+    print(f'Blocks {summary["blocks"]} ({summary["blocks_per_sec"]:.3f}/s)')
+
+    lat = ', '.join(f'{k} {v:.2f}s' for k, v in summary['latency'].items())
+    print(f'Inclusion latency: {lat or "n/a"}')
+
+    print(f'Messages: {summary["msg_counts"]}')
+    print(f'Bytes per subscriber {summary["bytes_per_subscriber"]}, '
+          f'relayed (est) {summary["bytes_relayed_est"]}')
+
+    print('CPU (seconds, utilization):')
+    for name, t in summary['cpu_seconds'].items():
+        util = summary['cpu_util'][name]
+        s = f'{t:.2f}s {100 * util:.1f}%' if t is not None else 'n/a'
+        print(f'  {name:<10} {s}')
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=25100, type=int)
+    parser.add_argument('--channel', default='/topic/main')
+    parser.add_argument('--nodes', default=2, type=int)
+    parser.add_argument('--duration', default=60, type=float)
+    parser.add_argument('--warmup', default=2, type=float)
+    parser.add_argument('--min_interval', default=0.1, type=float)
+    parser.add_argument('--max_interval', default=0.5, type=float)
+    parser.add_argument('--log_dir', default=None)
+    parser.add_argument('--out', default=None)
+
+    asyncio.run(main(parser.parse_args()))
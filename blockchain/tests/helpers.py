@@ -0,0 +1,70 @@
+"""Shared test data: unsigned genesis txns and valid chains.
+"""
+
+
+from toycoin import block, transaction, utils # type: ignore
+from typing import List, Optional # type: ignore
+
+
+################################################################################
+
+
+def gen_txn(i: int,
+            value: Optional[int] = None,
+            tag: bytes = b''
+            ) -> transaction.Transaction:
+    """Distinct (unsigned) genesis txn, worth i unless value is given."""
+    return {'previous_hashes': [],
+            'receiver': tag + f'receiver{i}'.encode(),
+            'receiver_value': i if value is None else value,
+            'receiver_signature': b'',
+            'sender': b'genesis',
+            'sender_change': 0,
+            'sender_signature': b''
+            }
+
+
+def gen_chain(n: int,
+              start: Optional[int] = None,
+              tag: bytes = b'',
+              txns: Optional[List[transaction.Transaction]] = None
+              ) -> block.Blockchain:
+    """Valid chain of n blocks, timestamped BLOCK_INTERVAL apart from start
+    (by default, ending now). Blocks hold txns, 2 per block and cycling, if
+    given, or else one gen_txn(i, tag=tag) each.
+    """
+    if start is None:
+        start = utils.timestamp() - n * block.BLOCK_INTERVAL
+    chain: block.Blockchain = []
+    for i in range(n):
+        h = block.GENESIS if i == 0 else chain[-1]['header']['this_hash']
+        if txns:
+            j = (2 * i) % len(txns)
+            txns_ = txns[j:j + 2]
+        else:
+            txns_ = [gen_txn(i, tag=tag)]
+        b, _ = block.gen_block(h, txns_, block.next_target(chain),
+                               timestamp=start + i * block.BLOCK_INTERVAL)
+        assert b is not None
+        chain.append(b)
+    return chain
+
+
+def extend_chain(chain: block.Blockchain,
+                 n: int,
+                 start: int,
+                 spacing: int = block.BLOCK_INTERVAL,
+                 tag: bytes = b''
+                 ) -> block.Blockchain:
+    """Chain extended by n valid blocks, timestamped spacing seconds apart
+    from start, each with one gen_txn(height, tag=tag).
+    """
+    chain = list(chain)
+    for i in range(n):
+        h = block.GENESIS if not chain else chain[-1]['header']['this_hash']
+        b, _ = block.gen_block(h, [gen_txn(len(chain), tag=tag)],
+                               block.next_target(chain),
+                               timestamp=start + i * spacing)
+        assert b is not None
+        chain.append(b)
+    return chain
@@ -1,3 +1,6 @@
+import copy # type: ignore
+from concurrent.futures import ProcessPoolExecutor # type: ignore
+from helpers import gen_chain, gen_txn # type: ignore
 from toycoin import block, hash, signature, transaction, utils, wallet # type: ignore
 
 
@@ -10,7 +13,7 @@ class TestGenBlock:
         """Test gen_block with no transactions."""
         f = block.gen_block
 
-        assert f(hash.hash(b'previous'), [], 1) == (None, [])
+        assert f(hash.hash(b'previous'), [], block.INITIAL_TARGET) == (None, [])
 
 
     def test_gen_block(self):
@@ -43,13 +46,13 @@ class TestGenBlock:
 
         b0, _ = block.gen_block(block.GENESIS,
                                 [txn0a, txn0b],
-                                block.next_difficulty(0))
+                                block.next_target([]))
 
         b0_, _ = block.gen_block(block.GENESIS + b'1',
                                  [txn0a, txn0b],
-                                 block.next_difficulty(0))
+                                 block.next_target([]))
 
-        assert block.valid_block(b0, block.next_difficulty(0))
+        assert block.valid_block(b0, block.INITIAL_TARGET)
         assert block.valid_blockchain([b0])
         assert block.valid_blockchain([b0_]) is False
 
@@ -64,7 +67,8 @@ class TestGenBlock:
 
         b1, _ = block.gen_block(b0['header']['this_hash'],
                                 [txn1, txn2],
-                                block.next_difficulty(1))
+                                block.next_target([b0]),
+                                timestamp=block.next_timestamp([b0]))
 
         assert block.valid_tokens(tokens1, [b0, b1])
         assert block.valid_tokens(tokens2, [b0, b1])
@@ -77,7 +81,7 @@ class TestGenBlock:
         a_wallet.receive(txn2)
         c_wallet.receive(txn2)
 
-        assert block.valid_block(b1, block.next_difficulty(1))
+        assert block.valid_block(b1, block.next_target([b0]))
         assert block.valid_blockchain([b0, b1])
         assert block.valid_blockchain([b1, b0]) is False
 
@@ -86,28 +90,95 @@ class TestGenBlock:
         _, txn3 = a_wallet.send(10, d_wallet.public_key)
         b2, _ = block.gen_block(b1['header']['this_hash'],
                                 [txn3],
-                                block.next_difficulty(2))
+                                block.next_target([b0, b1]),
+                                timestamp=block.next_timestamp([b0, b1]))
 
         a_wallet.confirm_send(transaction.hash_txn(txn3))
         a_wallet.receive(txn3)
         d_wallet.receive(txn3)
 
-        assert block.valid_block(b2, block.next_difficulty(2))
+        assert block.valid_block(b2, block.next_target([b0, b1]))
         assert block.valid_blockchain([b0, b1, b2])
         assert block.valid_blockchain([b1, b0, b2]) is False
 
 
 
+    def test_select_txns(self):
+        """Test block template selection with txn and byte budgets."""
+        f = block.select_txns
+        txns = [{'previous_hashes': [],
+                 'receiver': bytes(n),
+                 'receiver_value': 1,
+                 'receiver_signature': b'',
+                 'sender': b'',
+                 'sender_change': 0,
+                 'sender_signature': b''
+                 }
+                for n in [8, 30, 8, 8]]
+        size = lambda txn: len(txn['receiver'])
+
+        assert f(txns, 10, 100, size) == (txns, [])
+        assert f(txns, 2, 100, size) == (txns[:2], txns[2:])
+        # txn over the byte budget is skipped, smaller ones still fit
+        assert f(txns, 10, 20, size) == ([txns[0], txns[2]],
+                                         [txns[1], txns[3]])
+
+        # once the block is full, the remaining txns are not sized
+        sized = []
+        assert f(txns, 1, 100, lambda txn: sized.append(txn) or 8) == \
+            (txns[:1], txns[1:])
+        assert sized == txns[:1]
+
+        T = block.INITIAL_TARGET
+        b, rest = block.gen_block(block.GENESIS, txns, T, 10, 20, size)
+        assert b['txns'] == [txns[0], txns[2]]
+        assert rest == [txns[1], txns[3]]
+        assert block.gen_block(block.GENESIS, txns[1:2], T, 10, 20, size) == \
+            (None, txns[1:2])
+
+
+
 class TestProofOfWork:
 
 
-    def test_next_difficulty(self):
-        """Test next_difficulty"""
-        f = block.next_difficulty
+    def test_expected_targets(self):
+        """Test retargeting toward the block interval."""
+        f = block.expected_targets
+        T = block.INITIAL_TARGET
+        headers = lambda times: [{'timestamp': str(t).encode()}
+                                 for t in times]
+
+        assert f([]) == [T]
+        assert f(headers([0])) == [T, T]
 
-        assert f(0) == 1
-        assert f(1) == 1
-        assert f(2) == 2
+        # on schedule: target unchanged
+        assert f(headers([0, 10, 20]), 10) == [T, T, T, T]
+
+        # blocks twice as fast / slow as desired: target halves / doubles
+        assert f(headers([0, 5]), 10)[-1] == T // 2
+        assert f(headers([0, 20]), 10)[-1] == T * 2
+
+        # adjustment is clamped
+        assert f(headers([0, 0]), 10)[-1] == T // block.MAX_ADJUST
+        assert f(headers([10, 0]), 10)[-1] == T // block.MAX_ADJUST
+        assert f(headers([0, 1000]), 10)[-1] == T * block.MAX_ADJUST
+
+        # on schedule over more than a window: target stays unchanged
+        n = 3 * block.RETARGET_WINDOW
+        assert f(headers(range(0, 10 * n, 10)), 10) == [T] * (n + 1)
+
+
+    def test_meets_target(self):
+        """Test meets_target."""
+        f = block.meets_target
+
+        assert f(b'\x01\x02', 2 ** 16)
+        assert f(b'\x01\x02', 0x0103)
+        assert not f(b'\x01\x02', 0x0102)
+
+        h = b'\x00\x00\x01' + bytes(61)
+        assert f(h, block.difficulty_to_target(2))
+        assert not f(h, block.difficulty_to_target(3))
 
 
     def test_proof_of_work(self):
@@ -117,26 +188,277 @@ class TestProofOfWork:
         previous = hash.hash(b'hello world')
         root = hash.hash(b'root')
 
-        b = f(previous, root, 2)
+        b = f(previous, root, block.difficulty_to_target(2))
 
         assert b['previous_hash'] == previous
         assert b['merkle_root'] == root
         assert b['this_hash'][:2] == b'\x00\x00'
         # processing time should be easily < 60 seconds
         assert abs(int(b['timestamp']) - utils.timestamp()) < 60
-        assert block.valid_header(b, 2)
-
-
-    def test_solved(self):
-        """Test solved"""
-        f = block.solved
-
-        assert f(b'\x01\x02', 0) is True
-        assert f(b'\x01\x02', 1) is False
-
-        assert f(b'\x00\x00\x01\x02', 1) is True
-        assert f(b'\x00\x00\x01\x02', 2) is True
-        assert f(b'\x00\x00\x01\x02', 3) is False
+        assert block.valid_header(b, block.difficulty_to_target(2))
+        assert not block.valid_header(b, int.from_bytes(b['this_hash'],
+                                                        'big'))
+
+
+    def test_timestamps(self):
+        """Test median time past and future drift rules."""
+        f = block.valid_timestamps
+        headers = lambda times: [{'timestamp': str(t).encode()}
+                                 for t in times]
+        now = 1000
+
+        # later than the median of previous headers, not just the last one
+        assert f(headers([990, 992, 991]), now)
+        assert not f(headers([990, 992, 990]), now)
+        assert not f(headers([990, 990]), now)
+        times = [900 + i for i in range(block.MEDIAN_WINDOW)]
+        median = times[block.MEDIAN_WINDOW // 2]
+        assert f(headers(times + [median + 1]), now)
+        assert not f(headers(times + [median]), now)
+
+        # at most MAX_FUTURE_DRIFT ahead of now
+        assert f(headers([now + block.MAX_FUTURE_DRIFT]), now)
+        assert not f(headers([now + block.MAX_FUTURE_DRIFT + 1]), now)
+
+
+    def test_timestamp_rules_in_chain(self, monkeypatch):
+        """Test valid_blockchain rejects blocks breaking timestamp rules."""
+        txns = [gen_txn(n, 1) for n in range(3)]
+        monkeypatch.setattr(utils, 'timestamp', lambda: 1000)
+        T = block.INITIAL_TARGET
+
+        b0, _ = block.gen_block(block.GENESIS, txns[:1], T)
+        h0 = b0['header']['this_hash']
+        same, _ = block.gen_block(h0, txns[1:2], T)
+        later, _ = block.gen_block(h0, txns[1:2], T,
+                                   timestamp=block.next_timestamp([b0]))
+        future, _ = block.gen_block(h0, txns[1:2], T, timestamp=2000)
+
+        assert later['header']['timestamp'] == b'1001'
+        assert block.valid_blockchain([b0, later])
+        assert not block.valid_blockchain([b0, same])
+        assert not block.valid_blockchain([b0, future])
+
+
+class TestValidation:
+
+
+    def test_valid_blockchain_parallel(self):
+        """Test parallel validation gives the same verdict as serial."""
+        chain = gen_chain(10)
+
+        bad_root = copy.deepcopy(chain)
+        bad_root[7]['txns'][0]['receiver_value'] += 1
+        bad_link = chain[:4] + chain[5:]
+
+        with ProcessPoolExecutor(2) as executor:
+            f = lambda c: block.valid_blockchain_parallel(c, None, executor, 3)
+            for c in [chain, bad_root, bad_link, chain[:1]]:
+                assert f(c) == block.valid_blockchain(c)
+            assert f(chain) is True
+            assert f(bad_root) is False
+            assert f(bad_link) is False
+
+        # with its own pool
+        assert block.valid_blockchain_parallel(bad_root, shard_size=3) is False
+
+
+    def test_merkle_root_parallel(self):
+        """Test that txns hashed across workers give the same root."""
+        txns = [gen_txn(i) for i in range(9)]
+        label = block.gen_merkle(txns).label
+
+        with ProcessPoolExecutor(2) as executor:
+            assert block.merkle_root(txns) == label
+            assert block.merkle_root(txns, executor, 0, 4) == label
+            b, _ = block.gen_block(block.GENESIS, txns, block.INITIAL_TARGET,
+                                   max_txns=len(txns))
+            assert block.valid_merkle_root(b, executor)
+            b['txns'][3] = gen_txn(100)
+            assert not block.valid_merkle_root(b, executor)
+
+
+    def test_checkpoints(self):
+        """Test that blocks up to the last checkpoint skip txn checks."""
+        chain = gen_chain(10)
+        bad_root = copy.deepcopy(chain)
+        bad_root[3]['txns'][0]['receiver_value'] += 1
+        checkpoint = lambda i: {i: chain[i]['header']['this_hash']}
+
+        for f in [block.valid_blockchain,
+                  lambda c, i, cp: block.valid_blockchain_parallel(
+                      c, i, shard_size=3, checkpoints=cp)]:
+            assert f(bad_root, None, {}) is False
+            assert f(bad_root, None, checkpoint(2)) is False
+            assert f(bad_root, None, checkpoint(3)) is True
+            assert f(bad_root, None, {**checkpoint(1), **checkpoint(5)})
+            # checkpoints beyond the chain are ignored
+            assert f(bad_root[:5], None, checkpoint(8)) is False
+
+            # header hashes and links are still checked
+            bad_hdr = copy.deepcopy(chain)
+            bad_hdr[1]['header']['nonce'] = b'0'
+            assert f(bad_hdr, None, checkpoint(3)) is False
+
+            # a chain not matching a checkpoint is invalid
+            other = gen_chain(5)
+            assert f(other, None, {}) is True
+            assert f(other, None, checkpoint(3)) is False
+
+
+    def test_valid_header_chain(self):
+        """Test validating a chain from its headers alone."""
+        f = block.valid_header_chain
+        chain = gen_chain(5)
+        headers = [b['header'] for b in chain]
+
+        # txns are not needed, so a bad body is not detected
+        bad_root = copy.deepcopy(chain)
+        bad_root[3]['txns'][0]['receiver_value'] += 1
+        assert f([b['header'] for b in bad_root]) is True
+        assert block.valid_blockchain(bad_root) is False
+
+        assert f(headers) is True
+        assert f(headers[:2] + headers[3:]) is False
+        assert f(headers[1:]) is False
+        bad_nonce = copy.deepcopy(headers)
+        bad_nonce[2]['nonce'] = b'0'
+        assert f(bad_nonce) is False
+        assert f(headers, None, {1: block.GENESIS}) is False
+
+
+    def test_update_checkpoints(self):
+        """Test checkpointing blocks deep enough in the chain."""
+        f = block.update_checkpoints
+        chain = gen_chain(4)
+        checkpoints: block.Checkpoints = {}
+
+        assert f(chain, checkpoints, 4) is False
+        assert f(chain, checkpoints, 2) is True
+        assert f(chain, checkpoints, 2) is False
+        assert f(chain, checkpoints, 0) is True
+        assert checkpoints == {1: chain[1]['header']['this_hash'],
+                               3: chain[3]['header']['this_hash']}
+
+
+class TestChainIndex:
+
+    def test_update(self):
+        """Test that the index follows a growing chain and reorgs."""
+        chain = gen_chain(4)
+        fork = chain[:2] + gen_chain(3, tag=b'fork')[2:]
+        index = block.ChainIndex()
+        txn_hash = lambda height: transaction.hash_txn(chain[height]['txns'][0])
+
+        index.update(chain[:3])
+        assert index.matches(chain[:3]) and not index.matches(chain)
+        assert index.lookup(txn_hash(2)) == (2, chain[2]['txns'][0])
+        assert index.lookup(txn_hash(3)) is None
+
+        index.update(chain)
+        assert index.lookup(txn_hash(3)) == (3, chain[3]['txns'][0])
+        assert len(index) == 4
+
+        index.update(fork)
+        assert index.matches(fork)
+        assert index.lookup(txn_hash(1)) == (1, chain[1]['txns'][0])
+        assert index.lookup(txn_hash(2)) is None
+        fork_hash = transaction.hash_txn(fork[2]['txns'][0])
+        assert index.lookup(fork_hash) == (2, fork[2]['txns'][0])
+        assert len(index) == 3
+
+        index.update([])
+        assert index.matches([]) and len(index) == 0
+
+
+    def test_valid_tokens(self, monkeypatch):
+        """Test that token sources are looked up, not searched for, in an
+        indexed chain."""
+        chain = gen_chain(3)
+        txn = chain[1]['txns'][0]
+        token = {'txn_hash': transaction.hash_txn(txn),
+                 'owner': txn['receiver'],
+                 'value': txn['receiver_value'],
+                 'signature': txn['receiver_signature']}
+        index = block.ChainIndex()
+        index.update(chain)
+
+        hashed = []
+        hash_txn = transaction.hash_txn
+        def counted(txn):
+            hashed.append(txn)
+            return hash_txn(txn)
+        monkeypatch.setattr(transaction, 'hash_txn', counted)
+
+        assert block.valid_tokens([token], chain, index)
+        assert not block.valid_tokens([dict(token, value=0)], chain, index)
+        assert hashed == []
+
+        # the index is of another chain: search it instead
+        assert not block.valid_tokens([token], chain[:1], index)
+        assert block.valid_tokens([token], chain[:2], index)
+        assert hashed
+
+
+class TestValidatedBlocks:
+
+    def test_registry(self, monkeypatch):
+        """Test that blocks proven valid skip Merkle checks, but only with
+        the same target, header and txns."""
+        chain = gen_chain(4)
+        registry = block.ValidatedBlocks(capacity=5)
+        T = block.INITIAL_TARGET
+
+        assert block.valid_blockchain(chain, None, None, registry)
+        assert len(registry) == 4
+
+        hashed = []
+        merkle_root = block.merkle_root
+        def counted(txns, *args):
+            hashed.append(txns)
+            return merkle_root(txns, *args)
+        monkeypatch.setattr(block, 'merkle_root', counted)
+
+        assert block.valid_blockchain(chain, None, None, registry)
+        assert block.valid_merkle_root(chain[0], None, registry)
+        assert hashed == []
+
+        # other txns under a known header
+        bad = copy.deepcopy(chain)
+        bad[2]['txns'][0]['receiver_value'] += 1
+        assert not block.valid_blockchain(bad, None, None, registry)
+        assert not registry.known(bad[2])
+
+        # known under one target only; the capacity bounds the registry
+        assert block.valid_block(chain[3], T, registry)
+        assert registry.known(chain[3], T)
+        assert not registry.known(chain[3], T // 2)
+        assert not block.valid_block(chain[3], 1, registry)
+        assert len(registry) == 5
+        assert block.valid_block(chain[2], T, registry)
+        assert len(registry) == 5
+
+        registry.clear()
+        assert not registry.known(chain[3], T)
+
+
+    def test_parallel(self):
+        """Test that parallel validation skips known blocks, and records the
+        ones it checked."""
+        chain = gen_chain(6)
+        registry = block.ValidatedBlocks()
+        bad_pow = copy.deepcopy(chain)
+        bad_pow[1]['header']['nonce'] = b'0'
+
+        with ProcessPoolExecutor(2) as executor:
+            f = lambda c: block.valid_blockchain_parallel(c, None, executor, 2,
+                                                          registry=registry)
+            assert f(chain[:3])
+            assert len(registry) == 3
+            assert f(chain)
+            assert len(registry) == 6
+            assert not f(bad_pow)
+            assert not f(chain[:2] + chain[3:])
 
 
 ################################################################################
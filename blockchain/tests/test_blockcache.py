@@ -0,0 +1,62 @@
+"""Test cache of packed and unpacked blocks.
+"""
+
+
+from helpers import gen_chain # type: ignore
+from toycoin.network import blockcache, serialize # type: ignore
+
+
+################################################################################
+
+
+class TestBlockCache:
+
+    def test_pack(self):
+        """Test that cached packing matches packing from scratch, and only
+        packs new blocks."""
+        chain = gen_chain(4)
+        cache = blockcache.BlockCache()
+
+        for version in serialize.WIRE_VERSIONS:
+            assert (cache.pack_blockchain(chain[:3], version) ==
+                    serialize.pack_blockchain(chain[:3], version=version))
+        assert cache.misses == 6
+
+        s = cache.pack_blockchain(chain)
+        assert s == serialize.pack_blockchain(chain)
+        assert cache.misses == 7 and cache.hits == 3
+
+        assert cache.pack_body(chain[0], 1) == serialize.pack_body(chain[0], 1)
+        assert cache.pack_body(chain[0]) == serialize.pack_body(chain[0])
+
+
+    def test_unpack(self):
+        """Test that blocks are unpacked once, unless their txns differ."""
+        chain = gen_chain(3)
+        cache = blockcache.BlockCache()
+
+        s = serialize.pack_blockchain(chain[:2]).encode()
+        assert cache.unpack_blockchain(s) == chain[:2]
+        s = serialize.pack_blockchain(chain).encode()
+        assert cache.unpack_blockchain(s) == chain
+        assert cache.misses == 3 and cache.hits == 2
+
+        # same header, different txns: unpacked afresh
+        forged = [chain[0], {'header': chain[1]['header'],
+                             'txns': chain[2]['txns']}]
+        s = serialize.pack_blockchain(forged).encode()
+        assert cache.unpack_blockchain(s) == forged
+
+        s = serialize.pack_blockchain(chain, version=1)
+        assert cache.unpack_blockchain(s) == chain
+
+
+    def test_capacity(self):
+        """Test that the least recently used blocks are evicted."""
+        chain = gen_chain(3)
+        cache = blockcache.BlockCache(2)
+
+        cache.pack_blockchain(chain)
+        assert len(cache) == 2
+        cache.pack_blockchain(chain[1:])
+        assert cache.misses == 3
@@ -0,0 +1,114 @@
+"""Test block tree and fork choice.
+"""
+
+
+import copy # type: ignore
+from helpers import extend_chain, gen_chain # type: ignore
+from toycoin import block, utils # type: ignore
+from toycoin.network import blocktree # type: ignore
+
+
+################################################################################
+
+
+def headers(chain: block.Blockchain):
+    return [b['header'] for b in chain]
+
+
+def hashes(chain: block.Blockchain):
+    return [b['header']['this_hash'] for b in chain]
+
+
+class TestBlockTree:
+
+    def test_add_chain(self):
+        """Test that chains are validated as valid_blockchain would, and that
+        blocks already in the tree are not validated again."""
+        chain = gen_chain(6)
+        bad_root = copy.deepcopy(chain)
+        bad_root[4]['txns'][0]['receiver_value'] += 1
+        bad_link = chain[:2] + chain[3:]
+        tree = blocktree.BlockTree()
+
+        for c in [bad_root, bad_link, chain[1:]]:
+            assert not tree.add_chain(c)
+            assert block.valid_blockchain(c) is False
+        assert len(tree) == 0
+
+        assert tree.add_chain(chain[:4])
+        assert tree.reorg() == ([], chain[:4])
+        assert tree.add_chain(chain) # only the last 2 are new
+        assert tree.reorg() == ([], chain[4:])
+        assert tree.chain == chain and len(tree) == 6
+        assert tree.work() == block.chain_work(headers(chain))
+        assert tree.header_work(headers(chain)) == tree.work()
+
+        # known headers must match the tree, whose bodies are kept
+        assert tree.add_chain(bad_root)
+        assert tree.reorg() == ([], []) and tree.chain == chain
+        assert tree.header_work(headers(bad_link)) is None
+        assert not tree.add_chain(chain[:1] + chain[2:3])
+
+        # checkpoints
+        other = gen_chain(3, tag=b'other')
+        checkpoints = {1: chain[1]['header']['this_hash']}
+        assert tree.header_work(headers(other), checkpoints) is None
+        assert tree.header_work(headers(other)) is not None
+
+        # txns up to the last checkpoint are assumed valid
+        checkpoints = {4: bad_root[4]['header']['this_hash']}
+        assert blocktree.BlockTree().add_chain(bad_root[:5], checkpoints)
+        assert not blocktree.BlockTree().add_chain(bad_root[:5])
+
+
+    def test_fork_choice(self):
+        """Test that the chain with the most work wins, not the longest, and
+        that a reorg swaps only the blocks past the fork."""
+        start = utils.timestamp() - 1000
+        base = gen_chain(3, start)
+        t = start + 3 * block.BLOCK_INTERVAL
+        slow = extend_chain(base, 6, t, tag=b'slow')
+        fast = extend_chain(base, 5, t, spacing=1, tag=b'fast')
+        work = lambda c: block.chain_work(headers(c))
+        assert len(fast) < len(slow) and work(fast) > work(slow)
+
+        tree = blocktree.BlockTree()
+        assert tree.add_chain(slow)
+        tree.reorg()
+        assert tree.add_chain(fast)
+        assert tree.header_work(headers(fast)) == work(fast)
+        unwound, applied = tree.reorg()
+        assert hashes(unwound) == hashes(slow[3:])
+        assert hashes(applied) == hashes(fast[3:])
+        assert tree.chain == fast
+        assert tree.work() == work(fast)
+        assert tree.side == set(hashes(slow[3:]))
+
+        # the other branch stays in the tree: extending it needs only the
+        # new block, and equal work does not displace the tip
+        assert tree.add_chain(slow[:4])
+        assert tree.reorg() == ([], [])
+        more = extend_chain(slow, 3, t + 6 * block.BLOCK_INTERVAL, spacing=1,
+                            tag=b'more')
+        assert tree.add_chain(more[-3:])
+        unwound, applied = tree.reorg()
+        assert hashes(unwound) == hashes(fast[3:])
+        assert hashes(applied) == hashes(more[3:])
+
+
+    def test_prune(self):
+        """Test that deep side branches are dropped."""
+        start = utils.timestamp() - 1000
+        base = gen_chain(2, start)
+        t = start + 2 * block.BLOCK_INTERVAL
+        a = extend_chain(base, 1, t, tag=b'a')
+        b = extend_chain(base, 4, t, tag=b'b')
+        tree = blocktree.BlockTree(side_depth=2)
+
+        assert tree.add_chain(a) and tree.add_chain(b[:3])
+        tree.reorg()
+        assert tree.side == {b[2]['header']['this_hash']}
+        assert tree.add_chain(b)
+        tree.reorg()
+        assert tree.side == set() and len(tree) == len(b) == 6
+        assert a[2]['header']['this_hash'] not in tree
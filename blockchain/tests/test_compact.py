@@ -0,0 +1,50 @@
+"""Test compact block relay.
+"""
+
+
+from helpers import gen_txn # type: ignore
+from toycoin import block, transaction # type: ignore
+from toycoin.network import compact # type: ignore
+
+
+################################################################################
+
+
+class TestCompact:
+
+    def test_short_ids(self):
+        """Test short ids are salted with the block hash."""
+        h = transaction.hash_txn(gen_txn(0))
+        s = compact.short_id(h, block.GENESIS)
+
+        assert len(s) == compact.SHORT_ID_BYTES
+        assert s == compact.short_id(h, block.GENESIS)
+        assert s != compact.short_id(h, b'other block')
+
+
+    def test_reconstruct(self):
+        """Test rebuilding block txns from a mempool, and filling gaps."""
+        txns = [gen_txn(i) for i in range(4)]
+        b, _ = block.gen_block(block.GENESIS, txns, block.INITIAL_TARGET)
+        h = b['header']['this_hash']
+        ids = compact.short_ids(b)
+        pool = {transaction.hash_txn(txn): txn for txn in txns[1:3]}
+        pool[b'unrelated'] = gen_txn(9)
+
+        partial = compact.reconstruct(h, ids, pool)
+        assert partial == [None] + txns[1:3] + [None]
+        assert compact.missing(partial) == [0, 3]
+
+        assert not compact.fill(partial, [0, 3], txns[:1])
+        assert not compact.fill(partial, [0], txns[:1])
+        assert compact.fill(partial, [3], txns[3:])
+        assert partial == txns
+
+
+    def test_reconstruct_ambiguous(self, monkeypatch):
+        """Test that txns with colliding short ids are treated as missing."""
+        txns = [gen_txn(i) for i in range(2)]
+        pool = {transaction.hash_txn(txn): txn for txn in txns}
+        monkeypatch.setattr(compact, 'short_id', lambda txn_hash, h: b'same')
+
+        assert compact.reconstruct(block.GENESIS, [b'same'], pool) == [None]
@@ -0,0 +1,72 @@
+"""Test windowed network statistics.
+"""
+
+
+import json # type: ignore
+from helpers import gen_chain # type: ignore
+from toycoin.network import compact, dashboard, msg_protocol, serialize # type: ignore
+
+
+################################################################################
+
+
+def frame(data: bytes) -> bytes:
+    return b''.join(msg_protocol.encode_frame(b'/topic/main', data))
+
+
+def cmpt(node: str, chain) -> bytes:
+    b = chain[-1]
+    block_ = serialize.pack_compact_block(b['header'], compact.short_ids(b))
+    announcement = {'node': node, 'height': len(chain), 'block': block_}
+    return frame(b'CMPT' + json.dumps(announcement).encode())
+
+
+class TestDashboard:
+
+    def test_announced_tip(self):
+        """Test that each chain message yields its publisher, height and
+        tip."""
+        chain = gen_chain(3)
+        h = serialize.b2s(chain[-1]['header']['this_hash'])
+        f = lambda data: dashboard.announced_tip(
+            msg_protocol.decode_frame(data)[1])
+
+        assert f(cmpt('a', chain)) == ('a', 3, h)
+        headers = serialize.pack_headers([b['header'] for b in chain])
+        hdrs = json.dumps({'node': 'b', 'headers': headers}).encode()
+        assert f(frame(b'HDRS' + hdrs)) == ('b', 3, h)
+        for version in serialize.WIRE_VERSIONS:
+            packed = serialize.pack_blockchain(chain, version=version)
+            assert f(frame(b'BLOC' + packed.encode())) == ('BLOC', 3, h)
+        stats = {'node': 'c', 'metrics': {'chain_height': {'value': 2}}}
+        assert f(frame(b'STAT' + json.dumps(stats).encode())) == ('c', 2, None)
+        assert f(frame(b'TXN {}')) is None
+
+
+    def test_observe(self):
+        """Test window counts, heights and forks."""
+        chain = gen_chain(3)
+        fork = gen_chain(3, tag=b'fork')
+        d = dashboard.Dashboard(0)
+
+        for _ in range(5):
+            d.observe(frame(b'TXN not decoded'))
+        d.observe(cmpt('a', chain[:2]))
+        d.observe(cmpt('b', chain[:2])) # same block
+        d.observe(cmpt('a', chain))
+        d.observe(cmpt('b', fork)) # another block at the same height
+        d.observe(frame(b'CMPT not json'))
+
+        assert d.counts['TXN '] == 5 and d.counts['CMPT'] == 5
+        assert d.counts['(bad)'] == 1
+        assert d.heights == {'a': 3, 'b': 3}
+        assert d.blocks == 3 and d.forks == 1
+
+        s = d.render(10)
+        assert 'txns/s 0.50' in s and 'blocks/s 0.300' in s
+        assert 'forks 1 (total 1)' in s and 'a 3' in s
+
+        d.reset(10)
+        assert d.counts['TXN '] == 0 and d.forks == 0
+        assert d.forks_total == 1 and d.heights['a'] == 3
+        assert 'msgs: -' in d.render(20)
@@ -0,0 +1,141 @@
+"""Test mempool.
+"""
+
+
+import pytest # type: ignore
+from helpers import gen_txn # type: ignore
+from toycoin import block, merkle, transaction # type: ignore
+from toycoin.network import mempool, serialize # type: ignore
+
+
+################################################################################
+
+
+def gen_txn_pair(i: int, value: int) -> transaction.TxnPair:
+    """Txn pair with distinct (unsigned) txn."""
+    return ([], gen_txn(i, value))
+
+
+class TestMempool:
+
+    def test_add_remove(self, monkeypatch):
+        """Test adding (with dedup) and removing txns."""
+        pool = mempool.Mempool()
+        p0, p1 = gen_txn_pair(0, 10), gen_txn_pair(1, 20)
+
+        h0 = pool.add(p0, 100)
+        pool.add(p1, 200)
+        assert pool.add(p0, 100) == h0
+        assert len(pool) == 2
+        assert h0 in pool
+        assert pool.total_bytes() == 300
+        assert pool.size(p1[1]) == 200
+        # sizes are looked up by the pending txn object, without re-hashing
+        monkeypatch.setattr(transaction, 'hash_txn', None)
+        assert pool.size(p0[1]) == 100
+        assert pool.size(dict(p1[1])) == transaction.txn_size(p1[1])
+        monkeypatch.undo()
+
+        pool.remove([p0[1]])
+        assert pool.txn_pairs() == [p1]
+        pool.clear()
+        assert len(pool) == 0
+
+
+    def test_select(self):
+        """Test selection by arrival and by priority."""
+        pool = mempool.Mempool()
+        pairs = [gen_txn_pair(i, v) for i, v in enumerate([5, 20, 10, 20])]
+        for pair in pairs:
+            pool.add(pair, 100, pair[1]['receiver_value'])
+
+        assert pool.select('arrival') == pairs
+        assert pool.select('priority') == [pairs[1], pairs[3],
+                                           pairs[2], pairs[0]]
+        with pytest.raises(ValueError):
+            pool.select('random')
+
+
+    def test_root(self, monkeypatch):
+        """Test that the live root tracks pending txns in arrival order, and
+        that block assembly takes roots from the pool without re-hashing.
+        """
+        pool = mempool.Mempool()
+        pairs = [gen_txn_pair(i, 10) for i in range(5)]
+        hashes = [transaction.hash_txn(txn) for _, txn in pairs]
+        txns = [txn for _, txn in pairs]
+
+        assert pool.root() is None
+        for p in pairs:
+            pool.add(p, 100)
+        assert pool.root() == merkle.from_list(hashes).label
+
+        monkeypatch.setattr(transaction, 'hash_txn', None)
+        assert pool.merkle_root(txns) == pool.root()
+        assert pool.merkle_root(txns[:2]) == merkle.from_list(hashes[:2]).label
+        b, _ = block.gen_block(block.GENESIS, txns, block.INITIAL_TARGET,
+                               root=pool.merkle_root)
+        pool.remove(txns[1:3])
+        monkeypatch.undo()
+
+        assert block.valid_merkle_root(b)
+        assert pool.root() == merkle.from_list(hashes[:1] + hashes[3:]).label
+        pool.clear()
+        assert pool.root() is None
+
+
+    def test_evict(self):
+        """Test that the pool stays within its byte budget, evicting oldest
+        or lowest priority txns first."""
+        pairs = [gen_txn_pair(i, v) for i, v in enumerate([5, 20, 10, 20])]
+
+        pool = mempool.Mempool(max_bytes=300)
+        for pair in pairs:
+            pool.add(pair, 100, pair[1]['receiver_value'])
+        assert pool.txn_pairs() == pairs[1:]
+        assert pool.total_bytes() == 300 and pool.evicted == 1
+        assert pool.add(gen_txn_pair(9, 1), 301) is None
+
+        pool = mempool.Mempool(max_bytes=300, evict='priority')
+        for pair in pairs:
+            pool.add(pair, 100, pair[1]['receiver_value'])
+        assert pool.txn_pairs() == [pairs[1], pairs[2], pairs[3]]
+        assert pool.add(gen_txn_pair(9, 1), 100, 1) is None
+        pool.remove([pairs[2][1]])
+        assert pool.add(gen_txn_pair(9, 1), 100, 1) is not None
+        assert pool.txn_pairs() == [pairs[1], pairs[3], gen_txn_pair(9, 1)]
+        assert pool.root() == merkle.root([transaction.hash_txn(txn)
+                                           for _, txn in pool.txn_pairs()])
+
+        with pytest.raises(ValueError):
+            mempool.Mempool(evict='random')
+
+
+    def test_expire(self):
+        """Test that txns expire after waiting too long."""
+        pool = mempool.Mempool(expiry=10)
+        pairs = [gen_txn_pair(i, 10) for i in range(4)]
+        for t, pair in enumerate(pairs):
+            pool.add(pair, 100, now=t * 5)
+
+        assert pool.expire(now=9) == 0
+        assert pool.expire(now=16) == 2
+        assert pool.txn_pairs() == pairs[2:]
+        assert pool.total_bytes() == 200 and pool.expired == 2
+
+
+    def test_snapshot(self):
+        """Test that a restored snapshot keeps order, sizes, priorities and
+        arrival times, without expired txns."""
+        pool = mempool.Mempool(expiry=10)
+        pairs = [gen_txn_pair(i, 10 * i) for i in range(3)]
+        for t, pair in enumerate(pairs):
+            pool.add(pair, 100 + t, pair[1]['receiver_value'], now=t * 5)
+
+        packed = serialize.pack_mempool(pool.snapshot())
+        restored = mempool.Mempool(expiry=10)
+        assert restored.restore(serialize.unpack_mempool(packed), now=12) == 2
+        assert [e[1:] for e in restored.snapshot()] == \
+            [e[1:] for e in pool.snapshot()[1:]]
+        assert restored.root() == merkle.root([transaction.hash_txn(txn)
+                                               for _, txn in pairs[1:]])
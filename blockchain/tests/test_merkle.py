@@ -1,4 +1,5 @@
 
+from concurrent.futures import ThreadPoolExecutor # type: ignore
 from toycoin import hash # type: ignore
 from toycoin import merkle # type: ignore
 
@@ -72,3 +73,34 @@ class TestMerkle:
         # just checking the attack prevention is working as expected
         assert t.label[1:] == hash.hash(b'\x01' + h1[1:] +
                                         b'\x01' + h2[1:])
+
+
+    def test_root(self):
+        """Test that level-wise roots, serial and parallel, match from_list."""
+        leaves = [hash.hash(str(i).encode()) for i in range(70)]
+
+        assert merkle.root([]) is None
+        assert merkle.root_parallel([]) is None
+        with ThreadPoolExecutor(2) as executor:
+            for n in range(1, len(leaves) + 1):
+                label = merkle.from_list(leaves[:n]).label
+                assert merkle.root(leaves[:n]) == label
+                for chunk_size in [2, 4, 6]:
+                    assert merkle.root_parallel(leaves[:n], executor,
+                                                0, chunk_size) == label
+                assert merkle.root_parallel(leaves[:n], executor,
+                                            8, 4) == label
+
+
+    def test_frontier(self):
+        """Test that frontier roots match from_list after every append."""
+        leaves = [hash.hash(str(i).encode()) for i in range(70)]
+        frontier = merkle.MerkleFrontier()
+
+        assert frontier.root() is None
+        for n, leaf in enumerate(leaves, 1):
+            frontier.append(leaf)
+            assert len(frontier) == n
+            assert frontier.root() == merkle.from_list(leaves[:n]).label
+        assert len(frontier.peaks) == 7 # 70 leaves, 7 levels
+        assert merkle.MerkleFrontier(leaves).root() == frontier.root()
@@ -0,0 +1,59 @@
+"""Test metrics registry.
+"""
+
+
+import pytest # type: ignore
+from toycoin.network import metrics # type: ignore
+
+
+################################################################################
+
+
+class TestMetrics:
+
+    def test_counter_gauge(self):
+        """Test counter and gauge updates."""
+        r = metrics.Registry()
+
+        r.counter('c').inc()
+        r.counter('c').inc(2)
+        assert r.counter('c').value == 3
+
+        g = r.gauge('g')
+        g.set(5)
+        g.inc()
+        g.dec(3)
+        assert r.gauge('g').value == 3
+
+
+    def test_histogram(self):
+        """Test histogram buckets and summary stats."""
+        h = metrics.Registry().histogram('h', bounds=[1, 10])
+
+        for v in (0.5, 1, 5, 50):
+            h.observe(v)
+
+        assert h.buckets == [2, 1, 1]
+        assert h.count == 4
+        assert h.sum == 56.5
+        assert (h.min, h.max) == (0.5, 50)
+
+        with h.time():
+            pass
+        assert h.count == 5
+
+
+    def test_registry(self):
+        """Test snapshot and type checks."""
+        r = metrics.Registry()
+        r.counter('b.count').inc()
+        r.histogram('a.seconds').observe(0.1)
+
+        snap = r.snapshot()
+        assert list(snap) == ['a.seconds', 'b.count']
+        assert snap['b.count'] == {'type': 'counter', 'value': 1}
+        assert snap['a.seconds']['count'] == 1
+        assert 'b.count: 1' in metrics.show_snapshot(snap)
+
+        with pytest.raises(AssertionError):
+            r.gauge('b.count')
@@ -0,0 +1,156 @@
+"""Test message protocol.
+"""
+
+
+import asyncio # type: ignore
+import os # type: ignore
+import pytest # type: ignore
+from toycoin.network import msg_protocol # type: ignore
+
+
+################################################################################
+
+
+def frame(channel: bytes, data: bytes, compress_min=None) -> bytes:
+    return b''.join(msg_protocol.encode_frame(channel, data,
+                                              compress_min=compress_min))
+
+
+class FakeStream:
+
+    def __init__(self):
+        self.parts = []
+        self.drains = 0
+
+    def writelines(self, parts):
+        self.parts.extend(bytes(p) for p in parts)
+
+    async def drain(self):
+        self.drains += 1
+        await asyncio.sleep(0)
+
+
+################################################################################
+
+
+class TestFrames:
+
+    def test_encode_decode(self):
+        """Test that channel and data survive a round trip."""
+        f = frame(b'/topic/main', b'TXN {"a": 1}')
+
+        assert msg_protocol.decode_frame(f) == (b'/topic/main', b'TXN {"a": 1}')
+        assert msg_protocol.peek_frame(f) == (0, b'TXN ', b'/topic/main')
+        assert int.from_bytes(f[:4], 'big') == len(f) - 4
+        assert msg_protocol.decode_frame(frame(b'', b'SUB ')) == (b'', b'SUB ')
+
+        with pytest.raises(ValueError):
+            frame(b'x' * 256, b'TXN ')
+
+
+    def test_compress(self):
+        """Test that large bodies are compressed, and small ones are not."""
+        data = b'BLOC' + b'{"sender": "-----BEGIN PUBLIC KEY-----"}' * 100
+        small = frame(b'/a', data, compress_min=len(data))
+        large = frame(b'/a', data, compress_min=1024)
+
+        assert small == frame(b'/a', data)
+        assert len(large) < len(small) // 10
+        assert msg_protocol.peek_frame(large) == (msg_protocol.COMPRESSED,
+                                                  b'BLOC', b'/a')
+        assert msg_protocol.decode_frame(large) == (b'/a', data)
+        assert msg_protocol.decompress_frame(large) == small
+        assert msg_protocol.decompress_frame(small) == small
+
+        # incompressible bodies are sent as they are
+        noise = b'TXN ' + os.urandom(1024)
+        assert frame(b'/a', noise, compress_min=0) == frame(b'/a', noise)
+
+
+class TestHandshake:
+
+    def test_negotiate(self):
+        """Test that the first supported algorithm offered is chosen."""
+        f = msg_protocol.negotiate
+        hello = msg_protocol.hello_msg
+
+        assert f(hello(['lz4', 'zlib']), ['zlib']) == 'zlib'
+        assert f(hello(['zlib']), []) is None
+        assert f(hello([]), ['zlib']) is None
+
+
+    def test_hello(self):
+        """Test that compression is used only once the relay accepts it."""
+        async def hello(reader, writer, reply, compress_min):
+            reader.stream = asyncio.StreamReader()
+            reader.stream.feed_data(frame(b'', msg_protocol.hello_msg(reply)))
+            return await msg_protocol.hello(reader, writer, compress_min)
+
+        def run(reply, compress_min):
+            reader = msg_protocol.FrameReader(None)
+            writer = msg_protocol.FrameWriter(FakeStream())
+            algorithm = asyncio.run(hello(reader, writer, reply, compress_min))
+            _, offer = msg_protocol.decode_frame(writer.stream.parts[0] +
+                                                 writer.stream.parts[1])
+            return algorithm, writer.compress_min, offer
+
+        assert run(['zlib'], 100) == ('zlib', 100,
+                                      msg_protocol.hello_msg(['zlib']))
+        assert run([], 100) == (None, None, msg_protocol.hello_msg(['zlib']))
+        assert run(['zlib'], -1) == (None, None, msg_protocol.hello_msg([]))
+
+
+class TestFrameReader:
+
+    def test_read(self):
+        """Test that all complete frames are parsed from one read, and that
+        frames split across reads are reassembled."""
+        frames = [frame(b'/a', b'TXN ' + bytes([i]) * i) for i in range(5)]
+        data = b''.join(frames)
+
+        async def run():
+            stream = asyncio.StreamReader()
+            stream.feed_data(data[:-3])
+            reader = msg_protocol.FrameReader(stream)
+            first = await reader.read()
+            stream.feed_data(data[-3:])
+            stream.feed_eof()
+            rest = await reader.read()
+            with pytest.raises(asyncio.IncompleteReadError):
+                await reader.read()
+            return first, rest
+
+        first, rest = asyncio.run(run())
+        assert first == frames[:4]
+        assert rest == frames[4:]
+
+
+    def test_read_large_frame(self):
+        """Test frames larger than a read, one at a time."""
+        frames = [frame(b'/a', b'BLOC' + b'x' * 1000), frame(b'/b', b'TXN ')]
+
+        async def run():
+            stream = asyncio.StreamReader()
+            stream.feed_data(b''.join(frames))
+            stream.feed_eof()
+            reader = msg_protocol.FrameReader(stream, read_size=64)
+            return [await reader.read_frame(), await reader.read_frame()]
+
+        assert asyncio.run(run()) == frames
+
+
+class TestFrameWriter:
+
+    def test_coalesce(self):
+        """Test that sends arriving during a drain share the next drain."""
+        stream = FakeStream()
+        writer = msg_protocol.FrameWriter(stream)
+        msgs = [b'TXN ' + bytes([i]) for i in range(10)]
+
+        async def run():
+            await asyncio.gather(*[writer.send(b'/a', msg) for msg in msgs])
+
+        asyncio.run(run())
+        frames = b''.join(stream.parts)
+        assert frames == b''.join(frame(b'/a', msg) for msg in msgs)
+        assert stream.drains == writer.drains == 2
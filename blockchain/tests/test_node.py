@@ -0,0 +1,322 @@
+"""Test node validation pipeline.
+"""
+
+
+import argparse # type: ignore
+import asyncio # type: ignore
+import json # type: ignore
+from asyncio import Queue # type: ignore
+from helpers import extend_chain, gen_chain, gen_txn # type: ignore
+from toycoin import block, signature, utils, wallet # type: ignore
+from toycoin.network import blocktree, compact, mempool, metrics, node, seen, serialize, sync # type: ignore
+
+
+################################################################################
+
+
+def use_registry(monkeypatch) -> metrics.Registry:
+    registry = metrics.Registry()
+    monkeypatch.setattr(node, 'METRICS', registry)
+    return registry
+
+
+def use_tree(monkeypatch, chain: block.Blockchain) -> blocktree.BlockTree:
+    """Block tree holding just chain, as the node's chain."""
+    tree = blocktree.BlockTree()
+    assert tree.add_chain(chain)
+    tree.reorg()
+    index = block.ChainIndex()
+    index.update(tree.chain)
+    monkeypatch.setattr(node, 'TREE', tree)
+    monkeypatch.setattr(node, 'BLOCKCHAIN', tree.chain)
+    monkeypatch.setattr(node, 'INDEX', index)
+    monkeypatch.setattr(node, 'CHECKPOINTS', {})
+    return tree
+
+
+async def run(metric, f, *args):
+    return f(*args)
+
+
+################################################################################
+
+
+class TestPipeline:
+
+    def test_receive_sheds_txns(self, monkeypatch):
+        """Test that txns are shed, and other messages wait, on a full inbox."""
+        registry = use_registry(monkeypatch)
+        monkeypatch.setattr(node, 'SEEN', seen.SeenFilter())
+
+        async def run():
+            inbox: Queue = Queue(1)
+            await node.receive(b'TXN 1', inbox)
+            await node.receive(b'TXN 2', inbox)
+            assert inbox.qsize() == 1
+            assert registry.counter('txns_shed').value == 1
+
+            put = asyncio.create_task(node.receive(b'BLOC', inbox))
+            await asyncio.sleep(0)
+            assert not put.done()
+            assert await inbox.get() == b'TXN 1'
+            await put
+            assert await inbox.get() == b'BLOC'
+
+        asyncio.run(run())
+
+
+    def test_receive_drops_duplicate_txns(self, monkeypatch):
+        """Test that repeated txns are dropped before decoding, and that
+        shed txns are not remembered."""
+        registry = use_registry(monkeypatch)
+        monkeypatch.setattr(node, 'SEEN', seen.SeenFilter())
+
+        async def run():
+            inbox: Queue = Queue(2)
+            for data in [b'TXN 1', b'TXN 1', b'BLOC', b'TXN 2']:
+                await node.receive(data, inbox)
+            assert [inbox.get_nowait() for _ in range(2)] == [b'TXN 1', b'BLOC']
+            assert registry.counter('txns_duplicate').value == 1
+            assert registry.counter('txns_shed').value == 1
+
+            await node.receive(b'TXN 2', inbox)
+            assert inbox.get_nowait() == b'TXN 2'
+
+        asyncio.run(run())
+
+
+    def test_handle_blocks(self, monkeypatch):
+        """Test that a chain is adopted only if it has more work, and that
+        its new txns leave the mempool."""
+        registry = use_registry(monkeypatch)
+        chain = gen_chain(3)
+        use_tree(monkeypatch, chain[:1])
+        pool = mempool.Mempool()
+        pending = gen_txn(100)
+        for txn in [chain[0]['txns'][0], chain[1]['txns'][0], pending]:
+            pool.add(([], txn), 1)
+        monkeypatch.setattr(node, 'MEMPOOL', pool)
+        monkeypatch.setattr(node, 'in_pool', run)
+
+        assert asyncio.run(node.handle_blocks(chain[:2]))
+        assert node.BLOCKCHAIN == chain[:2]
+        # txns of blocks we already had are left alone
+        assert pool.txn_pairs() == [([], chain[0]['txns'][0]), ([], pending)]
+
+        for blocks in [chain[:2], chain[:1], chain[:1] + chain[2:]]:
+            assert not asyncio.run(node.handle_blocks(blocks))
+        assert node.BLOCKCHAIN == chain[:2]
+        assert registry.counter('chains_rejected').value == 3
+        assert registry.counter('chains_adopted').value == 1
+
+
+    def test_reorg(self, monkeypatch):
+        """Test that txns of unwound blocks return to the mempool, if their
+        sources are still in the chain."""
+        registry = use_registry(monkeypatch)
+        priv_key = signature.gen_priv_key()
+        a = wallet.Wallet(signature.get_pub_key_bytes(priv_key), priv_key)
+        txn0 = {**gen_txn(0, 100), 'receiver': a.public_key}
+        a.receive(txn0)
+        tokens, spend = a.send(10, b'bob')
+
+        start = utils.timestamp() - 1000
+        base = gen_chain(1, start, txns=[txn0])
+        t = start + block.BLOCK_INTERVAL
+        b1, _ = block.gen_block(base[0]['header']['this_hash'],
+                                [spend, gen_txn(1)], block.next_target(base),
+                                timestamp=t)
+        fork = extend_chain(base, 2, t, spacing=1, tag=b'fork')
+        use_tree(monkeypatch, base + [b1])
+        pool = mempool.Mempool()
+        monkeypatch.setattr(node, 'MEMPOOL', pool)
+        monkeypatch.setattr(node, 'in_pool', run)
+
+        assert asyncio.run(node.handle_blocks(fork))
+        assert node.BLOCKCHAIN == fork
+        assert pool.txn_pairs() == [(tokens, spend)]
+        assert registry.counter('reorgs').value == 1
+        # unsigned genesis txn is not restored
+        assert registry.counter('txns_dropped').value == 1
+
+
+    def test_mine_block_stale_tip(self, monkeypatch):
+        """Test that a block mined on a replaced chain is not adopted."""
+        registry = use_registry(monkeypatch)
+        chain = gen_chain(3)
+        tree = use_tree(monkeypatch, chain[:1])
+        ours = node.BLOCKCHAIN
+
+        pool = mempool.Mempool()
+        included, pending = gen_txn(1), gen_txn(100)
+        pool.add(([], included), 1)
+        pool.add(([], pending), 1)
+        monkeypatch.setattr(node, 'MEMPOOL', pool)
+
+        # a heavier chain (including one of our txns) arrives while mining
+        async def replace(metric, f, *args):
+            tree.add_chain(chain)
+            return f(*args)
+        monkeypatch.setattr(node, 'in_pool', replace)
+
+        args = argparse.Namespace(select='arrival', delay=0,
+                                  block_interval=block.BLOCK_INTERVAL,
+                                  block_txns=block.BLOCK_MAX_TXNS,
+                                  block_bytes=block.BLOCK_MAX_BYTES,
+                                  announce='compact')
+        added = asyncio.run(node.mine_block(pool, None, '/topic/main', args))
+
+        assert added is False
+        assert node.BLOCKCHAIN == chain
+        assert ours == chain[:1]
+        assert pool.txn_pairs() == [([], pending)]
+        assert registry.counter('blocks_stale').value == 1
+        assert len(tree) == 4 # our block is kept, off the chain
+
+
+    def test_mine_block_failed(self, monkeypatch, tmp_path):
+        """Test that txns stay pending when no block is mined, and survive
+        a restart through the snapshot."""
+        registry = use_registry(monkeypatch)
+        use_tree(monkeypatch, gen_chain(1))
+        pool = mempool.Mempool()
+        pairs = [([], gen_txn(i)) for i in range(3)]
+        for pair in pairs:
+            pool.add(pair, 100)
+        monkeypatch.setattr(node, 'MEMPOOL', pool)
+        monkeypatch.setattr(node, 'gen_block', lambda chain, txns, *args:
+                            (None, txns))
+
+        args = argparse.Namespace(select='arrival', delay=0,
+                                  block_interval=block.BLOCK_INTERVAL,
+                                  block_txns=block.BLOCK_MAX_TXNS,
+                                  block_bytes=block.BLOCK_MAX_BYTES)
+        added = asyncio.run(node.mine_block(pool, None, '/topic/main', args))
+        assert added is False
+        assert pool.txn_pairs() == pairs
+        assert registry.counter('blocks_discarded').value == 1
+
+        path = str(tmp_path / 'mempool.jsonl')
+        node.save_mempool(path)
+        with open(path) as f:
+            restored = serialize.unpack_mempool(f.read())
+        assert [e.txn_pair for e in restored] == pairs
+
+
+    def test_checkpoint(self, monkeypatch, tmp_path):
+        """Test that deep enough blocks are checkpointed and saved."""
+        chain = gen_chain(3)
+        path = tmp_path / 'checkpoints.json'
+        monkeypatch.setattr(node, 'BLOCKCHAIN', chain)
+        monkeypatch.setattr(node, 'CHECKPOINTS', {})
+        use_registry(monkeypatch)
+
+        args = argparse.Namespace(checkpoint_depth=1, checkpoints=str(path))
+        node.checkpoint(args)
+        saved = serialize.unpack_checkpoints(path.read_text())
+        assert saved == node.CHECKPOINTS == {1: chain[1]['header']['this_hash']}
+
+        args.checkpoint_depth = 5
+        node.checkpoint(args)
+        assert node.CHECKPOINTS == saved
+
+
+    def test_handle_chain_checks_headers_first(self, monkeypatch):
+        """Test that a lighter or invalid chain is rejected before its txns
+        are decoded."""
+        registry = use_registry(monkeypatch)
+        chain = gen_chain(3)
+        use_tree(monkeypatch, chain[:2])
+        monkeypatch.setattr(node, 'SYNC', sync.HeaderSync())
+
+        def decode(s):
+            raise AssertionError('txns decoded')
+        monkeypatch.setattr(node, 'in_pool', run)
+        monkeypatch.setattr(serialize, 'unpack_blockchain', decode)
+
+        args = argparse.Namespace(block_interval=block.BLOCK_INTERVAL,
+                                  checkpoint_depth=-1)
+        bad_link = chain[:1] + chain[2:] + chain[1:2]
+        for blocks in [chain[:1], chain[:2], bad_link]:
+            payload = serialize.pack_blockchain(blocks).encode()
+            asyncio.run(node.handle_chain(payload, args))
+        assert registry.counter('chains_rejected').value == 3
+
+
+    def test_sync_worker(self, monkeypatch):
+        """Test that body requests are repeated on a fixed schedule."""
+        calls = []
+        async def request(writer, channel):
+            calls.append(channel)
+        monkeypatch.setattr(node, 'request_bodies', request)
+
+        async def run():
+            task = asyncio.create_task(node.sync_worker(None, '', 0.01))
+            await asyncio.sleep(0.1)
+            task.cancel()
+
+        asyncio.run(run())
+        assert len(calls) >= 3
+
+
+    def test_compact_block(self, monkeypatch):
+        """Test rebuilding a compact block from the mempool, requesting only
+        the missing txns."""
+        registry = use_registry(monkeypatch)
+        chain = gen_chain(2)
+        tip = chain[1]
+        pool = mempool.Mempool()
+        use_tree(monkeypatch, chain[:1])
+        monkeypatch.setattr(node, 'MEMPOOL', pool)
+        monkeypatch.setattr(node, 'SYNC', sync.HeaderSync())
+        monkeypatch.setattr(node, 'PARTIAL', {})
+        monkeypatch.setattr(node, 'ME', 'me')
+
+        sent = []
+        async def send(writer, channel, msg):
+            sent.append(msg)
+        monkeypatch.setattr(node, 'in_pool', run)
+        monkeypatch.setattr(node, 'send_channel_msg', send)
+
+        args = argparse.Namespace(block_interval=block.BLOCK_INTERVAL,
+                                  checkpoint_depth=-1)
+        block_ = serialize.pack_compact_block(tip['header'],
+                                              compact.short_ids(tip))
+        work = block.chain_work([b['header'] for b in chain])
+        payload = json.dumps({'node': 'peer', 'height': 2, 'work': work,
+                              'block': block_}).encode()
+
+        # tip txn is not in our mempool: it is requested from the peer
+        asyncio.run(node.handle_compact(payload, None, '', args))
+        request = json.loads(sent[-1][4:])
+        assert sent[-1][:4] == b'GETT'
+        assert request['node'] == 'peer' and request['indexes'] == [0]
+
+        # the peer answers with just that txn
+        monkeypatch.setattr(node, 'ME', 'peer')
+        monkeypatch.setattr(node, 'BLOCKCHAIN', chain)
+        asyncio.run(node.serve_txns(sent[-1][4:], None, ''))
+        assert sent[-1][:4] == b'BTXN'
+
+        monkeypatch.setattr(node, 'ME', 'me')
+        use_tree(monkeypatch, chain[:1])
+        asyncio.run(node.handle_block_txns(sent[-1][4:], None, '', args))
+        assert node.BLOCKCHAIN == chain
+        assert node.PARTIAL == {}
+
+        # with the txn in our mempool, nothing is requested
+        use_tree(monkeypatch, chain[:1])
+        pool.add(([], tip['txns'][0]), 1)
+        sent.clear()
+        asyncio.run(node.handle_compact(payload, None, '', args))
+        assert sent == []
+        assert node.BLOCKCHAIN == chain
+        assert registry.counter('compact_txns_missing').value == 1
+
+        # a block not on our tip is synced headers-first, if heavier
+        use_tree(monkeypatch, gen_chain(1, tag=b'other'))
+        asyncio.run(node.handle_compact(payload, None, '', args))
+        assert sent[-1] == b'GETH' + json.dumps({'node': 'peer'}).encode()
+        use_tree(monkeypatch, gen_chain(3, tag=b'other'))
+        asyncio.run(node.handle_compact(payload, None, '', args))
+        assert len(sent) == 1
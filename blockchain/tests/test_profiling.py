@@ -0,0 +1,102 @@
+"""Test profiling hooks.
+"""
+
+
+import asyncio # type: ignore
+import os # type: ignore
+import threading # type: ignore
+import logging # type: ignore
+import time # type: ignore
+import tracemalloc # type: ignore
+from toycoin.network import profiling # type: ignore
+
+
+################################################################################
+
+
+def busy_wait(stop: threading.Event):
+    """Spin until stopped."""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiling:
+
+    def test_sampler(self):
+        """Test that sampled stacks include a busy thread's function."""
+        stop = threading.Event()
+        t = threading.Thread(target=busy_wait, args=(stop,), name='busy')
+        t.start()
+
+        sampler = profiling.Sampler(interval=0.001)
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        stop.set()
+        t.join()
+
+        assert sampler.samples > 0
+        report = sampler.report()
+        assert 'busy;' in report
+        assert ':busy_wait:' in report
+
+
+    def test_profiler(self, tmp_path):
+        """Test toggle on and off, with a slow callback on the loop."""
+        out_dir = str(tmp_path)
+
+        async def run():
+            profiler = profiling.install('test', out_dir, slow_callback=0.01)
+            profiler.toggle()
+            asyncio.get_running_loop().call_soon(time.sleep, 0.05)
+            await asyncio.sleep(0.1)
+            data = [bytes(1000) for _ in range(100)]
+            profiler.toggle()
+            return profiler, data
+
+        profiler, _ = asyncio.run(run())
+        assert not profiler.active
+
+        files = sorted(os.listdir(out_dir))
+        assert [f.split('.')[-2] for f in files] == ['memory', 'slow',
+                                                     'stacks']
+
+        slow = [f for f in files if '.slow.' in f][0]
+        with open(os.path.join(out_dir, slow)) as f:
+            report = f.read()
+        assert report.startswith('1 slow callbacks')
+        assert 'sleep' in report
+
+
+    def test_slow_callback_log(self):
+        """Test that unrelated or malformed asyncio records are ignored."""
+        log = profiling.SlowCallbackLog()
+        record = lambda msg, args: logging.LogRecord(
+            'asyncio', logging.WARNING, __file__, 0, msg, args, None)
+
+        log.emit(record('Executing %s took %.3f seconds', ('<Handle>', 0.5)))
+        log.emit(record(ValueError('not a str'), None))
+        log.emit(record('Executing %(handle)s', ({'handle': 'x'},)))
+        log.emit(record('Executing %s took %s seconds', ('<Handle>', 'slow')))
+
+        assert len(log.records) == 1
+        assert log.records[0][1:] == ('<Handle>', 0.5)
+
+
+    def test_keeps_existing_tracemalloc(self, tmp_path):
+        """Test that stopping leaves tracing started elsewhere running."""
+        async def run():
+            profiler = profiling.Profiler('test', str(tmp_path),
+                                          asyncio.get_running_loop())
+            profiler.start()
+            profiler.stop()
+
+        tracemalloc.start()
+        try:
+            asyncio.run(run())
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+        asyncio.run(run())
+        assert not tracemalloc.is_tracing()
@@ -0,0 +1,23 @@
+"""Test recently seen filter.
+"""
+
+
+from toycoin.network import seen # type: ignore
+
+
+################################################################################
+
+
+class TestSeenFilter:
+
+    def test_add(self):
+        """Test that repeats are reported, and old keys evicted."""
+        f = seen.SeenFilter(2)
+        a, b, c = seen.digest(b'a'), seen.digest(b'b'), seen.digest(b'c')
+
+        assert len(a) == seen.DIGEST_BYTES and a != b
+        assert f.add(a) and f.add(b)
+        assert not f.add(a) # a is now the most recently seen
+        assert f.add(c)
+        assert len(f) == 2
+        assert a in f and c in f and b not in f
@@ -2,7 +2,7 @@
 """
 
 
-from toycoin import block # type: ignore
+from toycoin import block, hash # type: ignore
 from toycoin.network import serialize # type: ignore
 
 
@@ -28,6 +28,15 @@ txn0b = {'previous_hashes': [b'2'],
          'sender_signature': b'sender2_signature'
          }
 
+txn2 = {'version': 2,
+        'previous_hashes': [b'3'],
+        'receiver': b'receiver3_public',
+        'receiver_value': 20,
+        'sender': b'sender3_public',
+        'sender_change': 5,
+        'signature': b'signature'
+        }
+
 token1 = {'txn_hash': b'random hash',
          'owner': b'some owner',
          'value': 100,
@@ -69,6 +78,7 @@ class TestSerialize:
         assert g(f(txn0a)) == txn0a
         assert g(f(txn0b)) == txn0b
         assert g(f(txn0a)) != txn0b
+        assert g(f(txn2)) == txn2
 
     def test_pack_unoack_txn_pairs(self):
           """Test round trip pack and unpack for tokens, txn pairs."""
@@ -87,9 +97,89 @@ class TestSerialize:
 
         block0, [] = block.gen_block(block.GENESIS,
                                     [txn0a, txn0b],
-                                    1)
+                                    block.INITIAL_TARGET)
         blockchain = [block0]
 
         f = serialize.pack_blockchain
         g = serialize.unpack_blockchain
         assert g(f(blockchain)) == blockchain
+        assert g(f([])) == []
+
+
+    def test_wire_versions(self):
+        """Test that each wire version is detected and unpacked, and that
+        version 2 does not nest JSON strings."""
+        block0, [] = block.gen_block(block.GENESIS,
+                                    [txn0a, txn0b],
+                                    block.INITIAL_TARGET)
+        block1, [] = block.gen_block(block0['header']['this_hash'],
+                                    [txn0b],
+                                    block.INITIAL_TARGET)
+        chain = [block0, block1]
+        headers = [b['header'] for b in chain]
+
+        for version in serialize.WIRE_VERSIONS:
+            s = serialize.pack_blockchain(chain, version=version)
+            assert serialize.wire_version(s) == version
+            assert serialize.wire_version(s.encode()) == version
+            assert serialize.unpack_blockchain(s.encode()) == chain
+            assert serialize.unpack_blockchain_headers(s) == headers
+
+            body = serialize.pack_body(block1, version)
+            assert serialize.unpack_body(body) == (headers[1]['this_hash'],
+                                                   [txn0b])
+
+        s = serialize.pack_blockchain(chain, version=2)
+        assert '\\"' not in s
+        assert len(s) < len(serialize.pack_blockchain(chain, version=1))
+        assert '\\"' not in serialize.pack_body(block1, 2)
+
+        # txn lines are not parsed for headers
+        lines = s.splitlines()
+        lines[2] = 'not json'
+        assert serialize.unpack_blockchain_headers('\n'.join(lines)) == headers
+
+
+    def test_pack_unpack_headers_bodies(self):
+        """Test round trip pack and unpack for headers and block bodies."""
+        block0, [] = block.gen_block(block.GENESIS,
+                                    [txn0a, txn0b],
+                                    block.INITIAL_TARGET)
+        hdr = block0['header']
+        s = serialize.pack_blockchain([block0])
+
+        assert serialize.unpack_headers(serialize.pack_headers([hdr])) == [hdr]
+        assert serialize.unpack_blockchain_headers(s) == [hdr]
+
+        body = serialize.pack_body(block0)
+        assert serialize.unpack_body(body) == (hdr['this_hash'],
+                                               block0['txns'])
+        assert serialize.unpack_body_hash(body) == hdr['this_hash']
+
+        hs = [hdr['this_hash'], block.GENESIS]
+        assert serialize.unpack_hashes(serialize.pack_hashes(hs)) == hs
+
+
+    def test_pack_unpack_compact_block(self):
+        """Test round trip pack and unpack for compact blocks and txns."""
+        block0, [] = block.gen_block(block.GENESIS,
+                                    [txn0a, txn0b],
+                                    block.INITIAL_TARGET)
+        hdr = block0['header']
+        ids = [b'\x00' * 6, b'abcdef']
+
+        s = serialize.pack_compact_block(hdr, ids)
+        assert serialize.unpack_compact_block(s) == (hdr, ids)
+
+        txns = [txn0a, txn0b]
+        assert serialize.unpack_txns(serialize.pack_txns(txns)) == txns
+
+
+    def test_pack_unpack_checkpoints(self):
+        """Test round trip pack and unpack for checkpoints."""
+        checkpoints = {0: block.GENESIS, 12: hash.hash(b'12')}
+
+        f = serialize.pack_checkpoints
+        g = serialize.unpack_checkpoints
+        assert g(f(checkpoints)) == checkpoints
+        assert g(f(checkpoints, True)) == checkpoints
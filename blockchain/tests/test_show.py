@@ -0,0 +1,62 @@
+"""Test rendering of network objects.
+"""
+
+
+from helpers import gen_chain # type: ignore
+from toycoin import block # type: ignore
+from toycoin.network import show # type: ignore
+
+
+################################################################################
+
+
+class TestChainSummary:
+
+    def test_render(self):
+        """Test that only new blocks are shown, at most max_blocks."""
+        chain = gen_chain(8)
+        summary = show.ChainSummary(max_blocks=2)
+
+        s = summary.render(chain[:5])
+        assert 'Blocks: 5' in s and 'New: 5' in s and 'Valid: True' in s
+        assert '3 new blocks not shown' in s
+        assert 'Block 3 Header' in s and 'Block 4 Header' in s
+        assert 'Block 2 Header' not in s
+
+        s = summary.render(chain[:6])
+        assert 'New: 1' in s and 'not shown' not in s
+        assert 'Block 5 Header' in s and 'Block 4 Header' not in s
+
+        # nothing new: just the tip
+        s = summary.render(chain[:6])
+        assert 'New: 0' in s and 'Block 5 Header' in s
+
+        # a shorter chain, then back: the dropped blocks are new again
+        summary.render(chain[:4])
+        s = summary.render(chain)
+        assert 'New: 4' in s
+        assert len(s) < len(show.show_blockchain(chain))
+
+
+    def test_valid_cache(self, monkeypatch):
+        """Test that chains are validated once, from the last known valid
+        block."""
+        chain = gen_chain(5)
+        calls = []
+        valid_blockchain = block.valid_blockchain
+        def valid(chain, interval, checkpoints):
+            calls.append(checkpoints)
+            return valid_blockchain(chain, interval, checkpoints)
+        monkeypatch.setattr(block, 'valid_blockchain', valid)
+
+        summary = show.ChainSummary()
+        assert summary.valid_chain(chain[:3])
+        assert summary.valid_chain(chain[:3])
+        assert summary.valid_chain(chain)
+        h = chain[2]['header']['this_hash']
+        assert calls == [{}, {2: h}]
+
+        bad = chain[:3] + [{'header': chain[3]['header'], 'txns': []}]
+        assert not summary.valid_chain(bad)
+        assert 'Valid: False' in summary.render(bad)
+        assert len(calls) == 3
@@ -0,0 +1,93 @@
+"""Test headers-first sync.
+"""
+
+
+from helpers import gen_chain # type: ignore
+from toycoin import block, utils # type: ignore
+from toycoin.network import sync # type: ignore
+
+
+################################################################################
+
+
+def headers(chain: block.Blockchain):
+    return [b['header'] for b in chain]
+
+
+def work(chain: block.Blockchain) -> int:
+    return block.chain_work(headers(chain))
+
+
+class TestHeaderSync:
+
+    def test_sync(self):
+        """Test fetching missing bodies and assembling the chain."""
+        start = utils.timestamp() - 1000
+        theirs = gen_chain(6, start)
+        ours = theirs[:2]
+        s = sync.HeaderSync(max_in_flight=2, timeout=5)
+
+        assert not s.start(headers(theirs[:2]), work(theirs[:2]), work(ours))
+        assert s.start(headers(theirs), work(theirs), work(ours), 'peer')
+        assert s.peer == 'peer'
+        assert s.missing(ours) == [b['header']['this_hash']
+                                   for b in theirs[2:]]
+
+        # pipelined: at most 2 requests in flight, repeated after timeout
+        r1 = s.requests(ours, work(ours), 0)
+        assert r1 == [b['header']['this_hash'] for b in theirs[2:4]]
+        assert s.requests(ours, work(ours), 1) == []
+        assert s.requests(ours, work(ours), 6) == r1
+
+        assert s.add_body(r1[0], theirs[2]['txns'])
+        assert not s.add_body(r1[0], theirs[2]['txns'])
+        assert not s.add_body(b'unknown', [])
+        assert s.requests(ours, work(ours), 7) == \
+            [theirs[4]['header']['this_hash']]
+
+        # bodies on their way by other means are not requested until timeout
+        s.expect(theirs[5]['header']['this_hash'], 7)
+        assert s.requests(ours, work(ours), 8) == []
+        assert s.complete(ours) is None
+
+        for b in theirs[3:]:
+            s.add_body(b['header']['this_hash'], b['txns'])
+        assert s.complete(ours) == theirs
+        assert s.headers == [] and s.bodies == {}
+
+
+    def test_candidate(self):
+        """Test switching candidates and dropping stale ones."""
+        start = utils.timestamp() - 1000
+        a, b = gen_chain(4, start, b'a'), gen_chain(5, start, b'b')
+        s = sync.HeaderSync()
+
+        assert s.start(headers(a), work(a), 0)
+        s.add_body(a[0]['header']['this_hash'], a[0]['txns'])
+        assert not s.heavier(work(a), 0)
+        assert s.start(headers(b), work(b), 0)
+        assert s.bodies == {} # not shared with the new candidate
+
+        # our chain caught up: candidate is dropped
+        assert s.requests(b, work(b), 0) == []
+        assert s.headers == []
+
+        # bodies never arrive: candidate is dropped after max_requests
+        s = sync.HeaderSync(max_in_flight=1, timeout=1, max_requests=2)
+        s.start(headers(b), work(b), 0)
+        assert s.requests([], 0, 0) == s.requests([], 0, 1) != []
+        assert s.requests([], 0, 2) == []
+        assert s.headers == []
+
+
+    def test_fork_height(self):
+        """Test common prefix of headers and chain."""
+        f = sync.fork_height
+        start = utils.timestamp() - 1000
+        a = gen_chain(3, start)
+        b = a[:1] + gen_chain(3, start + 5)[1:]
+
+        assert f(headers(a), a) == 3
+        assert f(headers(a), a[:2]) == 2
+        assert f(headers(a), []) == 0
+        assert f(headers(b), a) == 1
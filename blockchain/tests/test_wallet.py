@@ -155,6 +155,45 @@ class TestWallet:
 
         assert len(a_wallet.wallet) == 1
 
+
+    def test_txn_versions(self):
+        """Test that version 2 txns are signed once over all their fields,
+        and that version 1 txns are still accepted."""
+        a_wallet, b_wallet = gen_wallet(), gen_wallet()
+        txn0 = {'previous_hashes': [],
+                'receiver': a_wallet.public_key,
+                'receiver_value': 100,
+                'receiver_signature': b'',
+                'sender': transaction.COINBASE,
+                'sender_change': 0,
+                'sender_signature': b''
+                }
+        a_wallet.receive(txn0)
+        tokens = a_wallet.wallet
+
+        pairs = {v: transaction.send(b_wallet.public_key, a_wallet.public_key,
+                                     a_wallet.private_key, 30, tokens, v)
+                 for v in transaction.TXN_VERSIONS}
+        for _, txn in pairs.values():
+            assert transaction.valid_txn(tokens, txn)
+            b_wallet.receive(txn)
+            a_wallet.receive(txn)
+        for token in b_wallet.wallet + a_wallet.wallet[1:]:
+            txn = next(txn for _, txn in pairs.values()
+                       if transaction.hash_txn(txn) == token['txn_hash'])
+            assert transaction.valid_token(txn, token)
+
+        v1, v2 = pairs[1][1], pairs[2][1]
+        assert 'receiver_signature' not in v2
+        assert transaction.txn_size(v1) - transaction.txn_size(v2) == \
+            len(v1['sender_signature']) - 1
+
+        # version 2 signs the values too; version 1 does not
+        assert transaction.valid_txn(tokens, {**v1, 'receiver_value': 99})
+        assert not transaction.valid_txn(tokens, {**v2, 'receiver_value': 99})
+        assert not transaction.valid_txn(tokens, {**v2, 'version': 3})
+
+
 ################################################################################
 # Helpers
 
@@ -5,9 +5,11 @@ hash.
 """
 
 
-import math # type: ignore
+import statistics, threading # type: ignore
+from collections import OrderedDict # type: ignore
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed # type: ignore
 from toycoin import hash, merkle, transaction, utils # type: ignore
-from typing import List, Optional, Tuple, TypedDict # type: ignore
+from typing import Callable, Dict, List, Optional, Tuple, TypedDict # type: ignore
 
 
 ################################################################################
@@ -31,61 +33,214 @@ class Block(TypedDict):
 
 Blockchain = List[Block]
 
+Target = int # block hash, read as an unsigned int, must be below target
+
+Checkpoints = Dict[int, hash.Hash] # block height -> block hash
+
 
 ################################################################################
 # Constructor
 
 
 GENESIS = hash.hash(b'genesis') # genesis block previous hash
-BLOCK_MAX_TXNS = 10 # magic number: max transactions per block
+BLOCK_MAX_TXNS = 10 # default max transactions per block
+BLOCK_MAX_BYTES = 1_000_000 # default max (serialized) txn bytes per block
+
+SizeFn = Callable[[transaction.Transaction], int]
+RootFn = Callable[[Transactions], hash.Hash]
 
 
 def gen_block(previous_hash: hash.Hash,
               txns: Transactions,
-              difficulty: int
+              target: Target,
+              max_txns: int = BLOCK_MAX_TXNS,
+              max_bytes: int = BLOCK_MAX_BYTES,
+              size: SizeFn = transaction.txn_size,
+              timestamp: Optional[int] = None,
+              root: Optional[RootFn] = None
               ) -> Tuple[Optional[Block], Transactions]:
     """Attempt to generate a block from transactions.
     Return a block (or None if failure), and remainder transactions.
+    The Merkle root of the selected txns is given by root, if known (e.g. by
+    the mempool), and computed otherwise.
     """
-    if not txns:
-        return None, []
+    txns_, rest = select_txns(txns, max_txns, max_bytes, size)
+    if not txns_:
+        return None, rest
 
-    txns_, rest = txns[:BLOCK_MAX_TXNS], txns[BLOCK_MAX_TXNS:]
-
-    tree = gen_merkle(txns_)
-    header = proof_of_work(previous_hash, tree.label, difficulty)
+    merkle_root_ = (root or merkle_root)(txns_)
+    header = proof_of_work(previous_hash, merkle_root_, target, timestamp)
     block : Block = {'header': header,
                      'txns': txns_}
 
     return block, rest
 
 
+def select_txns(txns: Transactions,
+                max_txns: int = BLOCK_MAX_TXNS,
+                max_bytes: int = BLOCK_MAX_BYTES,
+                size: SizeFn = transaction.txn_size
+                ) -> Tuple[Transactions, Transactions]:
+    """Fill a block template from txns in the given (priority) order.
+    Txns that would exceed the byte budget are skipped, so later, smaller
+    txns can still fill the block. Returns selected and remainder txns.
+    """
+    selected: Transactions = []
+    rest: Transactions = []
+    total = 0
+    for i, txn in enumerate(txns):
+        if len(selected) == max_txns:
+            rest.extend(txns[i:]) # block is full, no need to size the rest
+            break
+        n = size(txn)
+        if total + n <= max_bytes:
+            selected.append(txn)
+            total += n
+        else:
+            rest.append(txn)
+    return selected, rest
+
+
 def gen_merkle(txns: Transactions) -> merkle.MerkleTree:
     """Generate Merkle Tree given (non-empty) transactions."""
-    tree = merkle.from_list([transaction.hash_txn(txn) for txn in txns])
+    tree = merkle.from_list(hash_txns(txns))
     assert tree is not None
     return tree
 
 
+def merkle_root(txns: Transactions,
+                executor: Optional[Executor] = None,
+                parallel_min: int = merkle.PARALLEL_MIN,
+                chunk_size: int = merkle.CHUNK_SIZE
+                ) -> hash.Hash:
+    """Root label of gen_merkle(txns), without building the tree. With an
+    executor, txns of large blocks are hashed in chunks across it, and so are
+    the lower tree levels.
+    """
+    if executor is None or len(txns) < parallel_min:
+        leaves = hash_txns(txns)
+    else:
+        futures = [executor.submit(hash_txns, txns[i:i + chunk_size])
+                   for i in range(0, len(txns), chunk_size)]
+        leaves = [h for f in futures for h in f.result()]
+    root = merkle.root_parallel(leaves, executor, parallel_min, chunk_size)
+    assert root is not None
+    return root
+
+
+def hash_txns(txns: Transactions) -> List[hash.Hash]:
+    """Hash each txn."""
+    return [transaction.hash_txn(txn) for txn in txns]
+
+
 ################################################################################
 # Proof of Work
 
 
-def next_difficulty(length: int) -> int:
-    """Determine difficulty of next block, given length of current chain."""
-    return 1 if length < 1 else 1 + int(math.log2(length))
+HASH_BITS = 512
+MAX_TARGET = 2 ** HASH_BITS # any hash meets this target
+
+# retargeting parameters; these are consensus rules, shared by all nodes
+BLOCK_INTERVAL = 10 # desired seconds between blocks
+RETARGET_WINDOW = 8 # number of recent headers used to measure block times
+MAX_ADJUST = 4 # max factor by which a retarget can change the target
+MEDIAN_WINDOW = 11 # timestamps must be later than the median of this many
+MAX_FUTURE_DRIFT = 60 # max seconds a timestamp may be ahead of local time
+
+
+def difficulty_to_target(n: int) -> Target:
+    """Target equivalent to requiring n leading zero bytes."""
+    return 2 ** (HASH_BITS - 8 * n)
+
+
+INITIAL_TARGET = difficulty_to_target(1)
+
+
+def expected_targets(headers: List[BlockHeader],
+                     interval: Optional[int] = None
+                     ) -> List[Target]:
+    """Target each block must meet, given the headers before it.
+    Returns one target per header, plus the target for the next block.
+
+    Each target is the mean target over the last RETARGET_WINDOW headers,
+    scaled by observed / desired time between them (clamped by MAX_ADJUST).
+    """
+    times = [int(hdr['timestamp']) for hdr in headers]
+    targets: List[Target] = []
+
+    for i in range(len(headers) + 1):
+        lo = max(0, i - RETARGET_WINDOW)
+        targets.append(retarget(times[lo:i], targets[lo:i], interval))
+
+    return targets
+
+
+def retarget(times: List[int],
+             targets: List[Target],
+             interval: Optional[int] = None
+             ) -> Target:
+    """Target of the next block, given the timestamps and targets of the
+    (up to RETARGET_WINDOW) blocks before it.
+    """
+    interval = interval or BLOCK_INTERVAL
+    if len(times) < 2:
+        return INITIAL_TARGET
+
+    # blocks after the first were mined at these targets, over this time
+    window = targets[1:]
+    desired = len(window) * interval
+    observed = times[-1] - times[0]
+
+    mean = sum(window) // len(window)
+    target = max(mean // MAX_ADJUST,
+                 min(mean * MAX_ADJUST, mean * observed // desired))
+    return max(1, min(MAX_TARGET, target))
+
+
+def work(target: Target) -> int:
+    """Expected number of hashes to meet target."""
+    return MAX_TARGET // target
+
+
+def chain_work(headers: List[BlockHeader],
+               interval: Optional[int] = None) -> int:
+    """Cumulative work of a header chain, at its expected targets."""
+    return sum(work(t) for t in expected_targets(headers, interval)[:-1])
+
+
+def next_target(chain: Blockchain, interval: Optional[int] = None) -> Target:
+    """Determine target of next block, given current chain."""
+    return expected_targets([b['header'] for b in chain], interval)[-1]
+
+
+def median_time(headers: List[BlockHeader]) -> int:
+    """Median timestamp of the last MEDIAN_WINDOW (non-empty) headers."""
+    return statistics.median_low(int(hdr['timestamp'])
+                                 for hdr in headers[-MEDIAN_WINDOW:])
+
+
+def next_timestamp(chain: Blockchain) -> int:
+    """Timestamp for the next block: now, unless that is not later than
+    the median time of the chain.
+    """
+    now = utils.timestamp()
+    if not chain:
+        return now
+    return max(now, median_time([b['header'] for b in chain]) + 1)
 
 
 def proof_of_work(p: hash.Hash,
                   root: hash.Hash,
-                  difficulty: int
+                  target: Target,
+                  timestamp: Optional[int] = None
                   ) -> BlockHeader:
-    """Naive POW solver."""
-    now = utils.int_to_bytes(utils.timestamp())
+    """Naive POW solver (timestamp defaults to now)."""
+    now = utils.int_to_bytes(utils.timestamp() if timestamp is None
+                             else timestamp)
 
-    nonce = 0
-    h = b''
-    while not solved(h, difficulty):
+    nonce = 1
+    h = hash.hash(now + p + utils.int_to_bytes(nonce) + root)
+    while not meets_target(h, target):
         nonce += 1
         h = hash.hash(now + p + utils.int_to_bytes(nonce) + root)
 
@@ -96,45 +251,214 @@ def proof_of_work(p: hash.Hash,
             'this_hash': h}
 
 
-def solved(h: hash.Hash, n: int) -> bool:
-    """Check if first n bytes are zeros."""
-    return h[:n] == bytes(n)
+def meets_target(h: hash.Hash, target: Target) -> bool:
+    """Check if hash (as unsigned int) is below target."""
+    return int.from_bytes(h, byteorder='big') < target
 
 
 ################################################################################
 # Block Validation
 
 
-def valid_blockchain(chain: Blockchain) -> bool:
-    """Check validity of blockchain."""
-    pairs = zip(chain[1:], chain)
-    v1 = all(valid_hash_pair(b1, b0) for b1, b0 in pairs)
+def valid_blockchain(chain: Blockchain,
+                     interval: Optional[int] = None,
+                     checkpoints: Optional[Checkpoints] = None,
+                     registry: Optional['ValidatedBlocks'] = None
+                     ) -> bool:
+    """Check validity of blockchain.
+    Blocks up to the last checkpoint in the chain are assumed valid: only
+    their headers are checked, not their txns. Nor are the txns of blocks
+    in registry, if given.
+    """
+    headers = [b['header'] for b in chain]
+    n = assumed_valid(headers, checkpoints or {})
+    return (valid_header_chain(headers, interval, checkpoints) and
+            all(valid_merkle_root(b, None, registry) for b in chain[n or 0:]))
+
+
+def valid_header_chain(headers: List[BlockHeader],
+                       interval: Optional[int] = None,
+                       checkpoints: Optional[Checkpoints] = None
+                       ) -> bool:
+    """Check validity of a chain from its headers alone: links, timestamps,
+    proof of work against expected targets, and checkpoints.
+    """
+    targets = expected_targets(headers, interval)
+    return (assumed_valid(headers, checkpoints or {}) is not None and
+            valid_links(headers) and
+            valid_timestamps(headers) and
+            valid_headers(headers, targets))
+
+
+def valid_blockchain_parallel(chain: Blockchain,
+                              interval: Optional[int] = None,
+                              executor: Optional[Executor] = None,
+                              shard_size: int = 64,
+                              checkpoints: Optional[Checkpoints] = None,
+                              registry: Optional['ValidatedBlocks'] = None
+                              ) -> bool:
+    """Check validity of blockchain, same verdict as valid_blockchain.
+    Links, timestamps, targets and assumed valid headers are cheap and
+    checked here, as are the headers of blocks in registry (if given). Block
+    hashes and Merkle roots of the rest are checked in shards of blocks
+    across executor (a new process pool if None), stopping at the first
+    invalid shard.
+    """
+    headers = [b['header'] for b in chain]
+    targets = expected_targets(headers, interval)
+    n = assumed_valid(headers, checkpoints or {})
+    if not (n is not None and
+            valid_links(headers) and
+            valid_timestamps(headers) and
+            valid_headers(headers[:n], targets[:n])):
+        return False
+
+    # blocks known to commit to their txns only need their header checked
+    known = [i for i in range(n, len(chain))
+             if registry is not None and registry.known(chain[i])]
+    if not valid_headers([headers[i] for i in known],
+                         [targets[i] for i in known]):
+        return False
+    todo = sorted(set(range(n, len(chain))) - set(known))
+    if not todo:
+        return True
+    pool = executor or ProcessPoolExecutor()
+    try:
+        shards = [todo[j:j + shard_size]
+                  for j in range(0, len(todo), shard_size)]
+        futures = [pool.submit(valid_blocks,
+                               [chain[i] for i in shard],
+                               [targets[i] for i in shard])
+                   for shard in shards]
+        for future in as_completed(futures):
+            if not future.result():
+                for f in futures:
+                    f.cancel()
+                return False
+        if registry is not None:
+            for i in todo:
+                registry.add(chain[i])
+        return True
+    finally:
+        if executor is None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def valid_merkle_roots(blocks: Blockchain,
+                       executor: Optional[Executor] = None,
+                       shard_size: int = 64,
+                       registry: Optional['ValidatedBlocks'] = None
+                       ) -> bool:
+    """Check that each block commits to its txns, in shards of blocks across
+    executor if given. Blocks in registry (if given) are not checked again,
+    and those checked are added to it.
+    """
+    todo = [b for b in blocks
+            if not (registry is not None and registry.known(b))]
+    if executor is None or len(todo) <= shard_size:
+        return all(valid_merkle_root(b, None, registry) for b in todo)
+
+    futures = [executor.submit(valid_merkle_roots, todo[i:i + shard_size])
+               for i in range(0, len(todo), shard_size)]
+    for future in as_completed(futures):
+        if not future.result():
+            for f in futures:
+                f.cancel()
+            return False
+    if registry is not None:
+        for b in todo:
+            registry.add(b)
+    return True
+
+
+def assumed_valid(headers: List[BlockHeader],
+                  checkpoints: Checkpoints
+                  ) -> Optional[int]:
+    """Number of blocks up to and including the last checkpoint within the
+    chain, or None if the chain does not match a checkpoint.
+    """
+    n = 0
+    for height, h in checkpoints.items():
+        if height < len(headers):
+            if headers[height]['this_hash'] != h:
+                return None
+            n = max(n, height + 1)
+    return n
+
+
+def update_checkpoints(chain: Blockchain,
+                       checkpoints: Checkpoints,
+                       depth: int
+                       ) -> bool:
+    """Checkpoint the block depth blocks below the tip, if there is one.
+    Returns True if checkpoints changed.
+    """
+    height = len(chain) - 1 - depth
+    if height < 0 or height in checkpoints:
+        return False
+    checkpoints[height] = chain[height]['header']['this_hash']
+    return True
+
+
+def valid_links(headers: List[BlockHeader]) -> bool:
+    """Chain starts at genesis and each block links to the one before."""
+    return (headers[0]['previous_hash'] == GENESIS and
+            all(h1['previous_hash'] == h0['this_hash']
+                for h1, h0 in zip(headers[1:], headers)))
 
-    v2 = all(valid_block(block, next_difficulty(i))
-             for i, block in enumerate(chain))
 
-    v3 = chain[0]['header']['previous_hash'] == GENESIS
+def valid_blocks(blocks: Blockchain, targets: List[Target]) -> bool:
+    """Check each block against its target."""
+    return all(valid_block(b, t) for b, t in zip(blocks, targets))
 
-    v4 = all(valid_timestamp(b1, b0) for b1, b0 in pairs)
 
-    return v1 and v2 and v3 and v4
+def valid_headers(headers: List[BlockHeader], targets: List[Target]) -> bool:
+    """Check each header against its target."""
+    return all(valid_header(hdr, t) for hdr, t in zip(headers, targets))
 
 
-def valid_block(block: Block, difficulty: int) -> bool:
-    """Check if block transactions and header hashes are valid."""
-    tree = gen_merkle(block['txns'])
-    return (valid_header(block['header'], difficulty) and
-            tree.label == block['header']['merkle_root'])
+def valid_block(block: Block,
+                target: Target,
+                registry: Optional['ValidatedBlocks'] = None
+                ) -> bool:
+    """Check if block transactions and header hashes are valid. Blocks in
+    registry (if given) are valid; valid blocks are added to it.
+    """
+    if registry is not None and registry.known(block, target):
+        return True
+    valid = (valid_header(block['header'], target) and
+             valid_merkle_root(block, None, registry))
+    if valid and registry is not None:
+        registry.add(block, target)
+    return valid
+
+
+def valid_merkle_root(block: Block,
+                      executor: Optional[Executor] = None,
+                      registry: Optional['ValidatedBlocks'] = None
+                      ) -> bool:
+    """Check if block header commits to block transactions. Large blocks are
+    hashed across executor, if given. Blocks in registry (if given) commit,
+    and so do those added to it.
+    """
+    if registry is not None and registry.known(block):
+        return True
+    valid = (len(block['txns']) > 0 and
+             merkle_root(block['txns'], executor) ==
+             block['header']['merkle_root'])
+    if valid and registry is not None:
+        registry.add(block)
+    return valid
 
 
-def valid_header(header: BlockHeader, difficulty: int) -> bool:
+def valid_header(header: BlockHeader, target: Target) -> bool:
     """Check if block hash matches header data."""
     h = hash.hash(header['timestamp'] +
                   header['previous_hash'] +
                   header['nonce'] +
                   header['merkle_root'])
     return (header['this_hash'] == h and
-            solved(header['this_hash'], difficulty))
+            meets_target(header['this_hash'], target))
 
 
 def valid_hash_pair(b1: Block, b0: Block) -> bool:
@@ -142,23 +466,47 @@ def valid_hash_pair(b1: Block, b0: Block) -> bool:
     return b1['header']['previous_hash'] == b0['header']['this_hash']
 
 
-def valid_timestamp(b1: Block, b0: Block) -> bool:
-    """B1 has later timestmap than B0."""
-    return b1['header']['timestamp'] > b0['header']['timestamp']
+def valid_timestamps(headers: List[BlockHeader],
+                     now: Optional[int] = None
+                     ) -> bool:
+    """Each timestamp is later than the median time of the headers before
+    it, and at most MAX_FUTURE_DRIFT seconds ahead of now.
+    """
+    latest = (utils.timestamp() if now is None else now) + MAX_FUTURE_DRIFT
+    times = [int(hdr['timestamp']) for hdr in headers]
+    return all(t <= latest and
+               (i == 0 or
+                t > statistics.median_low(times[max(0, i - MEDIAN_WINDOW):i]))
+               for i, t in enumerate(times))
 
 
 # Token & Blockchain Validation
 
 
-def valid_tokens(tokens: List[transaction.Token], chain: Blockchain) -> bool:
+def valid_tokens(tokens: List[transaction.Token],
+                 chain: Blockchain,
+                 index: Optional['ChainIndex'] = None
+                 ) -> bool:
     """Tokens are unique and all come from prior txns in the blockchain."""
     # backdoor for coinbase tokens
     return (transaction.unique_tokens(tokens) and
-            all(valid_token(token, chain) for token in tokens))
+            all(valid_token(token, chain, index) for token in tokens))
 
 
-def valid_token(token: transaction.Token, chain: Blockchain):
-    """Search blockchain backwards for txn source of token."""
+def valid_token(token: transaction.Token,
+                chain: Blockchain,
+                index: Optional['ChainIndex'] = None):
+    """Find txn source of token: looked up in the index, if it indexes chain,
+    else by searching blockchain backwards.
+    """
+    if index is not None:
+        with index.lock:
+            if index.matches(chain):
+                found = index.lookup(token['txn_hash'])
+                return (found is not None and
+                        transaction.valid_token(found[1], token,
+                                                token['txn_hash']))
+
     for block in chain[::-1]:
         txns = block['txns']
         for txn in txns:
@@ -166,3 +514,166 @@ def valid_token(token: transaction.Token, chain: Blockchain):
                 return True
 
     return False
+
+
+def spent_tokens(txn: transaction.Transaction,
+                 index: 'ChainIndex'
+                 ) -> Optional[List[transaction.Token]]:
+    """Tokens txn spends, rebuilt from its source txns in the indexed chain
+    (owned by its sender), or None if a source is missing.
+    """
+    tokens: List[transaction.Token] = []
+    for h in txn['previous_hashes']:
+        found = index.lookup(h)
+        if found is None:
+            return None
+        source = found[1]
+        to_receiver = source['receiver'] == txn['sender']
+        tokens.append({'txn_hash': h, 'owner': txn['sender'],
+                       'value': (source['receiver_value'] if to_receiver else
+                                 source['sender_change']),
+                       'signature': transaction.token_signature(source,
+                                                                to_receiver)})
+    return tokens
+
+
+################################################################################
+# Chain Index
+
+
+TxnLocation = Tuple[int, transaction.Transaction] # block height, txn
+
+
+class ChainIndex:
+    """Txn hash index of a blockchain.
+    Each block's txn hashes are computed once, and kept by block hash so they
+    survive reorgs. The chain-wide map from txn hash to (block height, txn)
+    is updated incrementally as the chain grows or is replaced. Hold lock
+    while checking matches() and looking up, if the index may be updated
+    concurrently.
+    """
+
+    def __init__(self, spare: int = 1000):
+        self.spare = spare # blocks off the chain whose txn hashes are kept
+        self.block_txns: Dict[hash.Hash, List[hash.Hash]] = {}
+        self.chain: List[hash.Hash] = [] # block hashes of the indexed chain
+        self.txns: Dict[hash.Hash, TxnLocation] = {}
+        self.lock = threading.Lock()
+
+
+    def __len__(self) -> int:
+        return len(self.txns)
+
+
+    def txn_hashes(self, b: Block) -> List[hash.Hash]:
+        """Hashes of the block's txns, in order."""
+        h = b['header']['this_hash']
+        hs = self.block_txns.get(h)
+        if hs is None:
+            hs = self.block_txns[h] = [transaction.hash_txn(txn)
+                                       for txn in b['txns']]
+        return hs
+
+
+    def update(self, chain: Blockchain):
+        """Index chain, re-indexing only blocks that changed since the last
+        update.
+        """
+        with self.lock:
+            n = min(len(chain), len(self.chain))
+            while (n and
+                   chain[n - 1]['header']['this_hash'] != self.chain[n - 1]):
+                n -= 1
+
+            for height in range(n, len(self.chain)):
+                for h in self.block_txns[self.chain[height]]:
+                    if self.txns.get(h, (None,))[0] == height:
+                        del self.txns[h]
+            del self.chain[n:]
+
+            for height, b in enumerate(chain[n:], n):
+                for h, txn in zip(self.txn_hashes(b), b['txns']):
+                    self.txns.setdefault(h, (height, txn))
+                self.chain.append(b['header']['this_hash'])
+
+            if len(self.block_txns) > len(self.chain) + self.spare:
+                self.block_txns = {h: self.block_txns[h] for h in self.chain}
+
+
+    def matches(self, chain: Blockchain) -> bool:
+        """Index is of chain (judging by its length and tip)."""
+        return (len(chain) == len(self.chain) and
+                (not chain or
+                 chain[-1]['header']['this_hash'] == self.chain[-1]))
+
+
+    def lookup(self, txn_hash: hash.Hash) -> Optional[TxnLocation]:
+        """Height and txn of txn_hash in the indexed chain, if present."""
+        return self.txns.get(txn_hash)
+
+
+################################################################################
+# Validated Blocks
+
+
+RULES_VERSION = 1 # bump when block validation rules change
+
+RegistryKey = Tuple[int, hash.Hash, Optional[Target]]
+
+
+class ValidatedBlocks:
+    """Bounded LRU registry of blocks proven valid, keyed by validation rules
+    version, block hash and the target checked against (None if only the
+    Merkle root was checked). A block is known only if its header and txns
+    are equal to those validated, so a valid header with other txns is not.
+    Blocks are treated as immutable once made, as elsewhere. Safe to share
+    with worker threads.
+    """
+
+    def __init__(self, capacity: int = 10_000):
+        self.capacity = capacity
+        # key -> (header, txns) validated
+        self.blocks: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+
+    def known(self, b: Block, target: Optional[Target] = None) -> bool:
+        """Block was proven valid against target (or to commit to its txns,
+        if target is None).
+        """
+        key = self.key(b, target)
+        with self.lock:
+            entry = self.blocks.get(key)
+            if entry and entry[0] == b['header'] and entry[1] == b['txns']:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+
+    def add(self, b: Block, target: Optional[Target] = None):
+        """Record block as valid against target (or as committing to its
+        txns, if target is None), evicting the least recently used.
+        """
+        with self.lock:
+            self.blocks[self.key(b, target)] = (dict(b['header']),
+                                                list(b['txns']))
+            if len(self.blocks) > self.capacity:
+                self.blocks.popitem(last=False)
+
+
+    def clear(self):
+        """Forget all blocks."""
+        with self.lock:
+            self.blocks.clear()
+
+
+    def key(self, b: Block, target: Optional[Target]) -> RegistryKey:
+        return (RULES_VERSION, b['header']['this_hash'], target)
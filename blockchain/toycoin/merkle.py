@@ -1,5 +1,6 @@
 # Merkle Hash Tree
 
+from concurrent.futures import Executor # type: ignore
 from toycoin import hash # type: ignore
 from typing import List, Optional, Tuple # type: ignore
 
@@ -99,6 +100,132 @@ def from_list(leaves: List[hash.Hash]) -> Optional[MerkleTree]:
     return t
 
 
+################################################################################
+# Roots
+#
+# The root of from_list(leaves), computed a level at a time without building
+# the tree: leaves are paired left to right, a lone last leaf is hashed on its
+# own, and a lone last node on a higher level is carried up unchanged.
+
+
+PARALLEL_MIN = 4096 # fewest leaves worth hashing across an executor
+
+CHUNK_SIZE = 1024 # labels per executor task (even, so pairs are not split)
+
+
+def root(leaves: List[hash.Hash]) -> Optional[hash.Hash]:
+    """Root label of from_list(leaves), or None if no leaves."""
+    if not leaves:
+        return None
+    labels = hash_level([b'\x00' + leaf for leaf in leaves], True)
+    while len(labels) > 1:
+        labels = hash_level(labels)
+    return labels[0]
+
+
+def root_parallel(leaves: List[hash.Hash],
+                  executor: Optional[Executor] = None,
+                  parallel_min: int = PARALLEL_MIN,
+                  chunk_size: int = CHUNK_SIZE
+                  ) -> Optional[hash.Hash]:
+    """Root label of from_list(leaves), hashing each level in chunks across
+    executor while the level has at least parallel_min labels. Serial without
+    an executor.
+    """
+    if executor is None or len(leaves) < parallel_min:
+        return root(leaves)
+    assert chunk_size % 2 == 0
+
+    labels = [b'\x00' + leaf for leaf in leaves]
+    leaf_level = True
+    while len(labels) >= max(parallel_min, 2):
+        chunks = [labels[i:i + chunk_size]
+                  for i in range(0, len(labels), chunk_size)]
+        futures = [executor.submit(hash_level, chunk, leaf_level)
+                   for chunk in chunks]
+        labels = [label for f in futures for label in f.result()]
+        leaf_level = False
+
+    if leaf_level:
+        labels = hash_level(labels, True)
+    while len(labels) > 1:
+        labels = hash_level(labels)
+    return labels[0]
+
+
+def hash_level(labels: List[hash.Hash],
+               leaf_level: bool = False) -> List[hash.Hash]:
+    """Labels of the next level up. A lone last label is hashed alone on the
+    leaf level, and carried up otherwise.
+    """
+    level = [b'\x01' + hash.hash(labels[i] + labels[i + 1])
+             for i in range(0, len(labels) - 1, 2)]
+    if len(labels) % 2:
+        last = labels[-1]
+        level.append(b'\x01' + hash.hash(last) if leaf_level else last)
+    return level
+
+
+################################################################################
+# Frontier
+
+
+class MerkleFrontier:
+    """Append-only Merkle accumulator, with the root of from_list over the
+    leaves appended so far. Only the labels of the perfect subtrees along the
+    right edge are kept, at most one per level, so appends cost amortized
+    O(1) hashes and the root O(log n).
+    """
+
+    def __init__(self, leaves: Optional[List[hash.Hash]] = None):
+        # level -> label of the perfect subtree of 2 ** level leaves, if any
+        self.peaks: List[Optional[hash.Hash]] = []
+        self.count = 0
+        self.cached: Optional[hash.Hash] = None # root, until the next append
+        for leaf in leaves or []:
+            self.append(leaf)
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def append(self, leaf: hash.Hash):
+        """Append leaf, merging equal sized subtrees like a binary carry."""
+        label = b'\x00' + leaf
+        level = 0
+        while level < len(self.peaks):
+            peak = self.peaks[level]
+            if peak is None:
+                break
+            label = b'\x01' + hash.hash(peak + label)
+            self.peaks[level] = None
+            level += 1
+        if level == len(self.peaks):
+            self.peaks.append(label)
+        else:
+            self.peaks[level] = label
+        self.count += 1
+        self.cached = None
+
+
+    def root(self) -> Optional[hash.Hash]:
+        """Root label of from_list over the leaves so far (None if none):
+        the subtrees folded from the smallest up, a lone leaf hashed alone.
+        """
+        if self.cached is None and self.count:
+            acc: Optional[hash.Hash] = None
+            for level, peak in enumerate(self.peaks):
+                if peak is None:
+                    continue
+                if acc is None:
+                    acc = b'\x01' + hash.hash(peak) if level == 0 else peak
+                else:
+                    acc = b'\x01' + hash.hash(peak + acc)
+            self.cached = acc
+        return self.cached
+
+
 ################################################################################
 # Verification
 
@@ -0,0 +1,106 @@
+"""Cache of packed and unpacked blocks.
+Blocks never change once made, so each block is packed (and unpacked) once,
+keyed by block hash. Chain messages are assembled from the cached packed
+blocks, so a new tip costs the encoding of one block rather than the whole
+chain.
+"""
+
+
+import threading # type: ignore
+from collections import OrderedDict # type: ignore
+from toycoin import block, hash # type: ignore
+from toycoin.network import serialize # type: ignore
+from typing import Callable, Sequence, Tuple # type: ignore
+
+
+################################################################################
+
+
+class BlockCache:
+    """Bounded LRU caches of packed blocks and bodies, by (block hash, kind,
+    wire version), and of unpacked blocks, by their packed header. Safe to
+    share with worker threads.
+    """
+
+    def __init__(self, capacity: int = 10_000):
+        self.capacity = capacity
+        self.packed: OrderedDict = OrderedDict()
+        # header line -> (txns line, block)
+        self.unpacked: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self.packed)
+
+
+    def fragment(self, b: block.Block,
+                 version: int = serialize.WIRE_VERSION) -> str:
+        """Packed block, as it appears in a packed blockchain."""
+        return self._packed(b, 'block', version, serialize.block_fragment)
+
+
+    def pack_body(self, b: block.Block,
+                  version: int = serialize.WIRE_VERSION) -> str:
+        """Packed block body."""
+        return self._packed(b, 'body', version, serialize.pack_body)
+
+
+    def pack_blockchain(self, blocks: block.Blockchain,
+                        version: int = serialize.WIRE_VERSION) -> str:
+        """Packed blockchain, packing only blocks not seen before."""
+        return serialize.join_blockchain([self.fragment(b, version)
+                                          for b in blocks], version)
+
+
+    def unpack_blockchain(self, s: serialize.Packed) -> block.Blockchain:
+        """Unpack blockchain, reusing blocks unpacked before if their txns
+        are packed identically.
+        """
+        if serialize.wire_version(s) == 1:
+            return serialize.unpack_blockchain(s)
+
+        blocks = []
+        lines: Sequence[serialize.Packed] = s.splitlines()
+        for hdr_line, txns_line in zip(lines[1::2], lines[2::2]):
+            with self.lock:
+                cached = self.unpacked.get(hdr_line)
+                if cached and cached[0] == txns_line:
+                    self.unpacked.move_to_end(hdr_line)
+                    self.hits += 1
+                    blocks.append(cached[1])
+                    continue
+                self.misses += 1
+            b = serialize.unpack_block_lines(hdr_line, txns_line)
+            self._put(self.unpacked, hdr_line, (txns_line, b))
+            blocks.append(b)
+        return blocks
+
+
+    def _packed(self, b: block.Block,
+                kind: str,
+                version: int,
+                pack: Callable[[block.Block, int], str]) -> str:
+        """Cached packed form of b, packing it if missing."""
+        key: Tuple[hash.Hash, str, int] = (b['header']['this_hash'], kind,
+                                           version)
+        with self.lock:
+            s = self.packed.get(key)
+            if s is not None:
+                self.packed.move_to_end(key)
+                self.hits += 1
+                return s
+            self.misses += 1
+        s = pack(b, version)
+        self._put(self.packed, key, s)
+        return s
+
+
+    def _put(self, cache: OrderedDict, key, value):
+        """Add to cache, evicting the least recently used."""
+        with self.lock:
+            cache[key] = value
+            if len(cache) > self.capacity:
+                cache.popitem(last=False)
@@ -0,0 +1,249 @@
+"""Block tree: the blocks of competing branches, and fork choice.
+Each block is validated once, against the branch it extends, and stored with
+its height, target and the cumulative work of its branch. The best chain ends
+in the block with the most cumulative work (the first seen, among equals).
+Switching to it unwinds and reapplies only the blocks past the fork, so a
+reorg costs the fork depth rather than the chain length.
+"""
+
+
+import statistics, threading # type: ignore
+from concurrent.futures import Executor # type: ignore
+from toycoin import block, hash, utils # type: ignore
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple # type: ignore
+
+
+################################################################################
+
+
+WINDOW = max(block.RETARGET_WINDOW, block.MEDIAN_WINDOW) # ancestors checked
+
+SIDE_DEPTH = 100 # side branches forking deeper below the tip are dropped
+
+
+class Node(NamedTuple):
+    block: block.Block
+    height: int
+    target: block.Target
+    work: int # cumulative, up to and including this block
+
+
+Checked = List[Tuple[block.Target, int]] # target, cumulative work
+
+
+class BlockTree:
+    """Validated blocks by block hash, on the best chain or off it. Safe to
+    share with worker threads.
+    """
+
+    def __init__(self,
+                 interval: Optional[int] = None,
+                 registry: Optional[block.ValidatedBlocks] = None,
+                 side_depth: int = SIDE_DEPTH):
+        self.interval = interval
+        self.registry = registry # skips Merkle checks of known blocks
+        self.side_depth = side_depth
+        self.nodes: Dict[hash.Hash, Node] = {}
+        self.side: Set[hash.Hash] = set() # blocks off the best chain
+        self.tip: Optional[hash.Hash] = None # block with the most work
+        self.chain: block.Blockchain = [] # best chain, as of the last reorg
+        self.lock = threading.Lock()
+
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+    def __contains__(self, h: hash.Hash) -> bool:
+        return h in self.nodes
+
+
+    def work(self) -> int:
+        """Cumulative work of the best chain."""
+        chain = self.chain
+        return self.nodes[chain[-1]['header']['this_hash']].work if chain else 0
+
+
+    def header_work(self,
+                    headers: List[block.BlockHeader],
+                    checkpoints: Optional[block.Checkpoints] = None,
+                    now: Optional[int] = None
+                    ) -> Optional[int]:
+        """Cumulative work of a header chain, or None if it is invalid.
+        Headers already in the tree must match it, and only the others are
+        checked (links, timestamps, proof of work and checkpoints).
+        """
+        with self.lock:
+            found = self.known_prefix(headers)
+            if found is None:
+                return None
+            n, parent = found
+            checked = self.check(parent, headers[n:], checkpoints, now)
+        if checked is None:
+            return None
+        if checked:
+            return checked[-1][1]
+        return self.nodes[parent].work if parent else 0
+
+
+    def add_chain(self,
+                  blocks: block.Blockchain,
+                  checkpoints: Optional[block.Checkpoints] = None,
+                  executor: Optional[Executor] = None,
+                  now: Optional[int] = None
+                  ) -> bool:
+        """Add the blocks of a chain (or of a branch off a block in the tree)
+        that are not in the tree yet, if they are valid. Only those blocks
+        are validated, their Merkle roots across executor if given, except
+        for blocks up to the last checkpoint, which are assumed valid. The
+        best chain is left as it is, until reorg().
+        """
+        headers = [b['header'] for b in blocks]
+        with self.lock:
+            found = self.known_prefix(headers)
+            if found is None:
+                return False
+            n, parent = found
+            height = self.nodes[parent].height + 1 if parent else 0
+            checked = self.check(parent, headers[n:], checkpoints, now)
+        end = height + len(checked or [])
+        assumed = max((i + 1 for i in checkpoints or {} if i < end), default=0)
+        if checked is None or not block.valid_merkle_roots(
+                blocks[n + max(0, assumed - height):], executor,
+                registry=self.registry):
+            return False
+
+        with self.lock:
+            if parent and parent not in self.nodes: # pruned meanwhile
+                return False
+            for i, (b, (target, work)) in enumerate(zip(blocks[n:], checked)):
+                h = b['header']['this_hash']
+                if h in self.nodes: # added by another thread meanwhile
+                    continue
+                self.nodes[h] = Node(b, height + i, target, work)
+                self.side.add(h)
+                if self.tip is None or work > self.nodes[self.tip].work:
+                    self.tip = h
+        return True
+
+
+    def reorg(self) -> Tuple[block.Blockchain, block.Blockchain]:
+        """Make the chain ending in the block with the most work the best
+        chain. Returns the blocks unwound from the old chain and the blocks
+        applied in their place, both in chain order.
+        """
+        with self.lock:
+            chain = self.chain
+            if self.tip is None or (chain and
+                                    chain[-1]['header']['this_hash'] ==
+                                    self.tip):
+                return [], []
+
+            applied = []
+            h = self.tip
+            while h in self.nodes:
+                node = self.nodes[h]
+                if (node.height < len(chain) and
+                    chain[node.height]['header']['this_hash'] == h):
+                    break
+                applied.append(node.block)
+                h = node.block['header']['previous_hash']
+            applied.reverse()
+
+            fork = self.nodes[applied[0]['header']['this_hash']].height
+            unwound = chain[fork:]
+            self.chain = chain[:fork] + applied
+            self.side.update(b['header']['this_hash'] for b in unwound)
+            self.side.difference_update(b['header']['this_hash']
+                                        for b in applied)
+            self.prune()
+            return unwound, applied
+
+
+    def known_prefix(self, headers: List[block.BlockHeader]
+                     ) -> Optional[Tuple[int, Optional[hash.Hash]]]:
+        """Number of leading headers in the tree, and the block the rest
+        extend (None for genesis). None if headers don't start at genesis or
+        on a block in the tree, or differ from the tree.
+        """
+        parent: Optional[hash.Hash] = None
+        if headers and headers[0]['previous_hash'] != block.GENESIS:
+            parent = headers[0]['previous_hash']
+            if parent not in self.nodes:
+                return None
+        n = 0
+        for hdr in headers:
+            node = self.nodes.get(hdr['this_hash'])
+            if node is None:
+                break
+            if (node.block['header'] != hdr or
+                hdr['previous_hash'] != (parent or block.GENESIS)):
+                return None
+            parent = hdr['this_hash']
+            n += 1
+        return n, parent
+
+
+    def check(self,
+              parent: Optional[hash.Hash],
+              headers: List[block.BlockHeader],
+              checkpoints: Optional[block.Checkpoints] = None,
+              now: Optional[int] = None
+              ) -> Optional[Checked]:
+        """Target and cumulative work of each header extending parent, or
+        None if any is invalid, as judged by block.valid_header_chain on the
+        whole chain.
+        """
+        ancestors = self.branch(parent, WINDOW)
+        times = [int(n.block['header']['timestamp']) for n in ancestors]
+        targets = [n.target for n in ancestors]
+        height = self.nodes[parent].height + 1 if parent else 0
+        total = self.nodes[parent].work if parent else 0
+        latest = (utils.timestamp() if now is None else now) + \
+            block.MAX_FUTURE_DRIFT
+        checkpoints = checkpoints or {}
+
+        prev = parent or block.GENESIS
+        checked: Checked = []
+        for i, hdr in enumerate(headers, height):
+            target = block.retarget(times[-block.RETARGET_WINDOW:],
+                                    targets[-block.RETARGET_WINDOW:],
+                                    self.interval)
+            t = int(hdr['timestamp'])
+            median = (statistics.median_low(times[-block.MEDIAN_WINDOW:])
+                      if times else None)
+            if not (hdr['previous_hash'] == prev and
+                    t <= latest and
+                    (median is None or t > median) and
+                    checkpoints.get(i, hdr['this_hash']) == hdr['this_hash'] and
+                    block.valid_header(hdr, target)):
+                return None
+            total += block.work(target)
+            checked.append((target, total))
+            times, targets = times[-WINDOW:] + [t], targets[-WINDOW:] + [target]
+            prev = hdr['this_hash']
+        return checked
+
+
+    def branch(self, h: Optional[hash.Hash], n: int) -> List[Node]:
+        """Up to the last n blocks of the branch ending in h, oldest first."""
+        nodes: List[Node] = []
+        while h is not None and h in self.nodes and len(nodes) < n:
+            node = self.nodes[h]
+            nodes.append(node)
+            h = node.block['header']['previous_hash']
+        return nodes[::-1]
+
+
+    def prune(self):
+        """Drop side branches forking more than side_depth blocks below the
+        tip (and any blocks left without a parent).
+        """
+        cutoff = len(self.chain) - self.side_depth
+        for h in sorted(self.side, key=lambda h: self.nodes[h].height):
+            node = self.nodes[h]
+            parent = node.block['header']['previous_hash']
+            if node.height < cutoff or (parent != block.GENESIS and
+                                        parent not in self.nodes):
+                del self.nodes[h]
+                self.side.discard(h)
@@ -0,0 +1,64 @@
+"""Compact block relay.
+Peers have usually seen a new block's txns already, in TXN broadcasts, so a
+block is relayed as its header and a short id per txn. The receiver rebuilds
+it from its mempool, and requests only the txns it is missing.
+Short ids are salted with the block hash, so txns whose ids collide in one
+block don't collide in the next.
+"""
+
+
+from toycoin import block, hash, transaction # type: ignore
+from typing import Dict, List, Optional # type: ignore
+
+
+################################################################################
+
+
+SHORT_ID_BYTES = 6
+
+ShortId = bytes
+
+PartialTxns = List[Optional[transaction.Transaction]] # None where missing
+
+
+def short_id(txn_hash: hash.Hash, block_hash: hash.Hash) -> ShortId:
+    """Short id of txn in the block with block_hash."""
+    return hash.hash(block_hash + txn_hash)[:SHORT_ID_BYTES]
+
+
+def short_ids(b: block.Block) -> List[ShortId]:
+    """Short ids of block txns, in block order."""
+    h = b['header']['this_hash']
+    return [short_id(transaction.hash_txn(txn), h) for txn in b['txns']]
+
+
+def reconstruct(block_hash: hash.Hash,
+                ids: List[ShortId],
+                txns: Dict[hash.Hash, transaction.Transaction]
+                ) -> PartialTxns:
+    """Block txns matched by short id from txns (keyed by txn hash).
+    Txns that are not found, or whose short id is ambiguous, are None.
+    """
+    index: Dict[ShortId, Optional[transaction.Transaction]] = {}
+    for h, txn in txns.items():
+        s = short_id(h, block_hash)
+        index[s] = None if s in index else txn
+    return [index.get(s) for s in ids]
+
+
+def missing(txns: PartialTxns) -> List[int]:
+    """Indexes of missing txns."""
+    return [i for i, txn in enumerate(txns) if txn is None]
+
+
+def fill(txns: PartialTxns,
+         indexes: List[int],
+         found: List[transaction.Transaction]
+         ) -> bool:
+    """Fill in missing txns at indexes. Returns True if none are left."""
+    if len(indexes) != len(found):
+        return False
+    for i, txn in zip(indexes, found):
+        if 0 <= i < len(txns) and txns[i] is None:
+            txns[i] = txn
+    return not missing(txns)
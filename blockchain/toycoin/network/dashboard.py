@@ -0,0 +1,151 @@
+"""Windowed network statistics, for the listener's stats mode.
+Frames are counted from their headers as they arrive. Only chain
+announcements are decoded, and only as far as the announcing node, chain
+height and tip hash: txns and block bodies are never decoded (or
+decompressed). A compact dashboard of the current window is rendered at a
+fixed interval.
+"""
+
+
+import json # type: ignore
+from collections import Counter, OrderedDict # type: ignore
+from toycoin.network import metrics, serialize # type: ignore
+from toycoin.network.msg_protocol import decode_frame, peek_frame # type: ignore
+from typing import Dict, Optional, Set, Tuple # type: ignore
+
+
+################################################################################
+
+
+Tip = Tuple[str, int, Optional[str]] # publisher, chain height, tip hash (b64)
+
+DECODED = (b'CMPT', b'HDRS', b'BLOC', b'STAT')
+
+FORK_HEIGHTS = 1000 # recent heights whose tips are kept, to spot forks
+
+
+class Dashboard:
+    """Per-window counts of messages, txns, blocks and forks, and the latest
+    chain height of each publisher.
+    """
+
+    def __init__(self, now: float):
+        self.heights: Dict[str, int] = {} # publisher -> chain height
+        self.tips: OrderedDict = OrderedDict() # height -> set of tip hashes
+        self.forks_total = 0
+        self.reset(now)
+
+
+    def reset(self, now: float):
+        """Start a new window."""
+        self.start = now
+        self.counts: Counter = Counter()
+        self.bytes: Counter = Counter()
+        self.max_bytes: Counter = Counter()
+        self.sizes = metrics.Histogram('frame_bytes',
+                                       bounds=metrics.BYTE_BUCKETS)
+        self.blocks = 0
+        self.forks = 0
+
+
+    def observe(self, frame: bytes):
+        """Count frame, and record the chain tip it announces, if any."""
+        _, kind, _ = peek_frame(frame)
+        k = kind.decode(errors='replace')
+        self.counts[k] += 1
+        self.bytes[k] += len(frame)
+        self.max_bytes[k] = max(self.max_bytes[k], len(frame))
+        self.sizes.observe(len(frame))
+
+        if kind in DECODED:
+            try:
+                tip = announced_tip(decode_frame(frame)[1])
+            except (ValueError, KeyError, IndexError, TypeError):
+                self.counts['(bad)'] += 1
+                return
+            if tip:
+                self.add_tip(*tip)
+
+
+    def add_tip(self, publisher: str, height: int, h: Optional[str]):
+        """Record publisher's chain height, and count a new block (and a fork,
+        if another block was seen at the same height).
+        """
+        self.heights[publisher] = height
+        if h is None:
+            return
+        seen: Optional[Set[str]] = self.tips.get(height)
+        if seen is None:
+            self.tips[height] = {h}
+            if len(self.tips) > FORK_HEIGHTS:
+                self.tips.popitem(last=False)
+            self.blocks += 1
+        elif h not in seen:
+            seen.add(h)
+            self.blocks += 1
+            self.forks += 1
+            self.forks_total += 1
+
+
+    def render(self, now: float) -> str:
+        """Return dashboard string of the current window."""
+        elapsed = max(now - self.start, 1e-9)
+        txns = self.counts['TXN ']
+        lines = [f'{"-" * 30} {elapsed:.1f}s window {"-" * 30}',
+                 f'txns/s {txns / elapsed:.2f} | '
+                 f'blocks/s {self.blocks / elapsed:.3f} | '
+                 f'forks {self.forks} (total {self.forks_total})']
+
+        heights = sorted(self.heights.items(), key=lambda x: -x[1])
+        lines.append('heights: ' + (', '.join(f'{p} {n}' for p, n in heights)
+                                    or '-'))
+        lines.append('msgs: ' + (' | '.join(
+            f'{k.strip()} {n} ({show_bytes(self.bytes[k])}, '
+            f'max {show_bytes(self.max_bytes[k])})'
+            for k, n in sorted(self.counts.items())) or '-'))
+
+        bounds = [int(b) for b in self.sizes.bounds]
+        labels = ([f'<={show_bytes(b)}' for b in bounds] +
+                  [f'>{show_bytes(bounds[-1])}'])
+        lines.append('sizes: ' + (' | '.join(
+            f'{label} {n}' for label, n in zip(labels, self.sizes.buckets)
+            if n) or '-'))
+        return '\n'.join(lines)
+
+
+def announced_tip(data: bytes) -> Optional[Tip]:
+    """Publisher, height and tip hash announced by a chain message (type +
+    body), decoding as little as possible.
+    """
+    kind, payload = data[:4], data[4:]
+    if kind == b'CMPT':
+        announcement = json.loads(payload)
+        hdr = json.loads(json.loads(announcement['block'])['header'])
+        return announcement['node'], announcement['height'], hdr['this_hash']
+    if kind == b'HDRS':
+        announcement = json.loads(payload)
+        headers = json.loads(announcement['headers'])
+        h = json.loads(headers[-1])['this_hash'] if headers else None
+        return announcement['node'], len(headers), h
+    if kind == b'BLOC': # no publisher in the message
+        if serialize.wire_version(payload) == 1:
+            hdrs = serialize.unpack_blockchain_headers(payload)
+            h = serialize.b2s(hdrs[-1]['this_hash']) if hdrs else None
+            return 'BLOC', len(hdrs), h
+        n = json.loads(payload.split(b'\n', 1)[0])['blocks']
+        h = json.loads(payload.rsplit(b'\n', 2)[-2])['this_hash'] if n else None
+        return 'BLOC', n, h
+    if kind == b'STAT':
+        stats = json.loads(payload)
+        height = stats['metrics'].get('chain_height', {}).get('value')
+        return None if height is None else (stats['node'], height, None)
+    return None
+
+
+def show_bytes(n: int) -> str:
+    """Byte count, abbreviated."""
+    for unit in ['B', 'K', 'M']:
+        if n < 1024:
+            return f'{n}{unit}'
+        n //= 1024
+    return f'{n}G'
@@ -4,9 +4,17 @@ Used in toycoin for monitoring network activity, indepepdently on nodes.
 
 
 import asyncio # type: ignore
-import argparse, uuid # type: ignore
-from toycoin.network import serialize, show # type: ignore
-from toycoin.network.msg_protocol import read_msg, send_msg # type: ignore
+import argparse, json, time, uuid # type: ignore
+from toycoin import block # type: ignore
+from toycoin.network import blockcache, dashboard, metrics, profiling, serialize, show # type: ignore
+from toycoin.network.msg_protocol import FrameReader, FrameWriter, decode_frame, hello, subscribe # type: ignore
+from typing import Optional # type: ignore
+
+
+################################################################################
+
+
+MODES = ['summary', 'full', 'stats'] # show chains, or just windowed stats
 
 
 ################################################################################
@@ -15,15 +23,29 @@ from toycoin.network.msg_protocol import read_msg, send_msg # type: ignore
 async def main(args):
     me = uuid.uuid4().hex[:8]
     print(f'Starting up {me}: Listener')
+    profiling.install(f'listener-{me}', args.profile_dir, args.slow_callback)
     reader, writer = await asyncio.open_connection(args.host, args.port)
     print(f'I am {writer.get_extra_info("sockname")}')
     print(f'Listening on channel {args.listen}')
-    await send_msg(writer, args.listen.encode())
+    frames, frame_writer = FrameReader(reader), FrameWriter(writer)
+    await hello(frames, frame_writer)
+    await subscribe(frame_writer, args.listen.encode())
+    summary = (show.ChainSummary(args.block_interval, args.max_blocks)
+               if args.mode == 'summary' else None)
+    stats = (dashboard.Dashboard(time.monotonic())
+             if args.mode == 'stats' else None)
+    if stats:
+        asyncio.create_task(dashboard_worker(stats, args.window))
 
     try:
-        while data := await read_msg(reader):
-            handle_data(data)
-            print('Transmission ended.')
+        while batch := await frames.read():
+            for frame in batch:
+                if stats:
+                    stats.observe(frame)
+                    continue
+                handle_data(decode_frame(frame)[1], args.block_interval,
+                            summary)
+                print('Transmission ended.')
     except asyncio.IncompleteReadError:
         print('Server closed.')
 
@@ -32,17 +54,76 @@ async def main(args):
         await writer.wait_closed()
 
 
+async def dashboard_worker(stats: dashboard.Dashboard, window: float):
+    """Print the dashboard and start a new window, every window seconds."""
+    while True:
+        await asyncio.sleep(window)
+        now = time.monotonic()
+        print(stats.render(now), flush=True)
+        stats.reset(now)
+
+
 ################################################################################
 # Data Handler
 
-def handle_data(data: bytes):
-    """Data handler."""
+
+BLOCK_CACHE = blockcache.BlockCache() # blocks of chains seen before
+
+INDEX = block.ChainIndex() # txn hashes of blocks seen before
+
+VALIDATED = block.ValidatedBlocks() # blocks proven valid
+
+
+def handle_data(data: bytes,
+                interval: int = block.BLOCK_INTERVAL,
+                summary: Optional[show.ChainSummary] = None):
+    """Data handler. Chains are shown in full, or summarized if a summary
+    renderer is given.
+    """
     if data[:4] == b'TXN ':
         txn_pair = serialize.unpack_txn_pair(data[4:])
         print(f'Received TXN:\n{show.show_txn_pair(txn_pair)}')
     elif data[:4] == b'BLOC':
-        chain = serialize.unpack_blockchain(data[4:])
-        print(f'Received BLOC:\n{show.show_blockchain(chain)}')
+        chain = BLOCK_CACHE.unpack_blockchain(data[4:])
+        if summary:
+            shown = summary.render(chain)
+        else:
+            INDEX.update(chain)
+            shown = show.show_blockchain(chain, interval, INDEX, VALIDATED)
+        print(f'Received BLOC:\n{shown}')
+    elif data[:4] == b'HDRS':
+        announcement = json.loads(data[4:])
+        headers = serialize.unpack_headers(announcement['headers'])
+        print(f'Received HDRS from {announcement["node"]}:\n'
+              f'{show.show_headers(headers)}')
+    elif data[:4] == b'GETB':
+        request = json.loads(data[4:])
+        print(f'Received GETB for {len(request["hashes"])} bodies, '
+              f'addressed to {request["node"]}')
+    elif data[:4] == b'BODY':
+        h, txns = serialize.unpack_body(data[4:])
+        print(f'Received BODY of {serialize.b2s(h)[:10]}... '
+              f'with {len(txns)} txns')
+    elif data[:4] == b'GETH':
+        request = json.loads(data[4:])
+        print(f'Received GETH addressed to {request["node"]}')
+    elif data[:4] == b'CMPT':
+        announcement = json.loads(data[4:])
+        hdr, ids = serialize.unpack_compact_block(announcement['block'])
+        print(f'Received CMPT from {announcement["node"]} with {len(ids)} '
+              f'short txn ids:\n{show.show_headers([hdr])}')
+    elif data[:4] == b'GETT':
+        request = json.loads(data[4:])
+        print(f'Received GETT for {len(request["indexes"])} txns of '
+              f'{request["hash"][:10]}..., addressed to {request["node"]}')
+    elif data[:4] == b'BTXN':
+        response = json.loads(data[4:])
+        print(f'Received BTXN with {len(response["txns"])} txns of '
+              f'{response["hash"][:10]}...')
+    elif data[:4] == b'STAT':
+        stats = json.loads(data[4:])
+        print(f'Received STAT from {stats["node"]}:\n'
+              f'{metrics.show_snapshot(stats["metrics"])}')
     else:
         print(f'Couldn not handle message type {data[:4].decode()}')
 
@@ -55,6 +136,13 @@ if __name__ == '__main__':
     parser.add_argument('--host', default='localhost')
     parser.add_argument('--port', default=25000)
     parser.add_argument('--listen', default='/topic/main')
+    parser.add_argument('--block_interval', default=block.BLOCK_INTERVAL,
+                        type=int)
+    parser.add_argument('--mode', default='summary', choices=MODES)
+    parser.add_argument('--max_blocks', default=3, type=int) # in summaries
+    parser.add_argument('--window', default=10, type=float) # stats, seconds
+    parser.add_argument('--profile_dir', default='profiles')
+    parser.add_argument('--slow_callback', default=0.1, type=float)
 
     try:
         asyncio.run(main(parser.parse_args()))
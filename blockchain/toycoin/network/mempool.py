@@ -0,0 +1,255 @@
+"""Mempool: validated txns waiting to be included in a block.
+Txns are kept in arrival order, and can be selected for block templates by
+arrival time or by priority. A Merkle frontier over the pending txn hashes, in
+arrival order, keeps a live candidate root as txns stream in.
+
+The pool is bounded by the serialized size of its txns: past the budget, txns
+are evicted oldest first or lowest priority first. Txns also expire after
+waiting too long. Its entries can be snapshot (see serialize.pack_mempool)
+and restored, so a restarted node keeps its pending txns.
+"""
+
+
+import heapq, threading, time # type: ignore
+from toycoin import hash, merkle, transaction # type: ignore
+from typing import Dict, List, NamedTuple, Optional, Tuple # type: ignore
+
+
+################################################################################
+
+
+SELECT_POLICIES = ['arrival', 'priority']
+
+EVICT_POLICIES = ['oldest', 'priority']
+
+MAX_BYTES = 32 * 2 ** 20 # serialized txn bytes
+
+EXPIRY = 3600 # seconds a txn may wait for a block
+
+
+class Entry(NamedTuple):
+    seq: int # arrival order
+    txn_pair: transaction.TxnPair
+    size: int # serialized txn bytes
+    priority: float
+    time: float # arrival, seconds since the epoch
+
+
+class Mempool:
+    """Pending txn pairs, keyed by txn hash, within max_bytes.
+    The hash of each pending txn object is also indexed by object id, so
+    lookups for txns handed out by select() don't re-hash them. Changes are
+    locked, so block assembly can take the root from a worker thread.
+    """
+
+    def __init__(self,
+                 max_bytes: int = MAX_BYTES,
+                 expiry: float = EXPIRY,
+                 evict: str = 'oldest'):
+        if evict not in EVICT_POLICIES:
+            raise ValueError(f'Unknown evict policy {evict}')
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        self.evict = evict
+        self.entries: Dict[hash.Hash, Entry] = {}
+        self.hashes: Dict[int, hash.Hash] = {} # id(txn) -> txn hash
+        # over entries, in order; None once txns are removed, until needed
+        self.frontier: Optional[merkle.MerkleFrontier] = \
+            merkle.MerkleFrontier()
+        # (priority, seq, txn hash), for priority eviction; may hold
+        # entries already removed
+        self.heap: List[Tuple[float, int, hash.Hash]] = []
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.bytes = 0
+        self.evicted = 0
+        self.expired = 0
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def __contains__(self, txn_hash: hash.Hash) -> bool:
+        return txn_hash in self.entries
+
+
+    def add(self,
+            txn_pair: transaction.TxnPair,
+            size: int,
+            priority: float = 0,
+            now: Optional[float] = None
+            ) -> Optional[hash.Hash]:
+        """Add txn pair (if not present), arriving now, and evict txns as
+        needed to stay within max_bytes. Returns its txn hash, or None if it
+        did not fit: it is larger than the budget, or was evicted itself.
+        """
+        _, txn = txn_pair
+        h = transaction.hash_txn(txn)
+        now = time.time() if now is None else now
+        with self.lock:
+            if h in self.entries:
+                return h
+            if size > self.max_bytes:
+                self.evicted += 1
+                return None
+            self.entries[h] = Entry(self.seq, txn_pair, size, priority, now)
+            self.hashes[id(txn)] = h
+            self.bytes += size
+            if self.frontier is not None:
+                self.frontier.append(h)
+            if self.evict == 'priority':
+                heapq.heappush(self.heap, (priority, self.seq, h))
+            self.seq += 1
+            self._evict()
+            return h if h in self.entries else None
+
+
+    def remove(self, txns: List[transaction.Transaction]):
+        """Remove given txns (e.g. once they are in a block). The frontier is
+        rebuilt from the remaining txn hashes when next needed; no txn is
+        re-hashed.
+        """
+        with self.lock:
+            for txn in txns:
+                self._pop(self.hashes.get(id(txn)) or
+                          transaction.hash_txn(txn))
+
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Remove txns that arrived more than expiry seconds before now.
+        Returns how many.
+        """
+        cutoff = (time.time() if now is None else now) - self.expiry
+        with self.lock:
+            expired = []
+            for h, entry in self.entries.items(): # oldest first
+                if entry.time >= cutoff:
+                    break
+                expired.append(h)
+            for h in expired:
+                self._pop(h)
+            self.expired += len(expired)
+        return len(expired)
+
+
+    def clear(self):
+        """Remove all txns."""
+        with self.lock:
+            self.entries = {}
+            self.hashes = {}
+            self.frontier = merkle.MerkleFrontier()
+            self.heap = []
+            self.bytes = 0
+
+
+    def snapshot(self) -> List[Entry]:
+        """All entries, in arrival order."""
+        with self.lock:
+            return list(self.entries.values())
+
+
+    def restore(self, entries: List[Entry], now: Optional[float] = None
+                ) -> int:
+        """Add entries (e.g. of a snapshot) that have not expired by now,
+        keeping their arrival times. Returns how many were added.
+        """
+        cutoff = (time.time() if now is None else now) - self.expiry
+        n = 0
+        for e in entries:
+            if e.time >= cutoff and \
+               self.add(e.txn_pair, e.size, e.priority, e.time) is not None:
+                n += 1
+        return n
+
+
+    def root(self) -> Optional[hash.Hash]:
+        """Live Merkle root of all pending txns, in arrival order."""
+        with self.lock:
+            return self._frontier().root()
+
+
+    def merkle_root(self, txns: List[transaction.Transaction]) -> hash.Hash:
+        """Merkle root of txns handed out by select(), for block assembly:
+        the live root if they are all pending txns in arrival order, and from
+        their known hashes otherwise.
+        """
+        hashes = [self.hashes.get(id(txn)) or transaction.hash_txn(txn)
+                  for txn in txns]
+        with self.lock:
+            if len(hashes) == len(self.entries) and \
+               hashes == list(self.entries):
+                root = self._frontier().root()
+            else:
+                root = merkle.root(hashes)
+        assert root is not None
+        return root
+
+
+    def txn_pairs(self) -> List[transaction.TxnPair]:
+        """All txn pairs, in arrival order."""
+        return [e.txn_pair for e in self.entries.values()]
+
+
+    def txns(self) -> Dict[hash.Hash, transaction.Transaction]:
+        """All txns, keyed by txn hash."""
+        return {h: e.txn_pair[1] for h, e in self.entries.items()}
+
+
+    def select(self, policy: str = 'arrival') -> List[transaction.TxnPair]:
+        """All txn pairs, ordered for block assembly.
+        'arrival' is oldest first, 'priority' is highest priority first
+        (oldest first among equal priorities).
+        """
+        if policy == 'arrival':
+            entries = list(self.entries.values())
+        elif policy == 'priority':
+            entries = sorted(self.entries.values(),
+                             key=lambda e: (-e.priority, e.seq))
+        else:
+            raise ValueError(f'Unknown select policy {policy}')
+        return [e.txn_pair for e in entries]
+
+
+    def size(self, txn: transaction.Transaction) -> int:
+        """Serialized size of pending txn (raw field size if unknown)."""
+        h = self.hashes.get(id(txn))
+        return self.entries[h].size if h else transaction.txn_size(txn)
+
+
+    def total_bytes(self) -> int:
+        """Total serialized size of pending txns."""
+        return self.bytes
+
+
+    def _evict(self):
+        """Evict txns, by the evict policy, until within max_bytes."""
+        while self.bytes > self.max_bytes:
+            if self.evict == 'oldest':
+                h = next(iter(self.entries))
+            else:
+                _, seq, h = heapq.heappop(self.heap)
+                if self.entries.get(h, (None,))[0] != seq:
+                    continue # removed already
+            self._pop(h)
+            self.evicted += 1
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(e.priority, e.seq, h)
+                         for h, e in self.entries.items()]
+            heapq.heapify(self.heap)
+
+
+    def _pop(self, h: hash.Hash):
+        """Remove txn h, if pending."""
+        entry = self.entries.pop(h, None)
+        if entry:
+            self.hashes.pop(id(entry.txn_pair[1]), None)
+            self.bytes -= entry.size
+            self.frontier = None
+
+
+    def _frontier(self) -> merkle.MerkleFrontier:
+        """Frontier over pending txn hashes, rebuilt if txns were removed."""
+        if self.frontier is None:
+            self.frontier = merkle.MerkleFrontier(list(self.entries))
+        return self.frontier
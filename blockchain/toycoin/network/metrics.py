@@ -0,0 +1,190 @@
+"""Metrics registry for toycoin processes.
+Counters, gauges and histograms, registered by name and snapshotted to a
+JSON-friendly dict (e.g. for periodic STAT messages).
+"""
+
+
+import bisect # type: ignore
+import contextlib # type: ignore
+import time # type: ignore
+from typing import Dict, Iterator, List, Optional, Union # type: ignore
+
+
+################################################################################
+
+
+Snapshot = Dict[str, dict]
+
+# default histogram bounds: seconds, from 100us to 100s
+TIME_BUCKETS = [0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3,
+                1, 3, 10, 30, 100]
+
+# default histogram bounds: bytes, from 256B to 64MB
+BYTE_BUCKETS = [2 ** n for n in range(8, 27, 2)]
+
+
+################################################################################
+# Metric Types
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+
+    def inc(self, n: int = 1):
+        """Increment counter by n."""
+        self.value += n
+
+
+    def snapshot(self) -> dict:
+        return {'type': 'counter', 'value': self.value}
+
+
+class Gauge:
+    """Value that can go up and down."""
+
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self.value: Union[int, float] = 0
+
+
+    def set(self, value: Union[int, float]):
+        """Set gauge value."""
+        self.value = value
+
+
+    def inc(self, n: Union[int, float] = 1):
+        """Increment gauge by n."""
+        self.value += n
+
+
+    def dec(self, n: Union[int, float] = 1):
+        """Decrement gauge by n."""
+        self.value -= n
+
+
+    def snapshot(self) -> dict:
+        return {'type': 'gauge', 'value': self.value}
+
+
+class Histogram:
+    """Distribution of observed values, counted in fixed buckets.
+    Bucket i counts values <= bounds[i]; the last bucket counts the rest.
+    """
+
+    def __init__(self,
+                 name: str,
+                 help: str = '',
+                 bounds: Optional[List[float]] = None):
+        self.name = name
+        self.help = help
+        self.bounds = sorted(bounds if bounds is not None else TIME_BUCKETS)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+
+    def observe(self, value: float):
+        """Record a value."""
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe wall time (seconds) spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+    def snapshot(self) -> dict:
+        return {'type': 'histogram',
+                'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.sum / self.count if self.count else None,
+                'bounds': self.bounds,
+                'buckets': self.buckets}
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+################################################################################
+# Registry
+
+
+class Registry:
+    """Named metrics; getters create the metric on first use."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        """Get or create counter."""
+        return self._get(name, lambda: Counter(name, help), Counter)
+
+
+    def gauge(self, name: str, help: str = '') -> Gauge:
+        """Get or create gauge."""
+        return self._get(name, lambda: Gauge(name, help), Gauge)
+
+
+    def histogram(self,
+                  name: str,
+                  help: str = '',
+                  bounds: Optional[List[float]] = None
+                  ) -> Histogram:
+        """Get or create histogram."""
+        return self._get(name, lambda: Histogram(name, help, bounds), Histogram)
+
+
+    def _get(self, name, create, kind):
+        """Get metric by name, creating it if needed; check its type."""
+        if name not in self.metrics:
+            self.metrics[name] = create()
+        metric = self.metrics[name]
+        assert isinstance(metric, kind), f'{name} is not a {kind.__name__}'
+        return metric
+
+
+    def snapshot(self) -> Snapshot:
+        """Current value of all metrics."""
+        return {name: metric.snapshot()
+                for name, metric in sorted(self.metrics.items())}
+
+
+REGISTRY = Registry()
+
+
+################################################################################
+# Display
+
+
+def show_snapshot(snapshot: Snapshot) -> str:
+    """Return compact string of a metrics snapshot."""
+    lines = []
+    for name, m in snapshot.items():
+        if m['type'] == 'histogram':
+            mean = f'{m["mean"]:.4g}' if m['mean'] is not None else '-'
+            max_ = f'{m["max"]:.4g}' if m['max'] is not None else '-'
+            lines.append(f'{name}: count {m["count"]} mean {mean} max {max_}')
+        else:
+            lines.append(f'{name}: {m["value"]}')
+    return '\n'.join(lines)
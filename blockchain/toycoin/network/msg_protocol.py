@@ -1,20 +1,224 @@
 """Simple message protocol.
+
+Each message is a single frame, carrying its channel and type code in the
+header:
+
+    size (4) | flags (1) | type (4) | channel size (1) | channel | body
+
+where size counts the bytes after the size field. Messages are passed around
+as data = type + body, as before.
+
+Connections may open with a HELO exchange to negotiate compression, after
+which bodies over a size threshold are sent compressed, with the COMPRESSED
+flag set. The type code and channel are never compressed.
 """
 
 
+import asyncio # type: ignore
+import json, struct, zlib # type: ignore
 from asyncio import StreamReader, StreamWriter # type: ignore
+from collections import deque # type: ignore
+from typing import Deque, List, Optional, Tuple # type: ignore
+
+
+################################################################################
+
+
+HEADER = struct.Struct('>IB4sB')
+
+COMPRESSED = 0x01 # flag: body is zlib compressed
+
+HELLO = b'HELO' # compression offer, and the relay's answer
+
+SUBSCRIBE = b'SUB ' # first message on a connection, on the channel to receive
+
+ZLIB = 'zlib'
+
+COMPRESS_MIN = 1024 # smallest body worth compressing
+
+COMPRESS_LEVEL = 1 # compressing is on the event loop, keep it cheap
+
+READ_SIZE = 2 ** 16
+
+
+################################################################################
+# Frames
+
+
+def encode_frame(channel: bytes,
+                 data: bytes,
+                 flags: int = 0,
+                 compress_min: Optional[int] = None) -> List[bytes]:
+    """Frame data (type + body) on channel, as parts for writelines.
+    Bodies of at least compress_min bytes are compressed, if that makes them
+    smaller. Otherwise the body is not copied.
+    """
+    if len(channel) > 255:
+        raise ValueError(f'Channel name too long: {channel[:20]!r}...')
+    body = memoryview(data)[4:]
+    if compress_min is not None and len(body) >= compress_min:
+        packed = zlib.compress(body, COMPRESS_LEVEL)
+        if len(packed) < len(body):
+            body, flags = memoryview(packed), flags | COMPRESSED
+    size = HEADER.size - 4 + len(channel) + len(body)
+    header = HEADER.pack(size, flags, data[:4], len(channel))
+    return [header + channel, body] # type: ignore
+
+
+def decode_frame(frame: bytes) -> Tuple[bytes, bytes]:
+    """Channel and data (type + body) of frame."""
+    _, flags, kind, n = HEADER.unpack_from(frame)
+    body = frame[HEADER.size + n:]
+    if flags & COMPRESSED:
+        body = zlib.decompress(body)
+    return frame[HEADER.size:HEADER.size + n], kind + body
+
+
+def peek_frame(frame: bytes) -> Tuple[int, bytes, bytes]:
+    """Flags, type and channel of frame, without decoding the body."""
+    _, flags, kind, n = HEADER.unpack_from(frame)
+    return flags, kind, frame[HEADER.size:HEADER.size + n]
+
+
+def decompress_frame(frame: bytes) -> bytes:
+    """Frame with its body decompressed, for peers without compression."""
+    channel, data = decode_frame(frame)
+    return b''.join(encode_frame(channel, data))
+
+
+################################################################################
+# Handshake
+
+
+def hello_msg(algorithms: List[str]) -> bytes:
+    """HELO message offering (or accepting) compression algorithms."""
+    return HELLO + json.dumps({'compress': algorithms}).encode()
+
+
+def negotiate(data: bytes, supported: List[str]) -> Optional[str]:
+    """First algorithm in HELO message data that is supported, if any."""
+    offered = json.loads(data[4:])['compress']
+    return next((a for a in offered if a in supported), None)
 
 
 ################################################################################
+# Streams
+
+
+class FrameReader:
+    """Reads frames from a stream, parsing all complete frames from each
+    buffer read.
+    """
+
+    def __init__(self, stream: StreamReader, read_size: int = READ_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.buffer = bytearray()
+        self.frames: Deque[bytes] = deque()
+
+
+    async def read(self) -> List[bytes]:
+        """Next frames: all complete frames read so far, waiting for at least
+        one. Raises IncompleteReadError when the stream closes.
+        """
+        while not self.frames:
+            await self.fill()
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+
+    async def read_frame(self) -> bytes:
+        """Next single frame."""
+        while not self.frames:
+            await self.fill()
+        return self.frames.popleft()
+
+
+    async def fill(self):
+        """Read from the stream and parse complete frames. The rest of a
+        large frame is read in one go once its size is known.
+        """
+        buffer = self.buffer
+        if len(buffer) >= 4:
+            missing = 4 + int.from_bytes(buffer[:4], 'big') - len(buffer)
+            chunk = await self.stream.readexactly(missing) \
+                if missing > self.read_size else \
+                await self.stream.read(self.read_size)
+        else:
+            chunk = await self.stream.read(self.read_size)
+        if not chunk:
+            raise asyncio.IncompleteReadError(bytes(buffer), None)
+        buffer += chunk
+
+        i = 0
+        while len(buffer) - i >= 4:
+            end = i + 4 + int.from_bytes(buffer[i:i + 4], 'big')
+            if end > len(buffer):
+                break
+            self.frames.append(bytes(buffer[i:end]))
+            i = end
+        del buffer[:i]
+
+
+class FrameWriter:
+    """Pipelined frame writer. Frames written while a drain is in progress
+    go out together, with a single drain.
+    """
+
+    def __init__(self, stream: StreamWriter):
+        self.stream = stream
+        self.pending: List[bytes] = []
+        self.lock = asyncio.Lock()
+        self.drains = 0
+        self.compress_min: Optional[int] = None # set by hello
+
+
+    def write(self, channel: bytes, data: bytes):
+        """Queue data (type + body) on channel, to go out on the next flush."""
+        self.pending.extend(encode_frame(channel, data,
+                                         compress_min=self.compress_min))
+
+
+    async def flush(self):
+        """Write all queued frames and drain once. Callers arriving during a
+        drain wait for it, then flush what they queued in the meantime.
+        """
+        async with self.lock:
+            if not self.pending:
+                return
+            parts, self.pending = self.pending, []
+            self.stream.writelines(parts)
+            await self.stream.drain()
+            self.drains += 1
+
+
+    async def send(self, channel: bytes, data: bytes):
+        """Write data (type + body) on channel and flush."""
+        self.write(channel, data)
+        await self.flush()
+
+
+async def hello(reader: FrameReader,
+                writer: FrameWriter,
+                compress_min: int = COMPRESS_MIN) -> Optional[str]:
+    """Offer compression to the relay, and compress frames of at least
+    compress_min bytes if it accepts. A negative compress_min offers nothing.
+    Returns the algorithm agreed on.
+    """
+    algorithms = [ZLIB] if compress_min >= 0 else []
+    await writer.send(b'', hello_msg(algorithms))
+    _, data = decode_frame(await reader.read_frame())
+    algorithm = negotiate(data, algorithms)
+    writer.compress_min = compress_min if algorithm else None
+    return algorithm
+
 
+async def subscribe(writer: FrameWriter, channel: bytes):
+    """Subscribe the connection to channel."""
+    await writer.send(channel, SUBSCRIBE)
 
-async def read_msg(stream: StreamReader) -> bytes:
-    size_bytes = await stream.readexactly(4)
-    size = int.from_bytes(size_bytes, byteorder='big')
-    data = await stream.readexactly(size)
-    return data
 
-async def send_msg(stream: StreamWriter, data: bytes):
-    size_bytes = len(data).to_bytes(4, byteorder='big')
-    stream.writelines([size_bytes, data])
-    await stream.drain()
+async def send_channel_msg(writer: FrameWriter, channel: bytes, data: bytes):
+    """Send data (type + body) on channel."""
+    await writer.send(channel, data)
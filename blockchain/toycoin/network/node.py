@@ -5,11 +5,13 @@
 
 import asyncio # type: ignore
 from asyncio import Queue # type: ignore
-import argparse, uuid # type: ignore
-from toycoin import block, transaction # type: ignore
-from toycoin.network import serialize, show # type: ignore
-from toycoin.network.msg_protocol import read_msg, send_msg # type: ignore
-from typing import List, Optional, Tuple # type: ignore
+import argparse, json, os, time, uuid # type: ignore
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor # type: ignore
+from toycoin import block, hash, transaction # type: ignore
+from toycoin.network import blockcache, blocktree, compact, mempool, metrics, profiling, seen, serialize, show, sync # type: ignore
+from toycoin.network import msg_protocol # type: ignore
+from toycoin.network.msg_protocol import FrameReader, FrameWriter, decode_frame, hello, send_channel_msg, subscribe # type: ignore
+from typing import Callable, Dict, List, Optional, Tuple # type: ignore
 
 
 ################################################################################
@@ -17,7 +19,37 @@ from typing import List, Optional, Tuple # type: ignore
 
 Address = bytes
 
-BLOCKCHAIN : block.Blockchain = []
+ME = '' # node id, used to address sync requests
+
+ANNOUNCE_POLICIES = ['compact', 'headers', 'blocks', 'both']
+
+BLOCKCHAIN : block.Blockchain = [] # best chain of TREE
+
+BLOCK_CACHE = blockcache.BlockCache() # packed and unpacked blocks
+
+CHECKPOINTS : block.Checkpoints = {} # blocks assumed valid, up to the last
+
+INDEX = block.ChainIndex() # txn hash -> (height, txn) of BLOCKCHAIN
+
+MEMPOOL = mempool.Mempool() # validated txns waiting for a block
+
+METRICS = metrics.REGISTRY
+
+PARTIAL : Dict[hash.Hash, compact.PartialTxns] = {} # compact block in progress
+
+POOL : Optional[ThreadPoolExecutor] = None # validation worker pool
+
+PROCS : Optional[ProcessPoolExecutor] = None # parallel chain validation
+
+SEEN = seen.SeenFilter() # recently received txn payloads
+
+SYNC = sync.HeaderSync() # headers-first sync candidate
+
+TREE = blocktree.BlockTree() # validated blocks of all recent branches
+
+VALIDATED = block.ValidatedBlocks() # blocks proven valid
+
+WIRE_VERSION = serialize.WIRE_VERSION # for BLOC and BODY we send
 
 
 ################################################################################
@@ -26,67 +58,510 @@ BLOCKCHAIN : block.Blockchain = []
 
 async def main(args):
     """Main."""
-    me = uuid.uuid4().hex[:8]
+    global BLOCK_CACHE, CHECKPOINTS, MEMPOOL, ME, POOL, PROCS, SEEN, SYNC
+    global TREE, VALIDATED, WIRE_VERSION
+    me = ME = uuid.uuid4().hex[:8]
     print(f'Starting up {me}: Full Node')
-    reader, writer = await asyncio.open_connection(args.host, args.port)
-    print(f'I am {writer.get_extra_info("sockname")}')
+    profiling.install(f'node-{me}', args.profile_dir, args.slow_callback)
+    reader, stream = await asyncio.open_connection(args.host, args.port)
+    print(f'I am {stream.get_extra_info("sockname")}')
+    frames, writer = FrameReader(reader), FrameWriter(stream)
+
+    if args.checkpoints and os.path.exists(args.checkpoints):
+        with open(args.checkpoints) as f:
+            CHECKPOINTS = serialize.unpack_checkpoints(f.read())
+        print(f'Loaded {len(CHECKPOINTS)} checkpoints')
+
+    MEMPOOL = mempool.Mempool(args.mempool_bytes, args.mempool_expiry,
+                              args.evict)
+    if args.mempool_snapshot and os.path.exists(args.mempool_snapshot):
+        with open(args.mempool_snapshot) as f:
+            n = MEMPOOL.restore(serialize.unpack_mempool(f.read()))
+        print(f'Restored {n} pending txns')
 
     channel = args.channel
     print(f'Node on channel {channel}')
-    await send_msg(writer, channel.encode())
-
-    txn_queue = Queue()
-    asyncio.create_task(block_worker(txn_queue, writer, channel, args.delay))
+    compression = await hello(frames, writer, args.compress_min)
+    print(f'Compression: {compression}')
+    await subscribe(writer, channel.encode())
+
+    # validation pipeline: read -> decode -> signatures -> tokens & blocks,
+    # with CPU-heavy work in the worker pool and bounded queues in between
+    POOL = ThreadPoolExecutor(args.workers, thread_name_prefix='validate')
+    if args.validation_procs > 0:
+        PROCS = ProcessPoolExecutor(args.validation_procs)
+    inbox: Queue = Queue(args.queue_size)
+    sig_queue: Queue = Queue(args.queue_size)
+    txn_queue: Queue = Queue(args.queue_size)
+    chain_queue: Queue = Queue(args.queue_size)
+    SYNC = sync.HeaderSync(args.max_in_flight, args.sync_timeout,
+                           args.sync_requests)
+    SEEN = seen.SeenFilter(args.seen_size)
+    BLOCK_CACHE = blockcache.BlockCache(args.block_cache)
+    VALIDATED = block.ValidatedBlocks(args.block_cache)
+    TREE = blocktree.BlockTree(args.block_interval, VALIDATED)
+    WIRE_VERSION = args.wire_version
+
+    asyncio.create_task(decode_worker(inbox, sig_queue, chain_queue))
+    for _ in range(args.workers):
+        asyncio.create_task(signature_worker(sig_queue, txn_queue))
+    asyncio.create_task(chain_worker(chain_queue, writer, channel, args))
+    asyncio.create_task(sync_worker(writer, channel))
+    asyncio.create_task(block_worker(txn_queue, writer, channel, args))
+    if args.stats_interval > 0:
+        asyncio.create_task(stats_worker(writer, args.stats_channel,
+                                         args.stats_interval, me))
+    if args.mempool_snapshot:
+        asyncio.create_task(snapshot_worker(args.mempool_snapshot,
+                                            args.snapshot_interval))
 
     try:
-        while data := await read_msg(reader):
-            handle_data(data, txn_queue)
+        while batch := await frames.read():
+            for frame in batch:
+                METRICS.counter('frame_bytes_received').inc(len(frame))
+                await receive(decode_frame(frame)[1], inbox)
     except asyncio.IncompleteReadError:
         print('Server closed.')
 
     finally:
-        writer.close()
-        await writer.wait_closed()
+        stream.close()
+        await stream.wait_closed()
+        POOL.shutdown(wait=False, cancel_futures=True)
+        if PROCS:
+            PROCS.shutdown(wait=False, cancel_futures=True)
+        if args.mempool_snapshot:
+            save_mempool(args.mempool_snapshot)
+
+
+async def receive(data: bytes, inbox: Queue):
+    """Queue raw message for decoding.
+    Txns seen recently are dropped. When the pipeline is saturated, txns are
+    shed rather than stalling the socket reader; other messages wait for
+    space.
+    """
+    METRICS.counter(f'msgs_received.{data[:4].decode().strip()}').inc()
+    METRICS.counter('bytes_received').inc(len(data))
+    if data[:4] == b'TXN ':
+        key = seen.digest(data)
+        if key in SEEN:
+            SEEN.add(key) # refresh
+            METRICS.counter('txns_duplicate').inc()
+            return
+        if inbox.full():
+            METRICS.counter('txns_shed').inc()
+            return
+        SEEN.add(key)
+    await inbox.put(data)
+    METRICS.gauge('inbox_depth').set(inbox.qsize())
 
 
 ################################################################################
-# Data Handler
+# Worker Pool
+
+
+async def in_pool(metric: str, f: Callable, *args):
+    """Run CPU-heavy f in the validation pool, timing it in a histogram."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(POOL, timed, metric, f, *args)
+
+
+def timed(metric: str, f: Callable, *args):
+    """Call f, observing its run time in the named histogram."""
+    with METRICS.histogram(metric).time():
+        return f(*args)
+
+
+################################################################################
+# Pipeline Stages
+
 
+CHAIN_MSGS = (b'BLOC', b'HDRS', b'GETB', b'BODY', b'GETH',
+              b'CMPT', b'GETT', b'BTXN')
 
-def handle_data(data: bytes, txn_queue: Queue):
+
+async def decode_worker(inbox: Queue, sig_queue: Queue, chain_queue: Queue):
+    """Decode stage: route messages to the next stage by type."""
+    while True:
+        data = await inbox.get()
+        METRICS.gauge('inbox_depth').set(inbox.qsize())
+        await handle_data(data, sig_queue, chain_queue)
+
+
+async def handle_data(data: bytes, sig_queue: Queue, chain_queue: Queue):
     """Data handler."""
     print(f'Received message type: {data[:4].decode()}')
     if data[:4] == b'TXN ':
-        txn_pair = serialize.unpack_txn_pair(data[4:])
-        handle_txn(txn_pair, txn_queue)
-    elif data[:4] == b'BLOC':
-        blocks = serialize.unpack_blockchain(data[4:])
-        handle_blocks(blocks)
+        txn_pair = await in_pool('decode_seconds',
+                                 serialize.unpack_txn_pair, data[4:])
+        await sig_queue.put(txn_pair)
+        METRICS.gauge('sig_queue_depth').set(sig_queue.qsize())
+    elif data[:4] in CHAIN_MSGS:
+        await chain_queue.put(data)
     else:
         print(f'Could not handle message type {data[:4].decode()}')
 
 
-def handle_txn(txn_pair: transaction.TxnPair, txn_queue: Queue):
+async def signature_worker(sig_queue: Queue, txn_queue: Queue):
+    """Signature stage: check txn signatures, pass valid txns on."""
+    while True:
+        txn_pair = await sig_queue.get()
+        METRICS.gauge('sig_queue_depth').set(sig_queue.qsize())
+        await handle_txn(txn_pair, txn_queue)
+
+
+async def handle_txn(txn_pair: transaction.TxnPair, txn_queue: Queue):
     """"Handle transaction pair.
     Append to txn queue if the tokens are valid payments for the txn.
     """
     tokens, txn = txn_pair
-    if not transaction.valid_txn(tokens, txn):
+    valid = await in_pool('txn_validation_seconds',
+                          transaction.valid_txn, tokens, txn)
+    if not valid:
         print(f'Txn pair is invalid: {show.show_txn_pair(txn_pair)}\n')
+        METRICS.counter('txns_invalid').inc()
+        return
+    await txn_queue.put(txn_pair)
+    METRICS.gauge('txn_queue_depth').set(txn_queue.qsize())
+
+
+async def chain_worker(chain_queue: Queue,
+                       writer: FrameWriter,
+                       channel: str,
+                       args):
+    """Chain stage: compact blocks, headers-first sync, and received
+    chains.
+    """
+    while True:
+        data = await chain_queue.get()
+        if data[:4] == b'CMPT':
+            await handle_compact(data[4:], writer, channel, args)
+        elif data[:4] == b'GETT':
+            await serve_txns(data[4:], writer, channel)
+        elif data[:4] == b'BTXN':
+            await handle_block_txns(data[4:], writer, channel, args)
+        elif data[:4] == b'HDRS':
+            await handle_headers(data[4:], writer, channel, args)
+        elif data[:4] == b'GETH':
+            await serve_headers(data[4:], writer, channel)
+        elif data[:4] == b'GETB':
+            await serve_bodies(data[4:], writer, channel)
+        elif data[:4] == b'BODY':
+            await handle_body(data[4:], writer, channel, args)
+        elif data[:4] == b'BLOC':
+            await handle_chain(data[4:], args)
+
+
+async def sync_worker(writer: FrameWriter,
+                      channel: str,
+                      interval: float = 1):
+    """Repeat body requests that have timed out, every interval seconds,
+    however busy the chain stage is.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await request_bodies(writer, channel)
+
+
+async def handle_headers(payload: bytes,
+                         writer: FrameWriter,
+                         channel: str,
+                         args):
+    """Handle header chain announcement.
+    A heavier chain that is valid from its headers becomes the sync
+    candidate and its missing bodies are requested; anything else is dropped
+    before any body is fetched.
+    """
+    announcement = json.loads(payload)
+    if announcement['node'] == ME:
+        return
+    headers = await in_pool('decode_seconds', serialize.unpack_headers,
+                            announcement['headers'])
+    work = await better_chain(headers)
+    if work is not None:
+        print(f'Syncing {len(headers)} headers from {announcement["node"]}')
+        SYNC.start(headers, work, TREE.work(), announcement['node'])
+        METRICS.counter('headers_accepted').inc()
+        await request_bodies(writer, channel)
+    else:
+        print(f'Received {len(headers)} headers but they are not heavier '
+              f'(have {len(BLOCKCHAIN)}, syncing {len(SYNC.headers)}), '
+              'or invalid.')
+        METRICS.counter('headers_rejected').inc()
+
+
+async def request_headers(peer: str,
+                          writer: FrameWriter,
+                          channel: str):
+    """Ask peer to announce its chain's headers."""
+    msg = b'GETH' + json.dumps({'node': peer}).encode()
+    await send_channel_msg(writer, channel.encode(), msg)
+    METRICS.counter('headers_requested').inc()
+
+
+async def serve_headers(payload: bytes,
+                        writer: FrameWriter,
+                        channel: str):
+    """Announce our chain's headers, if the request is addressed to us."""
+    if json.loads(payload)['node'] == ME:
+        await broadcast(announce_headers(), writer, channel)
+
+
+async def better_chain(headers: List[block.BlockHeader]) -> Optional[int]:
+    """Cumulative work of headers, if they form a valid chain with more work
+    than ours and the sync candidate. Only headers not in the block tree are
+    validated.
+    """
+    work = await in_pool('header_validation_seconds', TREE.header_work,
+                         headers, dict(CHECKPOINTS))
+    # the chain or candidate may have changed while validating
+    return work if work is not None and SYNC.heavier(work, TREE.work()) \
+        else None
+
+
+async def request_bodies(writer: FrameWriter, channel: str):
+    """Request missing sync candidate bodies, up to the in flight limit."""
+    hs = SYNC.requests(BLOCKCHAIN, TREE.work(), time.monotonic())
+    if not hs:
+        return
+    request = {'node': SYNC.peer, 'hashes': serialize.pack_hashes(hs)}
+    msg = b'GETB' + json.dumps(request).encode()
+    await send_channel_msg(writer, channel.encode(), msg)
+    METRICS.counter('bodies_requested').inc(len(hs))
+
+
+async def serve_bodies(payload: bytes,
+                       writer: FrameWriter,
+                       channel: str):
+    """Send requested block bodies, if the request is addressed to us. The
+    bodies go out together, with a single drain.
+    """
+    request = json.loads(payload)
+    if request['node'] != ME:
+        return
+    wanted = set(serialize.unpack_hashes(request['hashes']))
+    for b in BLOCKCHAIN:
+        if b['header']['this_hash'] in wanted:
+            body = BLOCK_CACHE.pack_body(b, WIRE_VERSION)
+            writer.write(channel.encode(), b'BODY' + body.encode())
+            METRICS.counter('bodies_served').inc()
+    await writer.flush()
+
+
+async def handle_body(payload: bytes,
+                      writer: FrameWriter,
+                      channel: str,
+                      args):
+    """Handle block body of the sync candidate.
+    Once all bodies are in, the assembled chain is handled as usual.
+    """
+    if SYNC.header(serialize.unpack_body_hash(payload)) is None:
+        return # not a body we are waiting for, don't decode it
+    h, txns = await in_pool('decode_seconds', serialize.unpack_body, payload)
+    await add_body(h, txns, writer, channel, args)
+
+
+async def add_body(h: hash.Hash,
+                   txns: block.Transactions,
+                   writer: FrameWriter,
+                   channel: str,
+                   args):
+    """Add body of sync candidate block h, if it matches the header's
+    Merkle root. Once all bodies are in, the assembled chain is handled as
+    usual.
+    """
+    hdr = SYNC.header(h)
+    valid = (hdr is not None and
+             await in_pool('body_validation_seconds', block.valid_merkle_root,
+                           {'header': hdr, 'txns': txns}, PROCS, VALIDATED))
+    if not (valid and SYNC.add_body(h, txns)):
+        METRICS.counter('bodies_rejected').inc()
+        return
+
+    chain = SYNC.complete(BLOCKCHAIN)
+    if chain is None:
+        await request_bodies(writer, channel)
+    elif await handle_blocks(chain):
+        checkpoint(args)
+
+
+async def handle_compact(payload: bytes,
+                         writer: FrameWriter,
+                         channel: str,
+                         args):
+    """Handle compact block announcement.
+    A block on our tip is rebuilt from mempool txns, and only the txns we
+    lack are requested from the announcing node. A heavier chain whose tip
+    is not on ours is synced headers-first instead.
+    """
+    global PARTIAL
+    announcement = json.loads(payload)
+    peer = announcement['node']
+    if peer == ME or announcement['work'] <= TREE.work():
+        return
+    hdr, ids = await in_pool('decode_seconds', serialize.unpack_compact_block,
+                             announcement['block'])
+    chain = BLOCKCHAIN
+    tip = chain[-1]['header']['this_hash'] if chain else block.GENESIS
+    if hdr['previous_hash'] != tip:
+        await request_headers(peer, writer, channel)
         return
-    txn_queue.put_nowait(txn_pair)
 
+    headers = [b['header'] for b in chain] + [hdr]
+    work = await better_chain(headers)
+    if work is None:
+        print('Received compact block but it is not heavier, or invalid.')
+        METRICS.counter('compact_blocks_rejected').inc()
+        return
+    h = hdr['this_hash']
+    SYNC.start(headers, work, TREE.work(), peer)
+    SYNC.expect(h, time.monotonic())
+
+    txns = await in_pool('compact_seconds', compact.reconstruct,
+                         h, ids, MEMPOOL.txns())
+    missing = compact.missing(txns)
+    METRICS.counter('compact_blocks').inc()
+    METRICS.counter('compact_txns_missing').inc(len(missing))
+    if missing:
+        PARTIAL = {h: txns}
+        request = {'node': peer, 'hash': serialize.b2s(h), 'indexes': missing}
+        msg = b'GETT' + json.dumps(request).encode()
+        await send_channel_msg(writer, channel.encode(), msg)
+    else:
+        await add_body(h, [txn for txn in txns if txn is not None],
+                       writer, channel, args)
 
-def handle_blocks(blocks: block.Blockchain):
+
+async def serve_txns(payload: bytes,
+                     writer: FrameWriter,
+                     channel: str):
+    """Send requested txns of a block, if the request is addressed to us."""
+    request = json.loads(payload)
+    if request['node'] != ME:
+        return
+    h = serialize.s2b(request['hash'])
+    for b in reversed(BLOCKCHAIN): # usually the tip
+        if b['header']['this_hash'] == h:
+            break
+    else:
+        return
+    indexes = [i for i in request['indexes'] if 0 <= i < len(b['txns'])]
+    response = {'hash': request['hash'],
+                'indexes': indexes,
+                'txns': serialize.pack_txns([b['txns'][i] for i in indexes])}
+    msg = b'BTXN' + json.dumps(response).encode()
+    await send_channel_msg(writer, channel.encode(), msg)
+    METRICS.counter('txns_served').inc(len(indexes))
+
+
+async def handle_block_txns(payload: bytes,
+                            writer: FrameWriter,
+                            channel: str,
+                            args):
+    """Handle txns missing from the compact block in progress."""
+    global PARTIAL
+    response = json.loads(payload)
+    h = serialize.s2b(response['hash'])
+    txns = PARTIAL.get(h)
+    if txns is None:
+        return # requested by another node
+    found = await in_pool('decode_seconds', serialize.unpack_txns,
+                          response['txns'])
+    if compact.fill(txns, response['indexes'], found):
+        PARTIAL = {}
+        await add_body(h, [txn for txn in txns if txn is not None],
+                       writer, channel, args)
+
+
+async def handle_chain(payload: bytes, args):
+    """Handle full blockchain (BLOC) message.
+    The chain's headers are checked first, so a lighter or invalid chain is
+    dropped before its txns are decoded. Blocks decoded before are reused.
+    """
+    headers = await in_pool('decode_seconds',
+                            serialize.unpack_blockchain_headers, payload)
+    if await better_chain(headers) is None:
+        print('Received blockchain but it is not heavier, or invalid.')
+        METRICS.counter('chains_rejected').inc()
+        return
+    blocks = await in_pool('decode_seconds',
+                           BLOCK_CACHE.unpack_blockchain, payload)
+    if await handle_blocks(blocks):
+        checkpoint(args)
+
+
+async def handle_blocks(blocks: block.Blockchain) -> bool:
     """Handle blocks.
-    Update node blockchain if blocks are valid and form a longer chain.
+    Add blocks that are new and valid to the block tree, and switch to the
+    chain with the most work if that changed. Returns True if the chain was
+    adopted.
+    """
+    valid = await in_pool('chain_validation_seconds', TREE.add_chain,
+                          blocks, dict(CHECKPOINTS), PROCS)
+    if valid and await adopt():
+        print('Received heavier, valid blockchain.')
+        METRICS.counter('chains_adopted').inc()
+        return True
+
+    print('Received blockchain but it is not heavier, or invalid.')
+    METRICS.counter('chains_rejected').inc()
+    return False
+
+
+async def adopt() -> bool:
+    """Switch to the block tree's best chain, if it changed.
+    Txns of the blocks applied leave the mempool. Txns of the blocks unwound
+    return to it, unless they are in the new chain or their sources no
+    longer are. Returns True if the chain changed.
     """
     global BLOCKCHAIN
-    if len(blocks) > len(BLOCKCHAIN) and block.valid_blockchain(blocks):
-        print('Received longer, valid blockchain.')
-        BLOCKCHAIN = blocks
-    else:
-        print('Received blockchain but it is not longer, or invalid.')
+    unwound, applied = TREE.reorg()
+    if not applied:
+        return False
+    BLOCKCHAIN = TREE.chain
+    INDEX.update(BLOCKCHAIN)
+    MEMPOOL.remove([txn for b in applied for txn in b['txns']])
+    if unwound:
+        print(f'Reorg: unwound {len(unwound)} blocks, '
+              f'applied {len(applied)}')
+        METRICS.counter('reorgs').inc()
+        METRICS.histogram('reorg_depth', bounds=[1, 2, 5, 10, 20, 50, 100]
+                          ).observe(len(unwound))
+        await restore_txns(unwound)
+    METRICS.gauge('txns_pending').set(len(MEMPOOL))
+    METRICS.gauge('chain_height').set(len(BLOCKCHAIN))
+    return True
+
+
+async def restore_txns(unwound: block.Blockchain):
+    """Return txns of unwound blocks to the mempool, if they are not in the
+    chain and their tokens can be rebuilt from it.
+    """
+    for b in unwound:
+        for h, txn in zip(INDEX.txn_hashes(b), b['txns']):
+            if INDEX.lookup(h) is not None:
+                continue
+            tokens = block.spent_tokens(txn, INDEX)
+            if tokens is None or not await in_pool(
+                    'txn_validation_seconds', transaction.valid_txn,
+                    tokens, txn):
+                METRICS.counter('txns_dropped').inc()
+                continue
+            await admit_txn((tokens, txn), MEMPOOL)
+
+
+def checkpoint(args):
+    """Checkpoint the block args.checkpoint_depth below the tip, and save
+    checkpoints (if a file is given) when they change.
+    """
+    if args.checkpoint_depth < 0:
+        return
+    if not block.update_checkpoints(BLOCKCHAIN, CHECKPOINTS,
+                                    args.checkpoint_depth):
+        return
+    METRICS.gauge('checkpoint_height').set(max(CHECKPOINTS))
+    if args.checkpoints:
+        with open(args.checkpoints, 'w') as f:
+            f.write(serialize.pack_checkpoints(CHECKPOINTS, True))
 
 
 ################################################################################
@@ -94,39 +569,107 @@ def handle_blocks(blocks: block.Blockchain):
 
 
 async def block_worker(txn_queue: Queue,
-                       writer: asyncio.StreamWriter,
+                       writer: FrameWriter,
                        channel: str,
-                       delay: int):
-    """Queue manager for generating blocks."""
-    txn_pairs : List[transaction.TxnPair] = []
+                       args):
+    """Queue manager for generating blocks.
+    Txns with valid tokens are added to the mempool, and expired txns leave
+    it. Once it holds at least args.min_txns txns, blocks are mined back to
+    back until it runs low. After a failed attempt, mining waits for the
+    next txn (or one block interval) before retrying.
+    """
+    pool = MEMPOOL
 
     while True:
-        txn_pair = await txn_queue.get()
-        if valid_tokens(txn_pair, txn_pairs):
-            txn_pairs.append(txn_pair)
+        # admit everything already queued, so it can go in the next block
+        for _ in range(txn_queue.qsize()):
+            await admit_txn(txn_queue.get_nowait(), pool)
+        METRICS.gauge('txn_queue_depth').set(txn_queue.qsize())
+        METRICS.counter('txns_expired').inc(pool.expire())
+
+        if len(pool) < args.min_txns:
+            await admit_txn(await txn_queue.get(), pool)
+            continue
+
+        if await mine_block(pool, writer, channel, args):
+            checkpoint(args)
+        else:
+            try:
+                txn_pair = await asyncio.wait_for(txn_queue.get(),
+                                                  args.block_interval)
+                await admit_txn(txn_pair, pool)
+            except asyncio.TimeoutError:
+                pass
+        METRICS.gauge('txns_pending').set(len(pool))
+        METRICS.gauge('mempool_bytes').set(pool.total_bytes())
+
+
+async def mine_block(pool: mempool.Mempool,
+                     writer: FrameWriter,
+                     channel: str,
+                     args) -> bool:
+    """Mine and broadcast a block of mempool txns on the current chain.
+    If a heavier chain replaced ours while mining, the block stays in the
+    block tree as a side branch. Unless added, the block's txns stay in the
+    mempool for the next attempt (or until they expire). Returns True if the
+    block was added to our chain.
+    """
+    chain = BLOCKCHAIN # snapshot, BLOCKCHAIN may be replaced while awaiting
+    txns = [txn for _, txn in pool.select(args.select)]
+    b, _ = await asyncio.to_thread(gen_block, chain, txns, args.block_interval,
+                                   args.block_txns, args.block_bytes,
+                                   pool.size, pool.merkle_root)
+    await asyncio.sleep(args.delay) # slow some nodes down artificially
+
+    valid = (b is not None and
+             await in_pool('chain_validation_seconds', TREE.add_chain, [b],
+                           dict(CHECKPOINTS)))
+
+    if b is not None and valid:
+        if await update_blockchain(b, writer, channel, args.announce):
+            return True
+        print('Blockchain changed while mining, retrying txns')
+        METRICS.counter('blocks_stale').inc()
+        return False
+
+    print('Invalid block or blockchain, keeping txns')
+    METRICS.counter('blocks_discarded').inc()
+    return False
+
+
+async def admit_txn(txn_pair: transaction.TxnPair, pool: mempool.Mempool):
+    """Add txn pair to mempool if its tokens are valid and unspent."""
+    tokens, txn = txn_pair
+    valid = await in_pool('token_validation_seconds', valid_tokens,
+                          txn_pair, pool.txn_pairs(), BLOCKCHAIN, INDEX)
+    if not valid:
+        METRICS.counter('txns_invalid_tokens').inc()
+        return
 
-        if len(txn_pairs) >= 2:
-            txns = [txn for _, txn in txn_pairs]
-            b, txns_ = await asyncio.to_thread(gen_block, txns)
-            await asyncio.sleep(delay) # slow some nodes down artificially
+    size = await in_pool('encode_seconds', txn_bytes, txn)
+    evicted = pool.evicted
+    pool.add(txn_pair, size, transaction.sum_tokens(tokens))
+    METRICS.counter('txns_evicted').inc(pool.evicted - evicted)
+    METRICS.gauge('txns_pending').set(len(pool))
 
-            if b and block.valid_blockchain(BLOCKCHAIN + [b]):
-                await update_blockchain(b, writer, channel)
-                txn_pairs = update_txn_pairs(txn_pairs, txns_)
-            else:
-                print('Invalid block or blockchain')
-                print(f'Dropping txns:\n{show.show_txn_hashes(txns)}\n')
-                txn_pairs = []
+
+def txn_bytes(txn: transaction.Transaction) -> int:
+    """Serialized size of txn, as sent in blocks."""
+    return len(serialize.pack_txn(txn))
 
 
 def valid_tokens(txn_pair: transaction.TxnPair,
-                 txn_pairs: List[transaction.TxnPair]):
-    """Verify that tokens are valid and not double spent."""
+                 txn_pairs: List[transaction.TxnPair],
+                 chain: block.Blockchain,
+                 index: Optional[block.ChainIndex] = None):
+    """Verify that tokens are valid and not double spent. Token sources are
+    looked up in the index, if it indexes chain.
+    """
     tokens, txn = txn_pair
-    seen_tokens = [ts for ts, _ in txn_pairs]
+    seen_tokens = [token for ts, _ in txn_pairs for token in ts]
     valid = True
 
-    if not block.valid_tokens(tokens, BLOCKCHAIN):
+    if not block.valid_tokens(tokens, chain, index):
         print(f'Some tokens missing source txns: {show.show_tokens(tokens)}')
         valid = False
     elif any([token in seen_tokens for token in tokens]):
@@ -136,18 +679,29 @@ def valid_tokens(txn_pair: transaction.TxnPair,
     return valid
 
 
-def gen_block(txns: List[transaction.Transaction]
+def gen_block(chain: block.Blockchain,
+              txns: List[transaction.Transaction],
+              interval: int = block.BLOCK_INTERVAL,
+              max_txns: int = block.BLOCK_MAX_TXNS,
+              max_bytes: int = block.BLOCK_MAX_BYTES,
+              size: block.SizeFn = transaction.txn_size,
+              root: Optional[block.RootFn] = None
               ) -> Tuple[Optional[block.Block], List[transaction.Transaction]]:
-    """Try to generate a block."""
+    """Try to generate a block on top of chain."""
     print('Starting block gen...')
-    h = (block.GENESIS if len(BLOCKCHAIN) == 0 else
-         BLOCKCHAIN[-1]['header']['this_hash'])
+    h = block.GENESIS if len(chain) == 0 else chain[-1]['header']['this_hash']
 
-    b, txns_ = block.gen_block(h, txns, block.next_difficulty(len(BLOCKCHAIN)))
-    block
+    with METRICS.histogram('pow_seconds').time():
+        b, txns_ = block.gen_block(h, txns,
+                                   block.next_target(chain, interval),
+                                   max_txns, max_bytes, size,
+                                   block.next_timestamp(chain), root)
     if b:
         print(f'Finished block gen, hash {b["header"]["this_hash"]}')
         print(f'Block has {len(b["txns"])} txns')
+        METRICS.counter('blocks_mined').inc()
+        METRICS.histogram('block_txns', bounds=[1, 2, 5, 10, 20, 50, 100]
+                          ).observe(len(b['txns']))
     else:
         print('Finished block gen but no block was generated.')
         print('Started with {len(txns)}, {len(txns_)} are leftover.')
@@ -156,23 +710,78 @@ def gen_block(txns: List[transaction.Transaction]
 
 
 async def update_blockchain(b: block.Block,
-                            writer: asyncio.StreamWriter,
-                            channel: str):
-    """Update blockchain and send to network."""
-    global BLOCKCHAIN
-    BLOCKCHAIN.append(b)
-    msg = b'BLOC' + serialize.pack_blockchain(BLOCKCHAIN).encode()
-    await send_msg(writer, channel.encode())
-    await send_msg(writer, msg)
+                            writer: FrameWriter,
+                            channel: str,
+                            announce: str = 'compact') -> bool:
+    """Switch to the block tree's best chain and, if it now ends in block b
+    (already in the tree), announce it to the network: as a compact block,
+    as headers (for headers-first sync), as full blocks, or as both headers
+    and blocks. Returns True if announced.
+    """
+    await adopt()
+    if not (BLOCKCHAIN and BLOCKCHAIN[-1]['header']['this_hash'] ==
+            b['header']['this_hash']):
+        return False
+
+    if announce == 'compact':
+        block_ = serialize.pack_compact_block(b['header'], compact.short_ids(b))
+        announcement = {'node': ME, 'height': len(BLOCKCHAIN),
+                        'work': TREE.work(), 'block': block_}
+        await broadcast(b'CMPT' + json.dumps(announcement).encode(),
+                        writer, channel)
+    if announce in ('headers', 'both'):
+        await broadcast(announce_headers(), writer, channel)
+    if announce in ('blocks', 'both'):
+        packed = BLOCK_CACHE.pack_blockchain(BLOCKCHAIN, WIRE_VERSION)
+        await broadcast(b'BLOC' + packed.encode(), writer, channel)
     print('Sent updated blockchain')
+    return True
+
+
+def announce_headers() -> bytes:
+    """HDRS message announcing our chain's headers."""
+    headers = [b['header'] for b in BLOCKCHAIN]
+    announcement = {'node': ME, 'headers': serialize.pack_headers(headers)}
+    return b'HDRS' + json.dumps(announcement).encode()
 
 
-def update_txn_pairs(txn_pairs: List[transaction.TxnPair],
-                     txns: List[transaction.Transaction]
-                     ) -> List[transaction.TxnPair]:
-    """Filter for txn_pairs matching given txns."""
-    return [(tokens, txn) for tokens, txn in txn_pairs
-            if txn in txns]
+async def broadcast(msg: bytes, writer: FrameWriter, channel: str):
+    """Send chain announcement, recording its size."""
+    await send_channel_msg(writer, channel.encode(), msg)
+    METRICS.counter('broadcasts').inc()
+    METRICS.histogram('broadcast_bytes', bounds=metrics.BYTE_BUCKETS
+                      ).observe(len(msg))
+
+
+################################################################################
+# Metrics
+
+
+async def snapshot_worker(path: str, interval: float):
+    """Save a mempool snapshot every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        await in_pool('snapshot_seconds', save_mempool, path)
+
+
+def save_mempool(path: str):
+    """Write a mempool snapshot to path, replacing the old one whole."""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(serialize.pack_mempool(MEMPOOL.snapshot()))
+    os.replace(tmp, path)
+
+
+async def stats_worker(writer: FrameWriter,
+                       channel: str,
+                       interval: float,
+                       me: str):
+    """Periodically publish a STAT message with a metrics snapshot."""
+    while True:
+        await asyncio.sleep(interval)
+        stats = {'node': me, 'metrics': METRICS.snapshot()}
+        msg = b'STAT' + json.dumps(stats).encode()
+        await send_channel_msg(writer, channel.encode(), msg)
 
 
 
@@ -185,6 +794,40 @@ if __name__ == '__main__':
     parser.add_argument('--port', default=25000)
     parser.add_argument('--channel', default='/topic/main')
     parser.add_argument('--delay', default=0, type=int)
+    parser.add_argument('--block_interval', default=block.BLOCK_INTERVAL,
+                        type=int) # consensus rule, same for all nodes
+    parser.add_argument('--min_txns', default=2, type=int)
+    parser.add_argument('--block_txns', default=block.BLOCK_MAX_TXNS, type=int)
+    parser.add_argument('--block_bytes', default=block.BLOCK_MAX_BYTES, type=int)
+    parser.add_argument('--select', default='arrival',
+                        choices=mempool.SELECT_POLICIES)
+    parser.add_argument('--mempool_bytes', default=mempool.MAX_BYTES, type=int)
+    parser.add_argument('--mempool_expiry', default=mempool.EXPIRY,
+                        type=float) # seconds
+    parser.add_argument('--evict', default='oldest',
+                        choices=mempool.EVICT_POLICIES)
+    parser.add_argument('--mempool_snapshot', default=None) # JSON lines file
+    parser.add_argument('--snapshot_interval', default=10, type=float)
+    parser.add_argument('--workers', default=2, type=int)
+    parser.add_argument('--validation_procs', default=0, type=int)
+    parser.add_argument('--checkpoints', default=None) # JSON file
+    parser.add_argument('--checkpoint_depth', default=20, type=int)
+    parser.add_argument('--queue_size', default=1000, type=int)
+    parser.add_argument('--seen_size', default=100_000, type=int)
+    parser.add_argument('--block_cache', default=10_000, type=int)
+    parser.add_argument('--compress_min', default=msg_protocol.COMPRESS_MIN,
+                        type=int) # bytes, negative to disable
+    parser.add_argument('--wire_version', default=serialize.WIRE_VERSION,
+                        type=int, choices=serialize.WIRE_VERSIONS)
+    parser.add_argument('--announce', default='compact',
+                        choices=ANNOUNCE_POLICIES)
+    parser.add_argument('--max_in_flight', default=8, type=int)
+    parser.add_argument('--sync_timeout', default=10, type=float)
+    parser.add_argument('--sync_requests', default=3, type=int)
+    parser.add_argument('--stats_channel', default='/topic/stats')
+    parser.add_argument('--stats_interval', default=10, type=float)
+    parser.add_argument('--profile_dir', default='profiles')
+    parser.add_argument('--slow_callback', default=0.1, type=float)
 
     try:
         asyncio.run(main(parser.parse_args()))
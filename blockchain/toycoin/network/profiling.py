@@ -0,0 +1,255 @@
+"""On-demand profiling hooks for long-running toycoin processes.
+
+Once installed, profiling is toggled on a running process with signals:
+
+- SIGUSR1: start profiling; on the next SIGUSR1, write reports and stop
+- SIGUSR2: write reports now, without stopping
+
+While on, profiling collects sampled call stacks (all threads), tracemalloc
+allocations, and asyncio callbacks that blocked the event loop for longer
+than the slow callback threshold. Reports are written to the output
+directory as <name>-<pid>-<timestamp>.{stacks,memory,slow}.txt; the stacks
+file uses the collapsed format read by flamegraph tools.
+"""
+
+
+import asyncio # type: ignore
+import logging # type: ignore
+import os # type: ignore
+import signal # type: ignore
+import sys # type: ignore
+import threading # type: ignore
+import time # type: ignore
+import tracemalloc # type: ignore
+from collections import Counter, defaultdict # type: ignore
+from typing import DefaultDict, List, Optional, Tuple # type: ignore
+
+
+################################################################################
+# Sampling Profiler
+
+
+class Sampler:
+    """Sample call stacks of all threads from a background thread."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+
+    def start(self):
+        """Start sampling in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='profiling-sampler',
+                                        daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        """Stop sampling (collected stacks are kept)."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(exclude=me)
+
+
+    def sample(self, exclude: Optional[int] = None):
+        """Record the current stack of every thread (except exclude)."""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == exclude:
+                continue
+            stack = [names.get(ident, str(ident))]
+            stack.extend(reversed(list(frame_names(frame))))
+            self.stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+
+    def report(self) -> str:
+        """Collapsed stacks, one 'frame;frame;... count' line per stack."""
+        return '\n'.join(f'{stack} {n}'
+                         for stack, n in self.stacks.most_common())
+
+
+def frame_names(frame):
+    """Yield 'file:function:line' from frame out to the root."""
+    while frame is not None:
+        code = frame.f_code
+        yield (f'{os.path.basename(code.co_filename)}:'
+               f'{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+
+
+################################################################################
+# Slow Callbacks
+
+
+class SlowCallbackLog(logging.Handler):
+    """Collect asyncio debug-mode warnings about slow callbacks."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records: List[Tuple[float, str, float]] = []
+
+
+    def emit(self, record: logging.LogRecord):
+        # asyncio logs 'Executing %s took %.3f seconds' in debug mode
+        args = record.args
+        if not (str(record.msg).startswith('Executing') and
+                isinstance(args, tuple) and len(args) == 2):
+            return
+        handle, duration = args
+        if isinstance(duration, (int, float)):
+            self.records.append((record.created, str(handle), float(duration)))
+
+
+    def report(self) -> str:
+        """Slow callbacks, grouped by callback and sorted by total time."""
+        totals: DefaultDict[str, float] = defaultdict(float)
+        counts: DefaultDict[str, int] = defaultdict(int)
+        worst: DefaultDict[str, float] = defaultdict(float)
+        for _, handle, duration in self.records:
+            totals[handle] += duration
+            counts[handle] += 1
+            worst[handle] = max(worst[handle], duration)
+
+        lines = [f'{len(self.records)} slow callbacks']
+        for handle, total in sorted(totals.items(), key=lambda kv: -kv[1]):
+            lines.append(f'total {total:.3f}s | count {counts[handle]} | '
+                         f'max {worst[handle]:.3f}s | {handle}')
+        return '\n'.join(lines)
+
+
+################################################################################
+# Profiler
+
+
+class Profiler:
+    """Toggle sampling, tracemalloc and slow-callback reporting together."""
+
+    def __init__(self,
+                 name: str,
+                 out_dir: str,
+                 loop: asyncio.AbstractEventLoop,
+                 slow_callback: float = 0.1,
+                 interval: float = 0.005):
+        self.name = name
+        self.out_dir = out_dir
+        self.loop = loop
+        self.slow_callback = slow_callback
+        self.interval = interval
+        self.active = False
+        self.sampler = Sampler(interval)
+        self.slow_log = SlowCallbackLog()
+        self._debug = loop.get_debug()
+        self._tracemalloc = False # True if this profiler started tracing
+
+
+    def toggle(self):
+        """Start profiling, or write reports and stop."""
+        if self.active:
+            self.dump()
+            self.stop()
+        else:
+            self.start()
+
+
+    def start(self):
+        """Start collecting."""
+        if self.active:
+            return
+        print(f'Profiling {self.name} started')
+        self.active = True
+        self.sampler = Sampler(self.interval)
+        self.sampler.start()
+        self._tracemalloc = not tracemalloc.is_tracing()
+        if self._tracemalloc:
+            tracemalloc.start()
+        self.slow_log = SlowCallbackLog()
+        logging.getLogger('asyncio').addHandler(self.slow_log)
+        self._debug = self.loop.get_debug()
+        self.loop.slow_callback_duration = self.slow_callback
+        self.loop.set_debug(True)
+
+
+    def stop(self):
+        """Stop collecting."""
+        if not self.active:
+            return
+        self.active = False
+        self.sampler.stop()
+        if self._tracemalloc:
+            tracemalloc.stop()
+            self._tracemalloc = False
+        logging.getLogger('asyncio').removeHandler(self.slow_log)
+        self.loop.set_debug(self._debug)
+        print(f'Profiling {self.name} stopped')
+
+
+    def dump(self) -> List[str]:
+        """Write reports for what has been collected so far."""
+        if not self.active:
+            print(f'Profiling {self.name} is not active, nothing to dump')
+            return []
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        prefix = os.path.join(self.out_dir, f'{self.name}-{os.getpid()}-'
+                              f'{int(time.time())}')
+        reports = [('stacks', self.sampler.report()),
+                   ('memory', memory_report()),
+                   ('slow', self.slow_log.report())]
+
+        paths = []
+        for kind, text in reports:
+            path = f'{prefix}.{kind}.txt'
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+            paths.append(path)
+        print(f'Profiling {self.name} wrote {", ".join(paths)}')
+        return paths
+
+
+def memory_report(limit: int = 30) -> str:
+    """Top allocation sites from a tracemalloc snapshot."""
+    if not tracemalloc.is_tracing():
+        return 'tracemalloc not running'
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    stats = snapshot.statistics('lineno')
+    lines = [f'current {current} bytes | peak {peak} bytes']
+    lines.extend(str(stat) for stat in stats[:limit])
+    return '\n'.join(lines)
+
+
+################################################################################
+# Install
+
+
+def install(name: str,
+            out_dir: str,
+            slow_callback: float = 0.1
+            ) -> Profiler:
+    """Create profiler for the running loop and register signal handlers.
+    Call from within a coroutine (e.g. at the start of main()).
+    """
+    loop = asyncio.get_running_loop()
+    profiler = Profiler(name, out_dir, loop, slow_callback)
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, profiler.toggle)
+        loop.add_signal_handler(signal.SIGUSR2, profiler.dump)
+    except (AttributeError, NotImplementedError):
+        print('Profiling signals are not supported on this platform')
+    return profiler
@@ -1,13 +1,18 @@
 """A TCP message relay.
-Messages are relayed to all connected clients based on channel names.
+Messages are relayed to all connected clients based on channel names. Frames
+are forwarded as received, routed on the channel in their header, so
+compressed frames are never recompressed. They are decompressed (once) only
+for subscribers that did not negotiate compression.
 """
 
 import asyncio # type: ignore
+import argparse # type: ignore
 from asyncio import StreamReader, StreamWriter, Queue # type: ignore
 from collections import deque, defaultdict # type: ignore
 from contextlib import suppress # type: ignore
 from typing import Deque, DefaultDict, Dict # type: ignore
-from msg_protocol import read_msg, send_msg # type: ignore
+from msg_protocol import COMPRESSED, HELLO, SUBSCRIBE, ZLIB, FrameReader, decode_frame, decompress_frame, encode_frame, hello_msg, negotiate, peek_frame # type: ignore
+import profiling # type: ignore
 
 
 ################################################################################
@@ -16,23 +21,44 @@ from msg_protocol import read_msg, send_msg # type: ignore
 SUBSCRIBERS: DefaultDict[bytes, Deque] = defaultdict(deque)
 SEND_QUEUES: DefaultDict[StreamWriter, Queue] = defaultdict(Queue)
 CHAN_QUEUES: Dict[bytes, Queue] = {}
+COMPRESSION: Dict[StreamWriter, bool] = {} # subscriber accepts compression
 
 
 async def client(reader: StreamReader, writer: StreamWriter):
     peername = writer.get_extra_info('peername')
-    subscribe_chan = await read_msg(reader)
+    frames = FrameReader(reader)
+    try:
+        subscribe_chan, data = decode_frame(await frames.read_frame())
+        if data[:4] == HELLO:
+            algorithm = negotiate(data, [ZLIB])
+            writer.writelines(encode_frame(b'', hello_msg(
+                [algorithm] if algorithm else [])))
+            await writer.drain()
+            COMPRESSION[writer] = algorithm is not None
+            subscribe_chan, data = decode_frame(await frames.read_frame())
+    except asyncio.IncompleteReadError:
+        print(f'Remote {peername} disconnected before subscribing')
+        COMPRESSION.pop(writer, None)
+        return
+    if data != SUBSCRIBE:
+        print(f'Remote {peername} did not subscribe first, closing')
+        COMPRESSION.pop(writer, None)
+        writer.close()
+        return
     SUBSCRIBERS[subscribe_chan].append(writer)
     send_task = asyncio.create_task(
     send_client(writer, SEND_QUEUES[writer]))
-    print(f'Remote {peername.decode()} subscribed to {subscribe_chan.decode()}')
+    print(f'Remote {peername} subscribed to {subscribe_chan.decode()}'
+          f'{" (compressed)" if COMPRESSION.get(writer) else ""}')
 
     try:
-        while channel_name := await read_msg(reader):
-            data = await read_msg(reader)
-            if channel_name not in CHAN_QUEUES:
-                CHAN_QUEUES[channel_name] = Queue(maxsize=10)
-                asyncio.create_task(chan_sender(channel_name))
-            await CHAN_QUEUES[channel_name].put(data)
+        while batch := await frames.read():
+            for frame in batch:
+                _, _, channel_name = peek_frame(frame)
+                if channel_name not in CHAN_QUEUES:
+                    CHAN_QUEUES[channel_name] = Queue(maxsize=10)
+                    asyncio.create_task(chan_sender(channel_name))
+                await CHAN_QUEUES[channel_name].put(frame)
     except asyncio.CancelledError:
         print(f'Remote {peername} connection cancelled.')
     except asyncio.IncompleteReadError:
@@ -42,23 +68,30 @@ async def client(reader: StreamReader, writer: StreamWriter):
         await SEND_QUEUES[writer].put(None)
         await send_task
         del SEND_QUEUES[writer]
+        COMPRESSION.pop(writer, None)
         SUBSCRIBERS[subscribe_chan].remove(writer)
 
 
 async def send_client(writer: StreamWriter, queue: Queue):
+    """Write queued frames to the client, everything queued so far with a
+    single drain.
+    """
     while True:
         try:
-            data = await queue.get()
+            frames = [await queue.get()]
         except asyncio.CancelledError:
             continue
+        while frames[-1] and not queue.empty():
+            frames.append(queue.get_nowait())
 
-        if not data:
-            break
-
+        writer.writelines([frame for frame in frames if frame])
         try:
-            await send_msg(writer, data)
+            await writer.drain()
         except asyncio.CancelledError:
-            await send_msg(writer, data)
+            await writer.drain()
+
+        if not frames[-1]:
+            break
 
     writer.close()
     await writer.wait_closed()
@@ -67,28 +100,41 @@ async def send_client(writer: StreamWriter, queue: Queue):
 async def chan_sender(name: bytes):
     with suppress(asyncio.CancelledError):
         while True:
-            writers = SUBSCRIBERS[name]
-            if not writers:
-                await asyncio.sleep(1)
-                continue 
+            # messages on channels without subscribers are dropped, so
+            # publishers never block on a full channel queue
             if not (msg := await CHAN_QUEUES[name].get()):
                 break
-            for writer in writers:
+            flags, kind, _ = peek_frame(msg)
+            plain = None if flags & COMPRESSED else msg
+            for writer in SUBSCRIBERS[name]:
                 if not SEND_QUEUES[writer].full():
-                    print(f'Sending to {name.decode()}: {msg[:19].decode()}...')
-                    await SEND_QUEUES[writer].put(msg)
+                    print(f'Sending to {name.decode()}: {kind.decode()} '
+                          f'({len(msg)} bytes)')
+                    if COMPRESSION.get(writer):
+                        await SEND_QUEUES[writer].put(msg)
+                    else:
+                        plain = plain or decompress_frame(msg)
+                        await SEND_QUEUES[writer].put(plain)
 
 
 ################################################################################
 
 
-async def main(*args, **kwargs):
-    server = await asyncio.start_server(*args, **kwargs)
+async def main(args):
+    profiling.install('relay', args.profile_dir, args.slow_callback)
+    server = await asyncio.start_server(client, host=args.host, port=args.port)
     async with server:
         await server.serve_forever()
 
 
-try:
-    asyncio.run(main(client, host='127.0.0.1', port=25000))
-except KeyboardInterrupt:
-    print('Bye!')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=25000, type=int)
+    parser.add_argument('--profile_dir', default='profiles')
+    parser.add_argument('--slow_callback', default=0.1, type=float)
+
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        print('Bye!')
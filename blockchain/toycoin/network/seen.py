@@ -0,0 +1,50 @@
+"""Recently seen messages.
+Nodes receive the same txn more than once (rebroadcasts, several oracles,
+reconnects). Raw payloads are keyed by a cheap digest and remembered in a
+bounded LRU set, so repeats are dropped before any decoding or signature
+checks.
+"""
+
+
+import hashlib # type: ignore
+from collections import OrderedDict # type: ignore
+
+
+################################################################################
+
+
+DIGEST_BYTES = 16
+
+
+def digest(data: bytes) -> bytes:
+    """Cheap digest of a raw message payload."""
+    return hashlib.blake2b(data, digest_size=DIGEST_BYTES).digest()
+
+
+class SeenFilter:
+    """Bounded set of recently seen keys, evicting the least recently seen."""
+
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self.keys: OrderedDict = OrderedDict()
+
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.keys
+
+
+    def add(self, key: bytes) -> bool:
+        """Add key. Returns False (and marks it recently seen) if already
+        present.
+        """
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return False
+        self.keys[key] = None
+        if len(self.keys) > self.capacity:
+            self.keys.popitem(last=False)
+        return True
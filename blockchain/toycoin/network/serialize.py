@@ -1,11 +1,25 @@
 """De/serialization of toycoin data structures.
 Mainly converting bytes to and from b64, and using JSON functions.
+
+Blockchains and block bodies have two wire versions. Version 1 nests JSON
+strings in JSON strings. Version 2 encodes each object once: a blockchain is
+JSON lines, a version line followed by a header line and a txns line per
+block, so headers can be read without parsing txns. Unpacking detects the
+version.
 """
 
 import base64 # type: ignore
 import json # type: ignore
-from toycoin import block, transaction # type: ignore
-from typing import List, Tuple # type: ignore
+from toycoin import block, hash, transaction # type: ignore
+from toycoin.network import mempool # type: ignore
+from typing import Iterator, List, Sequence, Tuple, Union # type: ignore
+
+
+################################################################################
+
+WIRE_VERSION = 2 # used for packing, unpacking accepts all versions
+
+WIRE_VERSIONS = [1, 2]
 
 
 ################################################################################
@@ -43,8 +57,22 @@ def pack_txn(txn: transaction.Transaction,
              pretty: bool  = False
              ) -> str:
     """Pack txn to JSON string with b64 for bytes."""
+    return json_dumps(_pack_txn(txn, abbrev), pretty)
+
+
+def _pack_txn(txn: transaction.Transaction, abbrev: bool = False) -> dict:
+    """Txn as JSON object with b64 for bytes."""
     f = get_b2s(abbrev)
-    txn_ = {'previous_hashes': [f(h) for h in
+    if transaction.txn_version(txn) >= 2:
+        return {'version': txn['version'],
+                'previous_hashes': [f(h) for h in txn['previous_hashes']],
+                'receiver': f(txn['receiver']),
+                'receiver_value': txn['receiver_value'],
+                'sender': f(txn['sender']),
+                'sender_change': txn['sender_change'],
+                'signature': f(txn['signature'])
+                }
+    return {'previous_hashes': [f(h) for h in
                                 txn['previous_hashes']],
             'receiver': f(txn['receiver']),
             'receiver_value': txn['receiver_value'],
@@ -53,12 +81,24 @@ def pack_txn(txn: transaction.Transaction,
             'sender_change': txn['sender_change'],
             'sender_signature': f(txn['sender_signature'])
             }
-    return json_dumps(txn_, pretty)
 
 
 def unpack_txn(s: str) -> transaction.Transaction:
     """Unpack txn from JSON string with b64 for bytes."""
-    txn = json.loads(s)
+    return _unpack_txn(json.loads(s))
+
+
+def _unpack_txn(txn: dict) -> transaction.Transaction:
+    """Txn from decoded JSON object with b64 for bytes."""
+    if 'version' in txn:
+        return {'version': txn['version'],
+                'previous_hashes': [s2b(h) for h in txn['previous_hashes']],
+                'receiver': s2b(txn['receiver']),
+                'receiver_value': txn['receiver_value'],
+                'sender': s2b(txn['sender']),
+                'sender_change': txn['sender_change'],
+                'signature': s2b(txn['signature'])
+                }
     return {'previous_hashes': [s2b(h) for h in
                                 txn['previous_hashes']],
             'receiver': s2b(txn['receiver']),
@@ -91,28 +131,51 @@ def unpack_txn_pair(s: str) -> TxnPair:
 # Blocks
 
 
+Packed = Union[str, bytes]
+
+
 def pack_blockchain(blocks: block.Blockchain,
                     abbrev: bool = False,
-                    pretty: bool = False) -> str:
-    """Pack blockchain to JSON string with b64 for bytes."""
-    blocks_ = [_pack_block(block, abbrev, pretty) for
-               block in blocks]
-    return json_dumps(blocks_, pretty)
+                    pretty: bool = False,
+                    version: int = WIRE_VERSION) -> str:
+    """Pack blockchain to JSON string with b64 for bytes.
+    Pretty output is for display, and always in the version 1 layout.
+    """
+    if pretty:
+        blocks_ = [_pack_block(block, abbrev, pretty) for
+                   block in blocks]
+        return json_dumps(blocks_, pretty)
+    return join_blockchain([block_fragment(b, version, abbrev)
+                            for b in blocks], version)
+
+
+def block_fragment(b: block.Block,
+                   version: int = WIRE_VERSION,
+                   abbrev: bool = False) -> str:
+    """Packed block, as it appears in a packed blockchain: a JSON string in
+    version 1, a header line and a txns line in version 2.
+    """
+    if version == 1:
+        return json.dumps(_pack_block(b, abbrev))
+    return (json.dumps(_pack_header(b['header'], abbrev)) + '\n' +
+            json.dumps([_pack_txn(txn, abbrev) for txn in b['txns']]))
+
+
+def join_blockchain(fragments: List[str], version: int = WIRE_VERSION) -> str:
+    """Packed blockchain from its packed blocks."""
+    if version == 1:
+        return '[' + ', '.join(fragments) + ']'
+    return '\n'.join([json.dumps({'version': version,
+                                  'blocks': len(fragments)})] + fragments)
 
 
 def _pack_block(block: block.Block,
                abbrev: bool = False,
                pretty: bool = False,
                ) -> str:
-    """Pack blockchain to JSON string with b64 for bytes."""
-    f = get_b2s(abbrev)
+    """Pack block to JSON string with b64 for bytes (version 1)."""
     hdr, txns = block['header'], block['txns']
-    hdr_ = {'timestamp': f(hdr['timestamp']),
-            'previous_hash': f(hdr['previous_hash']),
-            'nonce': f(hdr['nonce']),
-            'merkle_root': f(hdr['merkle_root']),
-            'this_hash': f(hdr['this_hash'])
-            }
+    hdr_ = _pack_header(hdr, abbrev)
     txns_ = [pack_txn(txn) for txn in txns]
     return json_dumps({'header': hdr_, 'txns': txns_}, pretty)
 
@@ -121,37 +184,195 @@ def pack_block_header(hdr: block.BlockHeader,
                       abbrev: bool = False,
                       pretty: bool = False,
                       ) -> str:
-    """Pack blockchain to JSON string with b64 for bytes."""
+    """Pack block header to JSON string with b64 for bytes."""
+    return json_dumps(_pack_header(hdr, abbrev), pretty)
+
+
+def _pack_header(hdr: block.BlockHeader, abbrev: bool = False) -> dict:
+    """Block header as JSON object with b64 for bytes."""
     f = get_b2s(abbrev)
-    hdr_ = {'timestamp': f(hdr['timestamp']),
+    return {'timestamp': f(hdr['timestamp']),
             'previous_hash': f(hdr['previous_hash']),
             'nonce': f(hdr['nonce']),
-        'merkle_root': f(hdr['merkle_root']),
+            'merkle_root': f(hdr['merkle_root']),
             'this_hash': f(hdr['this_hash'])
             }
-    return json_dumps(hdr_, pretty)
 
 
-def unpack_blockchain(s: str) -> block.Blockchain:
+def wire_version(s: Packed) -> int:
+    """Wire version of a packed blockchain. Version 1 is a JSON list."""
+    if s.lstrip()[:1] in ('[', b'['):
+        return 1
+    return json.loads(s.splitlines()[0])['version']
+
+
+def unpack_blockchain(s: Packed) -> block.Blockchain:
     """Unapck blockchain from JSON string with b64 for bytes."""
-    blocks = json.loads(s)
-    return [_unpack_block(block) for block in blocks]
+    return list(iter_blockchain(s))
+
+
+def iter_blockchain(s: Packed) -> Iterator[block.Block]:
+    """Unpack blocks of a packed blockchain one by one."""
+    if wire_version(s) == 1:
+        for b in json.loads(s):
+            yield _unpack_block(b)
+        return
+
+    lines: Sequence[Packed] = s.splitlines()
+    for hdr, txns in zip(lines[1::2], lines[2::2]):
+        yield unpack_block_lines(hdr, txns)
+
+
+def unpack_block_lines(hdr: Packed, txns: Packed) -> block.Block:
+    """Unpack block from its header and txns lines (version 2)."""
+    return {'header': _unpack_header(json.loads(hdr)),
+            'txns': [_unpack_txn(txn) for txn in json.loads(txns)]}
 
 
 def _unpack_block(s: str) -> block.Block:
-    """Unpack block from JSON string with b64 for bytes."""
+    """Unpack block from JSON string with b64 for bytes (version 1)."""
     block = json.loads(s)
-    hdr, txns = block['header'], block['txns']
-    return {'header': {'timestamp': s2b(hdr['timestamp']),
-                       'previous_hash': s2b(hdr['previous_hash']),
-                       'nonce': s2b(hdr['nonce']),
-                       'merkle_root': s2b(hdr['merkle_root']),
-                       'this_hash': s2b(hdr['this_hash'])
-                       },
-            'txns': [unpack_txn(txn) for txn in txns]
+    return {'header': _unpack_header(block['header']),
+            'txns': [unpack_txn(txn) for txn in block['txns']]
             }
 
 
+def unpack_block_header(s: str) -> block.BlockHeader:
+    """Unpack block header from JSON string with b64 for bytes."""
+    return _unpack_header(json.loads(s))
+
+
+def _unpack_header(hdr: dict) -> block.BlockHeader:
+    """Block header from decoded JSON object with b64 for bytes."""
+    return {'timestamp': s2b(hdr['timestamp']),
+            'previous_hash': s2b(hdr['previous_hash']),
+            'nonce': s2b(hdr['nonce']),
+            'merkle_root': s2b(hdr['merkle_root']),
+            'this_hash': s2b(hdr['this_hash'])
+            }
+
+
+def unpack_blockchain_headers(s: Packed) -> List[block.BlockHeader]:
+    """Unpack only the headers of a packed blockchain (txns stay packed).
+    In version 2, txn lines are not parsed at all.
+    """
+    if wire_version(s) == 1:
+        return [_unpack_header(json.loads(b)['header']) for b in json.loads(s)]
+    return [_unpack_header(json.loads(hdr)) for hdr in s.splitlines()[1::2]]
+
+
+################################################################################
+# Headers & Bodies (headers-first sync)
+
+
+def pack_headers(headers: List[block.BlockHeader]) -> str:
+    """Pack header chain to JSON string with b64 for bytes."""
+    return json.dumps([pack_block_header(hdr) for hdr in headers])
+
+
+def unpack_headers(s: str) -> List[block.BlockHeader]:
+    """Unpack header chain from JSON string with b64 for bytes."""
+    return [unpack_block_header(hdr) for hdr in json.loads(s)]
+
+
+def pack_hashes(hs: List[hash.Hash]) -> List[str]:
+    """Pack hashes to b64 strings."""
+    return [b2s(h) for h in hs]
+
+
+def unpack_hashes(ss: List[str]) -> List[hash.Hash]:
+    """Unpack hashes from b64 strings."""
+    return [s2b(s) for s in ss]
+
+
+def pack_body(b: block.Block, version: int = WIRE_VERSION) -> str:
+    """Pack block body: block hash and txns."""
+    if version == 1:
+        return json.dumps({'hash': b2s(b['header']['this_hash']),
+                           'txns': [pack_txn(txn) for txn in b['txns']]})
+    return json.dumps({'version': version,
+                       'hash': b2s(b['header']['this_hash']),
+                       'txns': [_pack_txn(txn) for txn in b['txns']]})
+
+
+def unpack_body(s: Packed) -> Tuple[hash.Hash, block.Transactions]:
+    """Unpack block body: block hash and txns."""
+    body = json.loads(s)
+    f = unpack_txn if body.get('version', 1) == 1 else _unpack_txn
+    return s2b(body['hash']), [f(txn) for txn in body['txns']]
+
+
+def unpack_body_hash(s: str) -> hash.Hash:
+    """Unpack only the block hash of a packed block body."""
+    return s2b(json.loads(s)['hash'])
+
+
+################################################################################
+# Compact Blocks
+
+
+def pack_compact_block(hdr: block.BlockHeader, short_ids: List[bytes]) -> str:
+    """Pack compact block: header and short txn ids."""
+    return json.dumps({'header': pack_block_header(hdr),
+                       'short_ids': [b2s(s) for s in short_ids]})
+
+
+def unpack_compact_block(s: str) -> Tuple[block.BlockHeader, List[bytes]]:
+    """Unpack compact block: header and short txn ids."""
+    compact = json.loads(s)
+    return (unpack_block_header(compact['header']),
+            [s2b(s) for s in compact['short_ids']])
+
+
+def pack_txns(txns: List[transaction.Transaction]) -> List[str]:
+    """Pack txns to JSON strings."""
+    return [pack_txn(txn) for txn in txns]
+
+
+def unpack_txns(ss: List[str]) -> List[transaction.Transaction]:
+    """Unpack txns from JSON strings."""
+    return [unpack_txn(s) for s in ss]
+
+
+################################################################################
+# Checkpoints
+
+
+def pack_checkpoints(checkpoints: block.Checkpoints,
+                     pretty: bool = False) -> str:
+    """Pack checkpoints to JSON string with b64 for hashes."""
+    return json_dumps({str(height): b2s(h)
+                       for height, h in sorted(checkpoints.items())}, pretty)
+
+
+def unpack_checkpoints(s: str) -> block.Checkpoints:
+    """Unpack checkpoints from JSON string with b64 for hashes."""
+    return {int(height): s2b(h) for height, h in json.loads(s).items()}
+
+
+################################################################################
+# Mempool
+
+
+def pack_mempool(entries: List[mempool.Entry]) -> str:
+    """Pack mempool entries to JSON lines, one per entry, in order."""
+    return ''.join(json.dumps({'pair': pack_txn_pair(e.txn_pair),
+                               'size': e.size,
+                               'priority': e.priority,
+                               'time': e.time}) + '\n'
+                   for e in entries)
+
+
+def unpack_mempool(s: str) -> List[mempool.Entry]:
+    """Unpack mempool entries from JSON lines."""
+    entries = []
+    for i, line in enumerate(s.splitlines()):
+        e = json.loads(line)
+        entries.append(mempool.Entry(i, unpack_txn_pair(e['pair']), e['size'],
+                                     e['priority'], e['time']))
+    return entries
+
+
 ################################################################################
 # Helpers
 
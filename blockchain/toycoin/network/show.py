@@ -1,9 +1,9 @@
 """Helpers for converting objects sent over network to strings.
 """
 
-from toycoin import block, transaction # type: ignore
+from toycoin import block, hash, transaction # type: ignore
 from toycoin.network import serialize # type: ignore
-from typing import List # type: ignore
+from typing import Dict, List, Optional, Set # type: ignore
 
 
 ################################################################################
@@ -31,31 +31,105 @@ def show_tokens(tokens: List[transaction.Token]) -> str:
 ################################################################################
 
 
-def show_blockchain(chain: block.Blockchain) -> str:
-    """Return string of blockchain."""
+def show_blockchain(chain: block.Blockchain,
+                    interval: int = block.BLOCK_INTERVAL,
+                    index: Optional[block.ChainIndex] = None,
+                    registry: Optional[block.ValidatedBlocks] = None) -> str:
+    """Return string of blockchain. Txn hashes are taken from the index, and
+    blocks in registry are not validated again, if given.
+    """
     txn_count = sum(len(b['txns']) for b in chain)
-    valid = block.valid_blockchain(chain)
+    valid = block.valid_blockchain(chain, interval, None, registry)
     stats = f'Blocks: {len(chain)} | Total Txns: {txn_count} | Valid: {valid}'
 
     s = f'\n{"-" * 80}\nBlockchain\n{stats}\n'
 
     for i, b in enumerate(chain):
         hdr_s = serialize.pack_block_header(b['header'], True, True)
-        txn_hashes_s = show_txn_hashes(b['txns'])
+        txn_hashes_s = show_txn_hashes(b['txns'],
+                                       index.txn_hashes(b) if index else None)
         s += f'\nBlock {i} Header:\n{hdr_s}'
         s += f'\nTxns Hashes:\n{txn_hashes_s}'
 
     return s
 
 
-def show_txn_hashes(txns: List[transaction.Transaction]) -> str:
-    """Return string of (previous hashes -> this hash) for txn."""
+class ChainSummary:
+    """Summary renderer for a chain received over and over, e.g. by the
+    listener. Shows the chain's size and the blocks new since the last
+    render, at most max_blocks of them. Validity is cached by block hash:
+    blocks known valid are assumed valid (as checkpoints) when validating a
+    longer chain, and a chain seen before is not validated again.
+    """
+
+    def __init__(self,
+                 interval: int = block.BLOCK_INTERVAL,
+                 max_blocks: int = 3):
+        self.interval = interval
+        self.max_blocks = max_blocks
+        self.valid: Dict[hash.Hash, bool] = {} # chain tip -> verdict
+        self.shown: Set[hash.Hash] = set() # blocks of the last render
+
+
+    def valid_chain(self, chain: block.Blockchain) -> bool:
+        """Validity of chain, validating only blocks not known valid."""
+        hs = [b['header']['this_hash'] for b in chain]
+        if not hs:
+            return True
+        if hs[-1] not in self.valid:
+            known = next((i for i in range(len(hs) - 2, -1, -1)
+                          if self.valid.get(hs[i])), None)
+            checkpoints = {} if known is None else {known: hs[known]}
+            self.valid[hs[-1]] = block.valid_blockchain(chain, self.interval,
+                                                        checkpoints)
+        return self.valid[hs[-1]]
+
+
+    def render(self, chain: block.Blockchain) -> str:
+        """Return summary string of blockchain."""
+        hs = [b['header']['this_hash'] for b in chain]
+        fork = next((i for i, h in enumerate(hs) if h not in self.shown),
+                    len(hs))
+        self.shown = set(hs)
+
+        txn_count = sum(len(b['txns']) for b in chain)
+        valid = self.valid_chain(chain)
+        stats = (f'Blocks: {len(chain)} | Total Txns: {txn_count} | '
+                 f'Valid: {valid} | New: {len(chain) - fork}')
+        s = f'\n{"-" * 80}\nBlockchain\n{stats}\n'
+
+        start = max(fork, len(chain) - self.max_blocks)
+        if start > fork:
+            s += f'\n... {start - fork} new blocks not shown'
+        if fork == len(chain) and chain: # nothing new, show the tip
+            start = len(chain) - 1
+        for i in range(start, len(chain)):
+            hdr_s = serialize.pack_block_header(chain[i]['header'], True, True)
+            s += f'\nBlock {i} Header ({len(chain[i]["txns"])} txns):\n{hdr_s}'
+
+        return s
+
+
+def show_txn_hashes(txns: List[transaction.Transaction],
+                    hashes: Optional[List[hash.Hash]] = None) -> str:
+    """Return string of (previous hashes -> this hash) for txn. Txn hashes
+    are computed, unless given.
+    """
     b2s = serialize.get_b2s(True)
+    if hashes is None:
+        hashes = [transaction.hash_txn(txn) for txn in txns]
 
     prev_to_str = lambda hs: ', '.join(f'{b2s(h)}' for h in hs)
-    this_to_str = lambda t: f'{b2s(transaction.hash_txn(t))}'
 
-    s = '\n'.join(f'{prev_to_str(txn["previous_hashes"])} -> {this_to_str(txn)}'
-                  for txn in txns)
+    s = '\n'.join(f'{prev_to_str(txn["previous_hashes"])} -> {b2s(h)}'
+                  for txn, h in zip(txns, hashes))
 
     return s
+
+
+def show_headers(headers: List[block.BlockHeader]) -> str:
+    """Return string of header chain (length and tip)."""
+    if not headers:
+        return 'Headers: 0'
+    tip = serialize.pack_block_header(headers[-1], True, True)
+    return f'Headers: {len(headers)} | Tip:\n{tip}'
@@ -0,0 +1,159 @@
+"""Headers-first chain synchronization.
+Peers announce their chain as a list of block headers. A header chain with
+more cumulative work than ours, and valid from its headers alone (links,
+proof of work, timestamps, checkpoints), becomes the sync candidate. Only
+the block bodies we don't already have are then requested, a few at a time,
+and the full chain is assembled once they have all arrived.
+"""
+
+
+from toycoin import block, hash # type: ignore
+from typing import Dict, List, Optional # type: ignore
+
+
+################################################################################
+
+
+class HeaderSync:
+    """Candidate header chain, and the bodies fetched for it so far."""
+
+    def __init__(self,
+                 max_in_flight: int = 8,
+                 timeout: float = 10,
+                 max_requests: int = 3):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout # seconds before a body is requested again
+        self.max_requests = max_requests # per body, before giving up
+        self.headers: List[block.BlockHeader] = []
+        self.work = 0 # cumulative work of the candidate
+        self.index: Dict[hash.Hash, block.BlockHeader] = {}
+        self.peer = '' # peer that announced the candidate
+        self.bodies: Dict[hash.Hash, block.Transactions] = {}
+        self.in_flight: Dict[hash.Hash, float] = {} # hash -> time requested
+        self.requested: Dict[hash.Hash, int] = {} # hash -> times requested
+
+
+    def heavier(self, work: int, chain_work: int) -> bool:
+        """Work is more than both that of our chain and of the current
+        candidate.
+        """
+        return work > max(chain_work, self.work)
+
+
+    def start(self,
+              headers: List[block.BlockHeader],
+              work: int,
+              chain_work: int,
+              peer: str = ''
+              ) -> bool:
+        """Make (already validated) headers, of the given cumulative work,
+        the candidate if still heavier than our chain (of chain_work).
+        Bodies fetched for blocks shared with the old candidate are kept.
+        """
+        if not self.heavier(work, chain_work):
+            return False
+        self.headers = headers
+        self.work = work
+        self.index = {hdr['this_hash']: hdr for hdr in headers}
+        self.peer = peer
+        self.bodies = {h: txns for h, txns in self.bodies.items()
+                       if h in self.index}
+        self.in_flight = {h: t for h, t in self.in_flight.items()
+                          if h in self.index}
+        self.requested = {h: n for h, n in self.requested.items()
+                          if h in self.index}
+        return True
+
+
+    def header(self, h: hash.Hash) -> Optional[block.BlockHeader]:
+        """Candidate header with block hash h, if any."""
+        return self.index.get(h)
+
+
+    def missing(self, chain: block.Blockchain) -> List[hash.Hash]:
+        """Hashes of candidate blocks that are neither in chain nor fetched."""
+        return [hdr['this_hash']
+                for hdr in self.headers[fork_height(self.headers, chain):]
+                if hdr['this_hash'] not in self.bodies]
+
+
+    def requests(self,
+                 chain: block.Blockchain,
+                 chain_work: int,
+                 now: float
+                 ) -> List[hash.Hash]:
+        """Missing bodies to request now, keeping at most max_in_flight
+        requests outstanding; requests older than timeout are repeated.
+        A candidate no heavier than chain (of chain_work), or with a body
+        still missing after max_requests requests, is dropped.
+        """
+        if self.work <= chain_work:
+            self.clear()
+            return []
+        self.in_flight = {h: t for h, t in self.in_flight.items()
+                          if now - t < self.timeout}
+        hs = [h for h in self.missing(chain) if h not in self.in_flight]
+        hs = hs[:max(0, self.max_in_flight - len(self.in_flight))]
+        if any(self.requested.get(h, 0) >= self.max_requests for h in hs):
+            self.clear() # peer is not sending bodies, e.g. it switched chain
+            return []
+        for h in hs:
+            self.in_flight[h] = now
+            self.requested[h] = self.requested.get(h, 0) + 1
+        return hs
+
+
+    def expect(self, h: hash.Hash, now: float):
+        """Mark body h as on its way by other means (e.g. a compact block
+        waiting for missing txns), so it is only requested after timeout.
+        """
+        if h in self.index and h not in self.bodies:
+            self.in_flight[h] = now
+
+
+    def add_body(self, h: hash.Hash, txns: block.Transactions) -> bool:
+        """Store body of candidate block (already checked against its
+        header's Merkle root). Returns False if it was not wanted.
+        """
+        if h not in self.index or h in self.bodies:
+            return False
+        self.bodies[h] = txns
+        self.in_flight.pop(h, None)
+        return True
+
+
+    def complete(self, chain: block.Blockchain) -> Optional[block.Blockchain]:
+        """Full candidate chain, if all its bodies have been fetched; the
+        candidate is then cleared.
+        """
+        if not self.headers or self.missing(chain):
+            return None
+        n = fork_height(self.headers, chain)
+        blocks = chain[:n] + [{'header': hdr,
+                               'txns': self.bodies[hdr['this_hash']]}
+                              for hdr in self.headers[n:]]
+        self.clear()
+        return blocks
+
+
+    def clear(self):
+        """Drop the candidate and its bodies."""
+        self.headers = []
+        self.work = 0
+        self.index = {}
+        self.peer = ''
+        self.bodies = {}
+        self.in_flight = {}
+        self.requested = {}
+
+
+def fork_height(headers: List[block.BlockHeader],
+                chain: block.Blockchain
+                ) -> int:
+    """Number of leading blocks headers and chain have in common."""
+    n = 0
+    for hdr, b in zip(headers, chain):
+        if hdr['this_hash'] != b['header']['this_hash']:
+            break
+        n += 1
+    return n
@@ -12,7 +12,7 @@ import argparse # type: ignore
 import random # type: ignore
 from toycoin import transaction, wallet, signature # type: ignore
 from toycoin.network import serialize # type: ignore
-from toycoin.network.msg_protocol import send_msg # type: ignore
+from toycoin.network.msg_protocol import FrameReader, FrameWriter, hello, subscribe # type: ignore
 from typing import List, Tuple # type: ignore
 import uuid # type: ignore
 
@@ -31,24 +31,26 @@ async def main(args):
     """Transaction oracle main loop."""
     me = uuid.uuid4().hex[:8]
     print(f'Starting up {me}: Transaction Oracle')
-    reader, writer = await asyncio.open_connection(
+    reader, stream = await asyncio.open_connection(
         host=args.host, port=args.port)
-    print(f'I am {writer.get_extra_info("sockname")}')
+    print(f'I am {stream.get_extra_info("sockname")}')
+    writer = FrameWriter(stream)
+    await hello(FrameReader(reader), writer)
 
     channel = b'/connect'
-    await send_msg(writer, channel)
+    await subscribe(writer, channel)
 
     chan = args.channel.encode()
     try:
         txn_pairs, state = init_state()
         while True:
-            await asyncio.sleep(random.randint(args.min_interval,
+            await asyncio.sleep(random.uniform(args.min_interval,
                                                args.max_interval))
             try:
                 for txn_pair in txn_pairs:
                     data = b'TXN ' + serialize.pack_txn_pair(txn_pair).encode()
-                    await send_msg(writer, chan)
-                    await send_msg(writer, data)
+                    writer.write(chan, data)
+                await writer.flush()
                 txn_pairs, state = update_state(state)
 
             except OSError:
@@ -56,8 +58,8 @@ async def main(args):
                 break
 
     except asyncio.CancelledError:
-        writer.close()
-        await writer.wait_closed()
+        stream.close()
+        await stream.wait_closed()
 
 
 ################################################################################
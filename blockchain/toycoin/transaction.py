@@ -3,12 +3,17 @@
 Transactions consume and produce tokens, which are unique, immutable
 stores of value that reference transactions from which they were
 produced.
+
+Version 1 txns (with no version field) carry two signatures, over the
+spent txn hashes and the receiver, and over the spent txn hashes and the
+sender. Version 2 txns carry one signature, over a canonical digest of all
+their other fields. Both are accepted; send makes version 2 txns.
 """
 
 from cryptography.hazmat.primitives.asymmetric import rsa # type: ignore
 from toycoin import hash # type: ignore
 from toycoin import signature, utils # type: ignore
-from typing import List, Optional, Tuple, TypedDict # type: ignore
+from typing import List, NotRequired, Optional, Tuple, TypedDict # type: ignore
 
 
 ################################################################################
@@ -16,15 +21,21 @@ from typing import List, Optional, Tuple, TypedDict # type: ignore
 
 Address = bytes
 
+TXN_VERSION = 2 # made by send
+
+TXN_VERSIONS = [1, 2]
+
 
 class Transaction(TypedDict):
+    version: NotRequired[int] # version 2 on
     previous_hashes: List[hash.Hash]
     receiver: Address
     receiver_value: int
-    receiver_signature: signature.Signature
+    receiver_signature: NotRequired[signature.Signature] # version 1
     sender: Address
     sender_change: int
-    sender_signature: signature.Signature
+    sender_signature: NotRequired[signature.Signature] # version 1
+    signature: NotRequired[signature.Signature] # version 2 on
 
 
 class Token(TypedDict):
@@ -44,9 +55,10 @@ def send(receiver_pub: bytes,
          sender_pub: bytes,
          sender_priv: rsa.RSAPrivateKey,
          send_value: int,
-         tokens: List[Token]
+         tokens: List[Token],
+         version: int = TXN_VERSION
          ) -> Optional[TxnPair]:
-    """Generate a send transaction.
+    """Generate a send transaction, of the given txn version.
     Returns None if token value is insufficient, and provides change if
     token value is greater than the send value.
     """
@@ -57,16 +69,26 @@ def send(receiver_pub: bytes,
 
     hs = [token['txn_hash'] for token in tokens]
     txn : Transaction
-    txn = {'previous_hashes': hs,
-           'receiver': receiver_pub,
-           'receiver_value': send_value,
-           'receiver_signature': signature.sign(sender_priv,
-                                                b''.join(hs) + receiver_pub),
-           'sender': sender_pub,
-           'sender_change': sum_value - send_value,
-           'sender_signature': signature.sign(sender_priv,
-                                              b''.join(hs) + sender_pub)
-           }
+    if version == 1:
+        txn = {'previous_hashes': hs,
+               'receiver': receiver_pub,
+               'receiver_value': send_value,
+               'receiver_signature': signature.sign(
+                   sender_priv, b''.join(hs) + receiver_pub),
+               'sender': sender_pub,
+               'sender_change': sum_value - send_value,
+               'sender_signature': signature.sign(
+                   sender_priv, b''.join(hs) + sender_pub)
+               }
+    else:
+        txn = {'version': version,
+               'previous_hashes': hs,
+               'receiver': receiver_pub,
+               'receiver_value': send_value,
+               'sender': sender_pub,
+               'sender_change': sum_value - send_value
+               }
+        txn['signature'] = signature.sign(sender_priv, txn_digest(txn))
 
     return (tokens, txn)
 
@@ -79,22 +101,28 @@ def send(receiver_pub: bytes,
 COINBASE = hash.hash(b'COINBASE')
 
 
-def valid_token(txn: Transaction, token: Token) -> bool:
-    """Verify that token matches its parent transaction."""
-    if token['owner'] == txn['receiver']:
-        valid_val = token['value'] == txn['receiver_value']
-        valid_sig = token['signature'] == txn['receiver_signature']
-    else:
-        valid_val = token['value'] == txn['sender_change']
-        valid_sig = token['signature'] == txn['sender_signature']
+def valid_token(txn: Transaction,
+                token: Token,
+                txn_hash: Optional[hash.Hash] = None
+                ) -> bool:
+    """Verify that token matches its parent transaction (whose hash may be
+    given, if known).
+    """
+    to_receiver = token['owner'] == txn['receiver']
+    valid_val = token['value'] == (txn['receiver_value'] if to_receiver else
+                                   txn['sender_change'])
+    valid_sig = token['signature'] == token_signature(txn, to_receiver)
 
-    return (token['txn_hash'] == hash_txn(txn) and
+    return (token['txn_hash'] == (hash_txn(txn) if txn_hash is None
+                                  else txn_hash) and
             valid_val and
             valid_sig)
 
 
 def valid_txn(tokens: List[Token], txn: Transaction) -> bool:
-    """Validate transaction signatures."""
+    """Validate transaction signatures (one for version 2 on, two for
+    version 1).
+    """
     # coinbase transaction backdoor
     if not tokens and txn['sender'] == COINBASE: return True
 
@@ -103,14 +131,17 @@ def valid_txn(tokens: List[Token], txn: Transaction) -> bool:
     if not owners or len(set(owners)) > 1:
         return False
 
-    owner = owners[0]
-    hs = b''.join(txn['previous_hashes'])
+    owner = signature.load_pub_key_bytes(owners[0])
+    version = txn_version(txn)
+    if version not in TXN_VERSIONS:
+        return False
+    if version >= 2:
+        return signature.verify(txn['signature'], owner, txn_digest(txn))
 
-    v1 = signature.verify(txn['receiver_signature'],
-                          signature.load_pub_key_bytes(owner),
+    hs = b''.join(txn['previous_hashes'])
+    v1 = signature.verify(txn['receiver_signature'], owner,
                           hs + txn['receiver'])
-    v2 = signature.verify(txn['sender_signature'],
-                          signature.load_pub_key_bytes(owner),
+    v2 = signature.verify(txn['sender_signature'], owner,
                           hs + txn['sender'])
 
     return v1 and v2
@@ -125,8 +156,58 @@ def sum_tokens(tokens: List[Token]) -> int:
     return sum(token['value'] for token in tokens)
 
 
+def txn_version(txn: Transaction) -> int:
+    """Txn format version."""
+    return txn.get('version', 1)
+
+
+def token_signature(txn: Transaction, to_receiver: bool) -> signature.Signature:
+    """Signature carried by the token txn makes for its receiver (or for its
+    sender, as change).
+    """
+    if txn_version(txn) >= 2:
+        return txn['signature']
+    return txn['receiver_signature'] if to_receiver else \
+        txn['sender_signature']
+
+
+def txn_size(txn: Transaction) -> int:
+    """Size of Transaction fields in bytes."""
+    if txn_version(txn) >= 2:
+        return (len(utils.int_to_bytes(txn['version'])) +
+                sum(len(h) for h in txn['previous_hashes']) +
+                len(txn['receiver']) +
+                len(utils.int_to_bytes(txn['receiver_value'])) +
+                len(txn['sender']) +
+                len(utils.int_to_bytes(txn['sender_change'])) +
+                len(txn['signature']))
+    return (sum(len(h) for h in txn['previous_hashes']) +
+            len(txn['receiver']) +
+            len(utils.int_to_bytes(txn['receiver_value'])) +
+            len(txn['receiver_signature']) +
+            len(txn['sender']) +
+            len(utils.int_to_bytes(txn['sender_change'])) +
+            len(txn['sender_signature']))
+
+
+def txn_digest(txn: Transaction) -> hash.Hash:
+    """Canonical digest of a version 2 (on) txn's fields, but its signature.
+    Each field is length prefixed, so different txns never share a digest.
+    """
+    fields = [utils.int_to_bytes(txn['version']),
+              utils.int_to_bytes(len(txn['previous_hashes'])),
+              *txn['previous_hashes'],
+              txn['receiver'],
+              utils.int_to_bytes(txn['receiver_value']),
+              txn['sender'],
+              utils.int_to_bytes(txn['sender_change'])]
+    return hash.hash(b''.join(len(f).to_bytes(4, 'big') + f for f in fields))
+
+
 def hash_txn(txn: Transaction) -> hash.Hash:
     """Hash Transaction."""
+    if txn_version(txn) >= 2:
+        return hash.hash(txn_digest(txn) + txn['signature'])
     return hash.hash(b''.join(txn['previous_hashes']) +
                      txn['receiver'] +
                      utils.int_to_bytes(txn['receiver_value']) +
@@ -85,10 +85,12 @@ class Wallet:
             self.wallet.append({'txn_hash': txn_hash,
                                 'owner': self.public_key,
                                 'value': txn['receiver_value'],
-                                'signature': txn['receiver_signature']})
+                                'signature': transaction.token_signature(
+                                    txn, True)})
         elif self.public_key == txn['sender']:
             if txn['sender_change'] > 0:
                 self.wallet.append({'txn_hash': txn_hash,
                                     'owner': self.public_key,
                                     'value': txn['sender_change'],
-                                    'signature': txn['sender_signature']})
+                                    'signature': transaction.token_signature(
+                                        txn, False)})